@@ -0,0 +1,303 @@
+import logging
+import threading
+import time
+import collections
+import zlib
+
+
+def parse_limits(text, value_type):
+    """
+    Parses a comma-separated list of <packet type>:<limit> items, returns
+    the dictionary packet type => limit.
+    """
+
+    limits = dict()
+
+    for item in text.split(","):
+        if item.strip() == "":
+            continue
+
+        packet_type, _, value = item.partition(":")
+        if value.strip() == "":
+            raise RuntimeError("Limit is missing: \"%s\"" % item.strip())
+
+        limits[packet_type.strip()] = value_type(value.strip())
+
+    return limits
+
+
+class AdmissionControl(object):
+    """
+    Admits the incoming requests by packet type before their handler is
+    called, so that one flooded packet type cannot take all the handler
+    threads and the transaction slot:
+      - Rate limit: a token bucket per packet type, refilled with the
+        configured number of requests per second; up to one second of
+        requests may arrive at once (rate_limited.<packet type>)
+      - Concurrency limit: maximum number of requests of the packet type
+        being handled at the same time (concurrency_limited.<packet type>)
+    The packet types without limit are always admitted.
+
+    Usage: control = AdmissionControl(rate_limits, concurrency_limits,
+                                      statistics)
+        if control.admit(packet_type):
+            try:
+                <handle the request>
+            finally:
+                control.release(packet_type)
+    """
+
+    def __init__(self, rate_limits, concurrency_limits, statistics):
+        """
+        Initializes a new instance of the admission.AdmissionControl class.
+
+        @param rate_limits packet type => requests per second
+        @param concurrency_limits packet type => requests at the same time
+        @param statistics metrics.Statistics which counts the rejections
+        """
+
+        self.__lock = threading.Lock()
+        self.__statistics = statistics
+
+        self.__buckets = {packet_type: TokenBucket(rate, max(1.0, rate))
+                          for (packet_type, rate) in rate_limits.items()}
+        self.__concurrency_limits = dict(concurrency_limits)
+        self.__running = {packet_type: 0
+                          for packet_type in concurrency_limits}
+
+    def admit(self, packet_type):
+        """
+        Returns whether the request can be handled now. An admitted request
+        must be released when it has been handled.
+        """
+
+        with self.__lock:
+            limit = self.__concurrency_limits.get(packet_type)
+            if limit is not None and self.__running[packet_type] >= limit:
+                logging.warning("Too many \"%s\" requests at the same time, "
+                                "reject", packet_type)
+                self.__statistics.increase(
+                    "concurrency_limited." + packet_type)
+                return False
+
+            bucket = self.__buckets.get(packet_type)
+            if bucket is not None and not bucket.take(time.time()):
+                logging.warning("Too many \"%s\" requests per second, "
+                                "reject", packet_type)
+                self.__statistics.increase("rate_limited." + packet_type)
+                return False
+
+            if limit is not None:
+                self.__running[packet_type] += 1
+
+            return True
+
+    def release(self, packet_type):
+        """
+        Finishes handling the admitted request.
+        """
+
+        with self.__lock:
+            if packet_type in self.__running:
+                self.__running[packet_type] -= 1
+
+
+class AdmissionQueue(object):
+    """
+    Bounded queue of the incoming packets waiting for the handler threads,
+    which protects the critical packets under overload by packet type:
+      - Packets of the sheddable packet types (e.g. read-only polls) are
+        dropped as soon as the queue is filled above the shed threshold
+        (packets_shed_low_priority).
+      - Packets of the protected packet types (e.g. elev_request_add) are
+        taken before all the other packets; when the queue is full, the
+        newest sheddable packet is dropped to make room for them
+        (packets_evicted).
+      - The other packets are dropped when the queue is full
+        (packets_shed).
+    The queue depth (queue_depth, queue_depth_max) is measured in the
+    statistics. The queue is not thread-safe, the caller holds a lock.
+
+    Usage: queue = AdmissionQueue(size, shed_threshold, sheddable_packets,
+                                  protected_packets, statistics)
+        if not queue.is_queued(address, data):
+            queued, evicted_item = queue.put(address, data, packet_type,
+                                             item)
+        received_time, address, data, item = queue.get()
+    """
+
+    def __init__(self, size, shed_threshold, sheddable_packets,
+                 protected_packets, statistics):
+        """
+        Initializes a new instance of the admission.AdmissionQueue class.
+
+        @param size Maximum number of packets in the queue
+        @param shed_threshold Queue fill ratio above which the sheddable
+                              packets are dropped
+        @param sheddable_packets Packet types shed first
+        @param protected_packets Packet types taken first
+        @param statistics metrics.Statistics which counts the dropped
+                          packets
+        """
+
+        self.__size = size
+        self.__shed_depth = shed_threshold * size
+        self.__sheddable_packets = frozenset(sheddable_packets)
+        self.__protected_packets = frozenset(protected_packets)
+        self.__statistics = statistics
+
+        # (time, address, data, packet type, item)
+        self.__queue = collections.deque()
+        self.__priority_queue = collections.deque()  # Protected packets
+        # (address, checksum, size) => data of the packets in the queue
+        self.__queued_packets = dict()
+        self.__depth_max = 0
+
+    def get_depth(self):
+        """
+        Returns the number of packets in the queue.
+        """
+
+        return len(self.__queue) + len(self.__priority_queue)
+
+    def is_queued(self, address, data):
+        """
+        Returns whether the same packet (same sender and content) is
+        waiting in the queue.
+        """
+
+        return self.__queued_packets.get(self.__get_key(address, data)) == \
+            data
+
+    def put(self, address, data, packet_type, item):
+        """
+        Puts the packet with an item of the caller (e.g. its receive
+        buffer) to the queue. Returns whether the packet has been queued,
+        and the item of the sheddable packet which has been dropped to make
+        room for it (None if there is none).
+        """
+
+        depth = self.get_depth()
+
+        if packet_type in self.__sheddable_packets and \
+                depth >= self.__shed_depth:
+            logging.warning("Packet queue is filling up, drop "
+                            "\"%s\" packet (addr = %s:%d)",
+                            packet_type, address[0], address[1])
+            self.__statistics.increase("packets_shed_low_priority")
+            return False, None
+
+        evicted_item = None
+        if depth >= self.__size:
+            if packet_type in self.__protected_packets:
+                evicted_item = self.__evict_sheddable_packet()
+
+            if evicted_item is None:
+                logging.warning("Packet queue is full, drop packet "
+                                "(addr = %s:%d)", address[0], address[1])
+                self.__statistics.increase("packets_shed")
+                return False, None
+
+        entry = (time.time(), address, data, packet_type, item)
+        if packet_type in self.__protected_packets:
+            self.__priority_queue.append(entry)
+        else:
+            self.__queue.append(entry)
+        self.__queued_packets.setdefault(self.__get_key(address, data), data)
+
+        depth = self.get_depth()
+        self.__depth_max = max(self.__depth_max, depth)
+        self.__statistics.set_gauge("queue_depth", depth)
+        self.__statistics.set_gauge("queue_depth_max", self.__depth_max)
+
+        return True, evicted_item
+
+    def get(self):
+        """
+        Takes the next packet from the queue, the protected packets first.
+        Returns the time when it has been queued, its sender, its data and
+        its item, or None if the queue is empty.
+        """
+
+        if len(self.__priority_queue) > 0:
+            queue = self.__priority_queue
+        elif len(self.__queue) > 0:
+            queue = self.__queue
+        else:
+            return None
+
+        received_time, address, data, _, item = queue.popleft()
+        self.__forget(address, data)
+
+        self.__statistics.set_gauge("queue_depth", self.get_depth())
+
+        return received_time, address, data, item
+
+    def __evict_sheddable_packet(self):
+        """
+        Drops the newest sheddable packet waiting in the queue, returns its
+        item or None if there is none.
+        """
+
+        for index in range(len(self.__queue) - 1, -1, -1):
+            _, address, data, packet_type, item = self.__queue[index]
+            if packet_type not in self.__sheddable_packets:
+                continue
+
+            del self.__queue[index]
+            self.__forget(address, data)
+
+            logging.warning("Drop \"%s\" packet for a protected packet "
+                            "(addr = %s:%d)",
+                            packet_type, address[0], address[1])
+            self.__statistics.increase("packets_evicted")
+            return item
+
+        return None
+
+    def __forget(self, address, data):
+        """
+        Forgets the packet which has left the queue, unless it is a copy of
+        another packet still waiting.
+        """
+
+        key = self.__get_key(address, data)
+        if self.__queued_packets.get(key) is data:
+            del self.__queued_packets[key]
+
+    @staticmethod
+    def __get_key(address, data):
+        """
+        Returns the key of the packet. The buffer holding the packet is not
+        hashable, the packets are compared by checksum and then by content.
+        """
+
+        return address, zlib.crc32(data), len(data)
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter.
+    All fields are public and directly accessible by the admission control.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.update_time = time.time()
+
+    def take(self, now):
+        """
+        Takes one token, returns False if the bucket is empty.
+        """
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.update_time) * self.rate)
+        self.update_time = now
+
+        if self.tokens < 1.0:
+            return False
+
+        self.tokens -= 1.0
+        return True
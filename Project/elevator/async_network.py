@@ -0,0 +1,475 @@
+import logging
+import asyncio
+import threading
+import concurrent.futures
+import time
+import network
+import codec
+import metrics
+import fragmentation
+
+
+class AsyncNetwork(network.Network):
+    """
+    Alternative implementation of the network module built on asyncio.
+    The packets are sent and received by datagram endpoints of one event loop
+    which is shared by all the AsyncNetwork instances in the process, so that
+    many logical nodes can run in one process without a thread or a blocking
+    socket per request. The packet format is the same as network.Network,
+    both implementations can communicate with each other.
+
+    The packet handlers may block on transactions, so they are called in
+    a fixed pool of handler threads. Packets arriving when all the handler
+    threads and queue slots are busy are dropped (packets_shed).
+
+    Usage: the same as network.Network. Coroutines running on the shared
+    event loop (see get_event_loop) can also use:
+        resp = await net.send_packet_async(addr, packet_type, data)
+    Replies are matched with the waiting requests by the request identifier,
+    so any number of requests can be in flight at the same time. Timeouts,
+    retransmissions and fragmentation are the same as network.Network.
+
+    The counters of the base module (circuit breakers, response cache,
+    admission, traffic) are included in get_statistics, and the gossip
+    membership is started with the UDP endpoint.
+
+    Optional configuration:
+        - network.handler_threads: number of handler threads (default 4)
+        - network.handler_queue_size: maximum number of packets waiting
+          for a handler thread (default 64)
+    """
+
+    # Event loop shared by all the instances in the process
+    __event_loop = None
+    __event_loop_lock = threading.Lock()
+
+    def __init__(self):
+        network.Network.__init__(self)
+
+        # Configurations
+        self.__port = None
+        self.__timeout = 0.0
+        self.__handler_threads = 0
+        self.__handler_queue_size = 0
+
+        # States
+        self.__server_transport = None
+        self.__client_transport = None
+        self.__executor = None
+        self.__internal_executor = None
+
+        self.__server_reassembler = None
+        self.__client_reassembler = None
+
+        # Request identifier => (future, peer address, packet type)
+        self.__waiting_replies = dict()
+        self.__handling_count = 0  # Packets being handled or waiting
+        self.__internal_count = 0  # Internal packets being handled
+
+        self.__statistics = metrics.Statistics()
+
+    def init(self, config, transaction_manager):
+        """
+        Initializes the network module and opens the endpoint for sending
+        packets.
+        """
+
+        network.Network.init(self, config, transaction_manager)
+
+        logging.debug("Start initializing asyncio network module")
+
+        self.__port = config.get_int("network", "port")
+        self.__timeout = config.get_float("network", "timeout", 0.5)
+        self.__handler_threads = config.get_int(
+            "network", "handler_threads", 4)
+        self.__handler_queue_size = config.get_int(
+            "network", "handler_queue_size", 64)
+
+        reassembly_timeout = config.get_float(
+            "network", "reassembly_timeout", self.__timeout)
+        reassembly_memory = config.get_int(
+            "network", "reassembly_memory", 1 << 20)
+        self.__server_reassembler = fragmentation.Reassembler(
+            reassembly_timeout, reassembly_memory, self.__statistics)
+        self.__client_reassembler = fragmentation.Reassembler(
+            reassembly_timeout, reassembly_memory, self.__statistics)
+
+        self.__run(self.__open_client_endpoint())
+
+        logging.debug("Finish initializing asyncio network module")
+
+    @classmethod
+    def get_event_loop(cls):
+        """
+        Returns the event loop shared by all the instances. The event loop
+        runs in its own thread and is created at the first call.
+        """
+
+        with cls.__event_loop_lock:
+            if cls.__event_loop is None:
+                logging.debug("Create the network event loop")
+
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever,
+                                 daemon=True).start()
+
+                cls.__event_loop = loop
+
+            return cls.__event_loop
+
+    def start(self, tid):
+        """
+        Opens a UDP endpoint and listens to incoming packets.
+        """
+
+        logging.debug("Start activating asyncio UDP server (port = %d)",
+                      self.__port)
+
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.__handler_threads)
+        self.__internal_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=network.INTERNAL_HANDLER_THREADS)
+        self.__run(self.__open_server_endpoint())
+
+        self._start_membership()
+
+        logging.debug("Finish activating asyncio UDP server")
+
+    def get_statistics(self):
+        """
+        Returns the network counters in serializable format, those of the
+        base module included.
+        """
+
+        statistics = network.Network.get_statistics(self)
+        own_statistics = self.__statistics.get()
+
+        # The same counter can be increased by both (e.g. packets_received)
+        for (name, value) in own_statistics["counters"].items():
+            statistics["counters"][name] = \
+                statistics["counters"].get(name, 0) + value
+        statistics["gauges"].update(own_statistics["gauges"])
+        statistics["samples"].update(own_statistics["samples"])
+
+        return statistics
+
+    def send_packet(self, addr, packet_type, data):
+        """
+        Sends the packet to other node and waits for the reply. See
+        network.Network.send_packet. This function must not be called
+        from the event loop thread, use send_packet_async instead.
+        """
+
+        return self.__run(self.send_packet_async(addr, packet_type, data))
+
+    def send_packets(self, packet_list, timeout=None, busy=False):
+        """
+        Sends many packets at the same time and waits for the replies until
+        the same deadline. See network.Network.send_packets.
+        """
+
+        return self.__run(
+            self.send_packets_async(packet_list, timeout, busy))
+
+    async def send_packets_async(self, packet_list, timeout=None,
+                                 busy=False):
+        """
+        Sends many packets at the same time without blocking the event loop.
+        See network.Network.send_packets.
+        """
+
+        return await asyncio.gather(
+            *[self.send_packet_async(addr, packet_type, data, timeout, busy)
+              for (addr, packet_type, data) in packet_list])
+
+    def _send_probes(self, packet_list, timeout):
+        """
+        Sends the probes of the gossip membership and waits for the replies
+        until the timeout. See network.Network._send_probes.
+        """
+
+        return self.__run(self.__send_probes_async(packet_list, timeout))
+
+    async def __send_probes_async(self, packet_list, timeout):
+        """
+        Sends the probes of the gossip membership at the same time.
+        """
+
+        return await asyncio.gather(
+            *[self.send_packet_async(addr, packet_type, data, timeout,
+                                     probe=True)
+              for (addr, packet_type, data) in packet_list])
+
+    async def send_packet_async(self, addr, packet_type, data, timeout=None,
+                                busy=False, probe=False):
+        """
+        Sends the packet to other node without blocking the event loop.
+        Returns the response data, or False if anything goes wrong.
+
+        @param timeout time to wait for the reply in seconds
+                       (default: network timeout), the request to a fast
+                       node may fail earlier
+        @param busy response if the receiver has not admitted the request
+                    because it is busy (see network.Network.send_packets)
+        @param probe whether the request is a gossip probe, which is sent
+                     once without the health of the peer (see
+                     network.Network._send_probes)
+        """
+
+        logging.debug(
+            "Start sending packet (addr = %s:%d, packet_type = \"%s\")",
+            addr[0], addr[1], packet_type)
+
+        # Fails immediately if the node is considered dead
+        peer = self._get_peer_health(addr)
+        if not probe and not peer.allow_request():
+            logging.debug("Peer is unavailable, drop the packet "
+                          "(addr = %s:%d, packet_type = \"%s\")",
+                          addr[0], addr[1], packet_type)
+            self.__statistics.increase("requests_rejected")
+            return False
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        request_id = self._next_request_id()
+        self.__waiting_replies[request_id] = (future, addr, packet_type)
+
+        if timeout is None:
+            timeout = self.__timeout
+        deadline = loop.time() + timeout
+        if probe:
+            retries_left = 0
+            wait_time = timeout
+        else:
+            retries_left = self._get_retransmit_attempts(packet_type)
+            wait_time = peer.get_timeout()
+        traffic = self._get_traffic()
+
+        try:
+            packet_bytes = self._encode_request(request_id, packet_type, data)
+            self.__sendto(self.__client_transport, packet_bytes, addr)
+            self.__statistics.increase("packets_sent")
+            traffic.on_request_sent(addr, packet_type, len(packet_bytes))
+            sent_time = loop.time()
+
+            logging.debug("Wait for reply from server")
+            while True:
+                wait_time = min(wait_time, deadline - loop.time())
+
+                try:
+                    resp_data = await asyncio.wait_for(
+                        asyncio.shield(future), max(0.0, wait_time))
+                    break
+                except asyncio.TimeoutError:
+                    if retries_left == 0 or loop.time() >= deadline:
+                        raise
+
+                # Sends the same request again
+                retries_left -= 1
+                wait_time = self._get_retransmit_timeout(wait_time)
+                sent_time = None
+                self.__sendto(self.__client_transport, packet_bytes, addr)
+                self.__statistics.increase("retransmissions")
+                traffic.on_request_sent(addr, packet_type, len(packet_bytes))
+
+            if probe:
+                pass  # A probe does not change the health of the peer
+            elif resp_data is network.BUSY:
+                peer.on_success()
+                logging.warning("Receiver is busy (addr = %s:%d, "
+                                "packet_type = \"%s\")",
+                                addr[0], addr[1], packet_type)
+                self.__statistics.increase("busy_replies")
+                resp_data = busy
+            else:
+                peer.on_success()
+                rtt = None
+                if sent_time is not None:  # Karn's algorithm
+                    rtt = loop.time() - sent_time
+                    peer.add_rtt_sample(rtt)
+                traffic.on_reply_received(addr, packet_type, rtt)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            logging.error(
+                "Cannot receive reply! (addr = %s:%d, packet_type = \"%s\")",
+                addr[0], addr[1], packet_type)
+            self.__statistics.increase("timeouts")
+            traffic.on_request_timeout(addr, packet_type)
+            if not probe:
+                peer.on_failure()
+            resp_data = False
+        finally:
+            self.__waiting_replies.pop(request_id, None)
+
+        logging.debug("Finish sending packet")
+
+        return resp_data
+
+    def __run(self, coroutine):
+        """
+        Runs the coroutine on the event loop and waits for the result.
+        """
+
+        loop = self.get_event_loop()
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def __open_client_endpoint(self):
+        """
+        Opens the endpoint which sends the packets and receives the replies.
+        """
+
+        loop = asyncio.get_running_loop()
+        self.__client_transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramProtocol(self.__on_reply_received),
+            local_addr=("0.0.0.0", 0))
+
+    async def __open_server_endpoint(self):
+        """
+        Opens the endpoint which receives the incoming packets.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                self.__server_transport, _ = \
+                    await loop.create_datagram_endpoint(
+                        lambda: DatagramProtocol(self.__on_packet_received),
+                        local_addr=("0.0.0.0", self.__port))
+                break
+            except OSError:
+                logging.error("Socket cannot bind the address "
+                              "(port = %d) => Retry", self.__port)
+
+                await asyncio.sleep(1)
+
+    def __sendto(self, transport, packet_bytes, addr):
+        """
+        Sends the packet from the endpoint, in fragments if necessary. The
+        datagrams are impaired by the rule of the peer (see get_impairment).
+        """
+
+        loop = asyncio.get_running_loop()
+        for datagram in self._split_packet(packet_bytes):
+            self.get_impairment().send(datagram, addr, transport.sendto,
+                                       loop.call_later)
+
+    def __on_reply_received(self, data, address):
+        """
+        Called in the event loop when a reply has been received. The reply
+        is given to the request with the same identifier.
+        """
+
+        if fragmentation.is_fragment(data):
+            data = self.__client_reassembler.add(address, data)
+            if data is None:
+                return
+
+        reply = self._decode_reply(address, data)
+        if reply is None:
+            return
+
+        request_id, resp_data = reply
+        future, addr, packet_type = self.__waiting_replies.pop(
+            request_id, (None, None, None))
+
+        if future is None or future.done():
+            # The request has timed out
+            logging.warning("Late reply, drop it (addr = %s:%d)",
+                            address[0], address[1])
+            self.__statistics.increase("late_replies_dropped")
+            return
+
+        self._get_traffic().on_bytes_received(addr, packet_type, len(data))
+        future.set_result(resp_data)
+
+    def __on_packet_received(self, data, address):
+        """
+        Called in the event loop when a packet has been received. The packet
+        is handled in the handler threads.
+        """
+
+        if fragmentation.is_fragment(data):
+            data = self.__server_reassembler.add(address, data)
+            if data is None:
+                return
+
+        self.__statistics.increase("packets_received")
+
+        # The network's own packets (e.g. gossip probes) do not wait behind
+        # the packet handlers
+        internal = self._is_internal_packet(codec.peek_packet_type(data))
+        if internal:
+            count = self.__internal_count
+        else:
+            count = self.__handling_count - self.__handler_threads
+
+        if count >= self.__handler_queue_size:
+            logging.warning("Too many packets are being handled, "
+                            "drop packet (addr = %s:%d)",
+                            address[0], address[1])
+            self.__statistics.increase("packets_shed")
+            return
+
+        if internal:
+            self.__internal_count += 1
+            executor = self.__internal_executor
+        else:
+            self.__handling_count += 1
+            self.__statistics.set_gauge("queue_depth", self.__handling_count)
+            executor = self.__executor
+
+        loop = asyncio.get_running_loop()
+        received_time = time.time()
+
+        future = loop.run_in_executor(
+            executor, self._process_packet, address, data)
+        future.add_done_callback(
+            lambda f: self.__on_packet_handled(f, address, received_time,
+                                               internal))
+
+    def __on_packet_handled(self, future, address, received_time,
+                            internal):
+        """
+        Called in the event loop when the packet handler has finished.
+        Sends the reply back to the sender.
+        """
+
+        if internal:
+            self.__internal_count -= 1
+        else:
+            self.__handling_count -= 1
+            self.__statistics.set_gauge("queue_depth", self.__handling_count)
+        self.__statistics.add_sample(
+            "handler_time", time.time() - received_time)
+
+        if future.exception() is not None:
+            logging.error("Packet handler has failed! (addr = %s:%d, "
+                          "error = %s)", address[0], address[1],
+                          future.exception())
+            return
+
+        resp = future.result()
+        if resp is not None:
+            logging.debug("Answer the client")
+            try:
+                self.__sendto(self.__server_transport, resp, address)
+            except ValueError:
+                logging.error("Reply is too large! (addr = %s:%d)",
+                              address[0], address[1])
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol which forwards all the received datagrams to
+    the specified function.
+    """
+
+    def __init__(self, receive_func):
+        self.__receive_func = receive_func
+
+    def datagram_received(self, data, addr):
+        self.__receive_func(data, addr)
+
+    def error_received(self, exc):
+        logging.debug("Datagram endpoint error (error = %s)", exc)
@@ -0,0 +1,62 @@
+import threading
+
+
+class BufferPool(object):
+    """
+    Pool of reusable receive buffers, so that receiving a packet does not
+    allocate a new object. A buffer taken from the pool must be put back
+    when its content is not used anymore.
+
+    Usage: pool = BufferPool(buffer_size, max_buffers)
+        buf = pool.get()
+        size, address = sock.recvfrom_into(buf)
+        <use memoryview(buf)[:size]>
+        pool.put(buf)
+    """
+
+    def __init__(self, buffer_size, max_buffers):
+        """
+        Initializes a new instance of the buffer_pool.BufferPool class.
+
+        @param buffer_size Size of every buffer in bytes
+        @param max_buffers Maximum number of free buffers kept in the pool,
+                           the other ones are left to the garbage collector
+        """
+
+        self.__lock = threading.Lock()
+
+        self.__buffer_size = buffer_size
+        self.__max_buffers = max_buffers
+
+        self.__free_buffers = list()
+        self.__allocated_count = 0
+
+    def get(self):
+        """
+        Returns a free buffer, a new one is allocated if the pool is empty.
+        """
+
+        with self.__lock:
+            if len(self.__free_buffers) > 0:
+                return self.__free_buffers.pop()
+
+            self.__allocated_count += 1
+
+        return bytearray(self.__buffer_size)
+
+    def put(self, buf):
+        """
+        Puts the buffer back to the pool.
+        """
+
+        with self.__lock:
+            if len(self.__free_buffers) < self.__max_buffers:
+                self.__free_buffers.append(buf)
+
+    def get_allocated_count(self):
+        """
+        Returns the number of buffers allocated since the pool was created.
+        """
+
+        with self.__lock:
+            return self.__allocated_count
@@ -0,0 +1,448 @@
+import json
+import struct
+import enum
+import core
+
+
+class PacketKind(enum.IntEnum):
+    """
+    Kind of packet: request sent to a node, reply of that request or busy
+    reply of a request which has not been admitted (without data).
+    """
+
+    Request = 0
+    Reply = 1
+    Busy = 2
+
+
+class Packet(object):
+    """
+    Decoded packet, including:
+      - Kind (request/reply/busy)
+      - Packet type which determines the packet handler (replies of JSON
+        codec do not have packet type)
+      - Request identifier which matches the reply with the request (None
+        for the older JSON packet format without identifier)
+      - Packet data
+      - Codec which has decoded the packet (replies should be encoded by the
+        same codec)
+    All fields are public and directly accessible by the network module.
+    """
+
+    def __init__(self, kind, packet_type, request_id, data, codec=None):
+        self.kind = kind
+        self.packet_type = packet_type
+        self.request_id = request_id
+        self.data = data
+        self.codec = codec
+
+
+class JsonCodec(object):
+    """
+    JSON packet format.
+
+    Request:
+        {
+          "type": "packet type",
+          "data": packet_data,
+          "id": request_id
+        }
+
+    Reply:
+        {
+          "id": request_id,
+          "data": response_data
+        }
+
+    Busy reply:
+        {
+          "id": request_id,
+          "busy": true
+        }
+
+    A reply of a request without identifier is the bare response data.
+    """
+
+    name = "json"
+
+    TYPE_PREFIX = b'{"type": "'
+    PEEK_SIZE = 128
+
+    def encode(self, packet):
+        """
+        Returns the packet in bytes.
+        """
+
+        if packet.kind == PacketKind.Request:
+            obj = {"type": packet.packet_type, "data": packet.data,
+                   "id": packet.request_id}
+        elif packet.kind == PacketKind.Busy:
+            obj = {"id": packet.request_id, "busy": True}
+        elif packet.request_id is None:  # Older packet format
+            obj = packet.data
+        else:
+            obj = {"id": packet.request_id, "data": packet.data}
+
+        return json.dumps(obj).encode()
+
+    def decode(self, data):
+        """
+        Returns the decoded packet. Throws ValueError if the packet is in
+        wrong format.
+        """
+
+        try:
+            obj = json.loads(str(data, "utf-8"))
+
+            if "type" in obj:
+                return Packet(PacketKind.Request, obj["type"],
+                              obj.get("id"), obj["data"], self)
+
+            if obj.get("busy") is True:
+                return Packet(PacketKind.Busy, None, obj["id"], None, self)
+
+            return Packet(PacketKind.Reply, None, obj["id"], obj["data"],
+                          self)
+        except (KeyError, TypeError) as ex:
+            raise ValueError("Packet is not in JSON packet format") from ex
+
+    def peek_packet_type(self, data):
+        """
+        Returns the packet type of the request without decoding it, or None
+        if it cannot be found quickly (e.g. reply, other encoder).
+        """
+
+        # The packet type is the first field written by encode
+        prefix = bytes(data[:self.PEEK_SIZE])
+        if not prefix.startswith(self.TYPE_PREFIX):
+            return None
+
+        end = prefix.find(b"\"", len(self.TYPE_PREFIX))
+        if end < 0:
+            return None
+
+        try:
+            return str(prefix[len(self.TYPE_PREFIX):end], "utf-8")
+        except UnicodeDecodeError:
+            return None
+
+
+class MessageLayout(object):
+    """
+    Fixed binary layout of the request and reply data of a packet type.
+    All fields are public and directly accessible by the binary codec.
+    """
+
+    def __init__(self, type_id, request_format, encode_request,
+                 decode_request, reply_format, encode_reply, decode_reply):
+        self.type_id = type_id
+
+        self.request_struct = struct.Struct(request_format)
+        self.encode_request = encode_request
+        self.decode_request = decode_request
+
+        self.reply_struct = struct.Struct(reply_format)
+        self.encode_reply = encode_reply
+        self.decode_reply = decode_reply
+
+
+def _encode_directions(directions):
+    """
+    Returns the bit mask of the list of request directions.
+    """
+
+    mask = 0
+    for direction in directions:
+        if direction == core.Direction.Up:
+            mask |= 1
+        elif direction == core.Direction.Down:
+            mask |= 2
+        else:
+            raise ValueError("Unknown direction")
+
+    return mask
+
+
+def _decode_directions(mask):
+    """
+    Returns the list of request directions of the bit mask.
+    """
+
+    directions = list()
+    if mask & 1:
+        directions.append(int(core.Direction.Up))
+    if mask & 2:
+        directions.append(int(core.Direction.Down))
+
+    return directions
+
+
+def _check_bool(value):
+    """
+    Returns the value if it is a boolean, otherwise throws ValueError.
+    """
+
+    if not isinstance(value, bool):
+        raise ValueError("Value is not boolean")
+
+    return value
+
+
+# Binary layouts of the known packet types, the other packet types are
+# encoded in the generic format
+MESSAGE_LAYOUTS = {
+    "elev_state_get": MessageLayout(
+        1,
+        "!b",
+        lambda data: (data["floor"],),
+        lambda values: {"floor": values[0]},
+        "!bbB?",
+        lambda data: (data["position"], data["direction"],
+                      _encode_directions(data["serving_requests"]),
+                      _check_bool(data["motor_stuck"])),
+        lambda values: {"position": values[0],
+                        "direction": values[1],
+                        "serving_requests": _decode_directions(values[2]),
+                        "motor_stuck": values[3]}),
+    "elev_request_add": MessageLayout(
+        2,
+        "!bb",
+        lambda data: (data["floor"], data["direction"]),
+        lambda values: {"floor": values[0], "direction": values[1]},
+        "!?",
+        lambda data: (_check_bool(data),),
+        lambda values: values[0]),
+    "floor_request_served": MessageLayout(
+        3,
+        "!bb",
+        lambda data: (data["elevator"], data["direction"]),
+        lambda values: {"elevator": values[0], "direction": values[1]},
+        "!?",
+        lambda data: (_check_bool(data),),
+        lambda values: values[0]),
+    "floor_get_all_requests": MessageLayout(
+        4,
+        "!?",
+        lambda data: (_check_bool(data),),
+        lambda values: values[0],
+        "!??",
+        lambda data: (_check_bool(data[0]), _check_bool(data[1])),
+        lambda values: [values[0], values[1]]),
+    "elev_state_subscribe": MessageLayout(
+        5,
+        "!b",
+        lambda data: (data["floor"],),
+        lambda values: {"floor": values[0]},
+        "!bbB?",
+        lambda data: (data["position"], data["direction"],
+                      _encode_directions(data["serving_requests"]),
+                      _check_bool(data["motor_stuck"])),
+        lambda values: {"position": values[0],
+                        "direction": values[1],
+                        "serving_requests": _decode_directions(values[2]),
+                        "motor_stuck": values[3]}),
+    "floor_elev_state_push": MessageLayout(
+        6,
+        "!bbbB?",
+        lambda data: (data["elevator"], data["position"], data["direction"],
+                      _encode_directions(data["serving_requests"]),
+                      _check_bool(data["motor_stuck"])),
+        lambda values: {"elevator": values[0],
+                        "position": values[1],
+                        "direction": values[2],
+                        "serving_requests": _decode_directions(values[3]),
+                        "motor_stuck": values[4]},
+        "!?",
+        lambda data: (_check_bool(data),),
+        lambda values: values[0]),
+}
+
+
+class BinaryCodec(object):
+    """
+    Compact binary packet format.
+
+    Header (7 bytes, network byte order):
+        - Magic byte (0xB7), distinguishes it from JSON packets
+        - Flags: bit 0 set for reply, bit 1 set for generic data, bit 2 set
+          (with bit 0) for busy reply
+        - Packet type identifier (0 for types without fixed layout)
+        - Request identifier (4 bytes)
+
+    Body:
+        - Known packet types (see MESSAGE_LAYOUTS): fixed-layout fields
+        - Generic request: packet type name length (1 byte), packet type
+          name and the JSON-encoded data
+        - Generic reply: the JSON-encoded data
+        - Busy reply: empty
+    Data which does not fit the fixed layout of its packet type (e.g. False
+    reply of a failed transaction) is encoded in the generic format.
+    """
+
+    name = "binary"
+
+    MAGIC = 0xB7
+
+    FLAG_REPLY = 0x01
+    FLAG_GENERIC = 0x02
+    FLAG_BUSY = 0x04
+
+    HEADER = struct.Struct("!BBBI")
+
+    def __init__(self):
+        self.__layouts_by_id = {layout.type_id: (packet_type, layout)
+                                for (packet_type, layout)
+                                in MESSAGE_LAYOUTS.items()}
+
+    def encode(self, packet):
+        """
+        Returns the packet in bytes.
+        """
+
+        is_reply = packet.kind == PacketKind.Reply
+        flags = self.FLAG_REPLY if is_reply else 0
+        request_id = packet.request_id or 0
+
+        # Fixed layout of the known packet types
+        layout = MESSAGE_LAYOUTS.get(packet.packet_type)
+
+        if packet.kind == PacketKind.Busy:
+            type_id = layout.type_id if layout is not None else 0
+            return self.HEADER.pack(
+                self.MAGIC, self.FLAG_REPLY | self.FLAG_BUSY, type_id,
+                request_id)
+        if layout is not None:
+            try:
+                if is_reply:
+                    body = layout.reply_struct.pack(
+                        *layout.encode_reply(packet.data))
+                else:
+                    body = layout.request_struct.pack(
+                        *layout.encode_request(packet.data))
+
+                return self.HEADER.pack(
+                    self.MAGIC, flags, layout.type_id, request_id) + body
+            except (struct.error, KeyError, IndexError, TypeError,
+                    ValueError):
+                pass  # Does not fit the layout => Generic format
+
+        # Generic format
+        flags |= self.FLAG_GENERIC
+        type_id = layout.type_id if layout is not None else 0
+        body = json.dumps(packet.data).encode()
+
+        if is_reply:
+            return self.HEADER.pack(
+                self.MAGIC, flags, type_id, request_id) + body
+
+        name = packet.packet_type.encode()
+        return self.HEADER.pack(self.MAGIC, flags, type_id, request_id) + \
+            bytes([len(name)]) + name + body
+
+    def decode(self, data):
+        """
+        Returns the decoded packet. Throws ValueError if the packet is in
+        wrong format.
+        """
+
+        try:
+            magic, flags, type_id, request_id = \
+                self.HEADER.unpack_from(data)
+            if magic != self.MAGIC:
+                raise ValueError("Packet is not in binary packet format")
+
+            offset = self.HEADER.size
+            is_reply = flags & self.FLAG_REPLY
+
+            if type_id != 0:
+                packet_type, layout = self.__layouts_by_id[type_id]
+            else:
+                packet_type, layout = None, None
+
+            if is_reply and flags & self.FLAG_BUSY:
+                return Packet(PacketKind.Busy, packet_type, request_id, None,
+                              self)
+
+            if flags & self.FLAG_GENERIC:
+                if not is_reply:
+                    length = data[offset]
+                    packet_type = str(
+                        data[offset + 1:offset + 1 + length], "utf-8")
+                    offset += 1 + length
+
+                value = json.loads(str(data[offset:], "utf-8"))
+            elif is_reply:
+                value = layout.decode_reply(
+                    layout.reply_struct.unpack_from(data, offset))
+            else:
+                value = layout.decode_request(
+                    layout.request_struct.unpack_from(data, offset))
+        except (struct.error, KeyError, IndexError, TypeError,
+                AttributeError) as ex:
+            raise ValueError("Packet is not in binary packet format") from ex
+
+        kind = PacketKind.Reply if is_reply else PacketKind.Request
+        return Packet(kind, packet_type, request_id, value, self)
+
+    def peek_packet_type(self, data):
+        """
+        Returns the packet type of the request from its header without
+        decoding the body, or None if it is not a valid request.
+        """
+
+        try:
+            magic, flags, type_id, _ = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC or flags & self.FLAG_REPLY:
+                return None
+
+            if type_id != 0:
+                return self.__layouts_by_id[type_id][0]
+
+            offset = self.HEADER.size
+            length = data[offset]
+            return str(data[offset + 1:offset + 1 + length], "utf-8")
+        except (struct.error, KeyError, IndexError, UnicodeDecodeError):
+            return None
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec(),
+    BinaryCodec.name: BinaryCodec(),
+}
+
+
+def get_codec(name):
+    """
+    Returns the codec with the specified name (json/binary). Throws
+    RuntimeError if the codec does not exist.
+    """
+
+    if name not in CODECS:
+        raise RuntimeError("Unknown codec \"%s\"" % name)
+
+    return CODECS[name]
+
+
+def decode(data):
+    """
+    Decodes the packet in any supported format. The codec is determined by
+    the first byte of the packet. Throws ValueError if the packet is in
+    wrong format.
+    """
+
+    if len(data) > 0 and data[0] == BinaryCodec.MAGIC:
+        return CODECS[BinaryCodec.name].decode(data)
+
+    return CODECS[JsonCodec.name].decode(data)
+
+
+def peek_packet_type(data):
+    """
+    Returns the packet type of the request in any supported format without
+    decoding it, or None if it cannot be determined quickly.
+    """
+
+    if len(data) > 0 and data[0] == BinaryCodec.MAGIC:
+        return CODECS[BinaryCodec.name].peek_packet_type(data)
+
+    return CODECS[JsonCodec.name].peek_packet_type(data)
@@ -1,6 +1,7 @@
 import logging
 import socket
 import threading
+import time
 import ctypes
 import enum
 import module_base
@@ -8,6 +9,14 @@ import core
 import transaction
 
 
+# Command identifiers of the simulator protocol
+COMMAND_GET_BUTTON_SIGNAL = 6
+COMMAND_GET_FLOOR_SENSOR_SIGNAL = 7
+COMMAND_GET_STOP_SIGNAL = 8
+COMMAND_GET_OBSTRUCTION_SIGNAL = 9
+COMMAND_GET_INPUTS = 10  # Simulator extension, see SimulationDriver
+
+
 class DriverTarget(enum.IntEnum):
     """
     Hardware or simulator.
@@ -37,14 +46,48 @@ class Driver(module_base.ModuleBase):
         - Floor panels buttons and lights
         - An elevator panel buttons and lights
         - An elevator motor and sensors
+
+    All the inputs (buttons, floor sensor, stop and obstruction) are read
+    together by one sampling thread every driver.sample_period: the
+    simulator driver sends all the commands at once and reads all the
+    replies, so that a sample costs one round trip whatever the number of
+    floors and however many modules poll the inputs. Every sample is
+    published as an immutable DriverInputs, which get_inputs and the get_*
+    functions return without locking and without any I/O. When the motor
+    box has lost power (the stop signal is set, the stop lamp is kept off
+    for that), all the inputs read "safe" values: no button pushed, between
+    floors, no stop, no obstruction. The readers which have to react to a
+    change wait for the next sample with wait_for_inputs instead of
+    polling. If the samples keep failing (see get_sample_errors) for more
+    than driver.max_input_age, the "safe" values are published as not valid
+    (DriverInputs.valid), never an old sample.
+
+    Optional configuration:
+        - driver.input_read: pipeline (default) or batch, which reads all
+          the inputs with one command of a simulator supporting it (see
+          SimulationDriver)
+        - driver.sample_period: time between two samples of the inputs in
+          seconds (default 0.1)
+        - driver.max_input_age: maximum age of the inputs in seconds before
+          they are replaced by not valid "safe" values (default 0.5)
     """
 
     def __init__(self):
         module_base.ModuleBase.__init__(self)
 
+        # Configurations
         self.__type = None
         self.__address = None
+        self.__floor_number = 0
+        self.__input_read = None
+        self.__sample_period = 0.0
+        self.__max_input_age = 0.0
+
+        # States
         self.__lib = None
+        self.__inputs = None  # Latest DriverInputs, replaced as a whole
+        self.__sample_errors = 0
+        self.__sample_condition = threading.Condition()
 
     def init(self, config, transaction_manager):
         """
@@ -61,12 +104,27 @@ class Driver(module_base.ModuleBase):
         if config.get_value("driver", "type") == "Comedi":
             self.__type = DriverTarget.Comedi
 
+        self.__floor_number = config.get_int("core", "floor_number")
+
+        self.__input_read = config.get_value(
+            "driver", "input_read", "pipeline")
+        if self.__input_read not in ("pipeline", "batch"):
+            raise RuntimeError("Unknown input read: %s" % self.__input_read)
+
+        self.__sample_period = config.get_float(
+            "driver", "sample_period", 0.1)
+        self.__max_input_age = config.get_float(
+            "driver", "max_input_age", 0.5)
+
+        # Nothing has been read yet
+        self.__inputs = DriverInputs.make_safe(self.__floor_number, False)
+
         if self.__type == DriverTarget.Simulation:
             self.__address = (
                 config.get_value("driver", "ip_address"),
                 config.get_int("driver", "port"))
 
-            self.__lib = SimulationDriver()
+            self.__lib = SimulationDriver(self.__input_read == "batch")
         else:
             self.__address = None
             self.__lib = ctypes.cdll.LoadLibrary(
@@ -88,6 +146,10 @@ class Driver(module_base.ModuleBase):
         # Sets the stop button light to 0 to detect the motor box power off
         self.__lib.elev_set_stop_lamp(0)
 
+        # The inputs are available as soon as the module has started
+        self.__inputs = self.__sample_inputs()
+        threading.Thread(target=self.__sampling_thread, daemon=True).start()
+
         logging.debug("Finish activating driver module")
 
     def export_state(self, tid):
@@ -123,43 +185,174 @@ class Driver(module_base.ModuleBase):
     def set_stop_lamp(self, value):
         self.__lib.elev_set_stop_lamp(value)
 
-    def get_button_signal(self, button, floor):
-        if self.__lib.elev_get_stop_signal() != 0:
-            # The motor box has lost of power, returns a "safe" value
-            return 0
+    def get_inputs(self):
+        """
+        Returns the latest sample of all the inputs (DriverInputs).
+        """
 
-        return self.__lib.elev_get_button_signal(button, floor)
+        return self.__inputs
 
-    def get_floor_sensor_signal(self):
-        if self.__lib.elev_get_stop_signal() != 0:
-            # The motor box has lost of power, returns a "safe" value
-            return -1
+    def wait_for_inputs(self, inputs=None, timeout=None):
+        """
+        Waits for a sample newer than the specified one (the latest one by
+        default) and returns it. Returns the latest sample, which can be the
+        specified one, if the timeout expires.
+        """
 
-        return self.__lib.elev_get_floor_sensor_signal()
+        with self.__sample_condition:
+            if inputs is None:
+                inputs = self.__inputs
 
-    def get_stop_signal(self):
-        if self.__lib.elev_get_stop_signal() != 0:
-            # The motor box has lost of power, returns a "safe" value
-            return 0
+            self.__sample_condition.wait_for(
+                lambda: self.__inputs is not inputs, timeout)
+
+            return self.__inputs
+
+    def get_input_age(self):
+        """
+        Returns the age of the latest sample in seconds.
+        """
+
+        return time.time() - self.__inputs.sample_time
+
+    def get_sample_errors(self):
+        """
+        Returns the number of samples which have failed.
+        """
+
+        return self.__sample_errors
+
+    def __sampling_thread(self):
+        """
+        Thread which samples all the inputs every period and publishes them.
+        """
+
+        logging.debug("Start sampling the inputs")
+
+        last_inputs = self.__inputs  # Latest successful sample
+
+        while True:
+            start_time = time.time()
+
+            try:
+                last_inputs = self.__sample_inputs()
+                self.__publish_inputs(last_inputs)
+            except Exception as ex:
+                logging.error("Cannot read the inputs! (error = %s)", ex)
+                self.__sample_errors += 1
 
-        return self.__lib.elev_get_stop_signal()
+                if start_time - last_inputs.sample_time > \
+                        self.__max_input_age and self.__inputs.valid:
+                    logging.error("The inputs are too old, use safe values")
+                    self.__publish_inputs(DriverInputs.make_safe(
+                        self.__floor_number, False))
+
+            time.sleep(max(0.0, self.__sample_period -
+                           (time.time() - start_time)))
+
+    def __publish_inputs(self, inputs):
+        """
+        Replaces the latest sample and wakes up the waiting readers.
+        """
+
+        with self.__sample_condition:
+            self.__inputs = inputs
+            self.__sample_condition.notify_all()
+
+    def __sample_inputs(self):
+        """
+        Reads all the inputs at once, returns a DriverInputs.
+        """
+
+        if self.__type == DriverTarget.Simulation:
+            inputs = self.__lib.elev_get_inputs(self.__floor_number)
+        else:
+            inputs = self.__read_comedi_inputs()
+
+        if inputs.stop != 0:
+            # The motor box has lost of power, returns "safe" values
+            return DriverInputs.make_safe(self.__floor_number)
+
+        return inputs
+
+    def get_button_signal(self, button, floor):
+        return self.get_inputs().buttons[floor][button]
+
+    def get_floor_sensor_signal(self):
+        return self.get_inputs().floor
+
+    def get_stop_signal(self):
+        return self.get_inputs().stop
 
     def get_obstruction_signal(self):
-        if self.__lib.elev_get_stop_signal() != 0:
-            # The motor box has lost of power, returns a "safe" value
-            return 0
+        return self.get_inputs().obstruction
+
+    def __read_comedi_inputs(self):
+        """
+        Reads all the inputs from the hardware one by one (local I/O, no
+        round trip).
+        """
 
-        return self.__lib.elev_get_obstruction_signal()
+        buttons = tuple(
+            tuple(self.__lib.elev_get_button_signal(button, floor)
+                  if has_button(button, floor, self.__floor_number) else 0
+                  for button in FloorButton)
+            for floor in range(self.__floor_number))
+
+        return DriverInputs(buttons,
+                            self.__lib.elev_get_floor_sensor_signal(),
+                            self.__lib.elev_get_stop_signal(),
+                            self.__lib.elev_get_obstruction_signal())
+
+
+def has_button(button, floor, floor_number):
+    """
+    Returns whether the button exists on the floor (no call up button on the
+    top floor, no call down button on the ground floor).
+    """
+
+    if button == FloorButton.CallUp:
+        return floor < floor_number - 1
+    if button == FloorButton.CallDown:
+        return floor > 0
+    return True
 
 
 class SimulationDriver(object):
     """
     Network-based elevator simulator driver which is rewritten from the native
     driver provided to support platform-independence.
+
+    Every command is 4 bytes, the get commands are replied with 4 bytes.
+    The commands reading all the inputs (see elev_get_inputs) are sent at
+    once and their replies are read together (pipelining), so that all the
+    inputs cost one round trip. A simulator may also support the batch
+    command, which reads all the inputs in one reply:
+        - Command: [10, number of floors, 0, 0]
+        - Reply: [10, number of floors, 0, 0], then [call up, call down,
+          command] of every floor, then [at floor, floor, stop, obstruction]
+    A simulator which does not support it ignores the command: if the first
+    batch command is not replied within BATCH_PROBE_TIMEOUT (or replied
+    with something else), the driver goes back to pipelining. A late or
+    unexpected reply would shift all the next replies, so the connection is
+    opened again before.
     """
 
-    def __init__(self):
+    COMMAND_SIZE = 4
+
+    BATCH_PROBE_TIMEOUT = 1.0
 
+    def __init__(self, batch_read=False):
+        """
+        Initializes a new instance of the driver.SimulationDriver class.
+
+        @param batch_read Whether the inputs are read with the batch command
+        """
+
+        self.__batch_read = batch_read
+        self.__batch_probed = False
+
+        self.__address = None
         self.__socket = None
         self.__socket_lock = threading.Lock()
 
@@ -170,27 +363,68 @@ class SimulationDriver(object):
 
         self.__socket_lock.acquire()
 
+        self.__address = (ip_addr, port)
         self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__socket.connect((ip_addr, port))
+        self.__socket.connect(self.__address)
 
         self.__socket_lock.release()
 
+    def __reconnect(self):
+        """
+        Replaces the connection with a new one, discarding the replies which
+        have not been read. The socket lock must be held.
+        """
+
+        self.__socket.close()
+
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__socket.connect(self.__address)
+
     def __sync_send(self, msg, receive=False):
         self.__socket_lock.acquire()
 
-        self.__socket.send(msg)
-        if receive:
-            recv = self.__socket.recv(1024)
-        else:
-            recv = None
-
-        self.__socket_lock.release()
+        try:
+            self.__socket.sendall(msg)
+            if receive:
+                recv = self.__receive(self.COMMAND_SIZE)
+            else:
+                recv = None
+        finally:
+            self.__socket_lock.release()
 
         return recv
 
     def __sync_send_and_receive(self, msg):
         return self.__sync_send(msg, True)
 
+    def __sync_exchange(self, msg_list):
+        """
+        Sends all the get commands at once, returns the list of their
+        replies.
+        """
+
+        with self.__socket_lock:
+            self.__socket.sendall(b"".join(msg_list))
+            recv = self.__receive(self.COMMAND_SIZE * len(msg_list))
+
+        return [recv[index:index + self.COMMAND_SIZE]
+                for index in range(0, len(recv), self.COMMAND_SIZE)]
+
+    def __receive(self, size):
+        """
+        Receives exactly the specified number of bytes (TCP may split or
+        merge the replies).
+        """
+
+        recv = bytearray()
+        while len(recv) < size:
+            chunk = self.__socket.recv(size - len(recv))
+            if len(chunk) == 0:
+                raise OSError("Simulator has closed the connection")
+            recv.extend(chunk)
+
+        return bytes(recv)
+
     def elev_set_motor_direction(self, direction):
         msg = bytearray([1, (direction + 256) % 256, 0, 0])
         self.__sync_send(msg)
@@ -212,12 +446,12 @@ class SimulationDriver(object):
         self.__sync_send(msg)
 
     def elev_get_button_signal(self, button, floor):
-        msg = bytes([6, button, floor, 0])
+        msg = bytes([COMMAND_GET_BUTTON_SIGNAL, button, floor, 0])
         resp = self.__sync_send_and_receive(msg)
         return resp[1]
 
     def elev_get_floor_sensor_signal(self):
-        msg = bytes([7, 0, 0, 0])
+        msg = bytes([COMMAND_GET_FLOOR_SENSOR_SIGNAL, 0, 0, 0])
         resp = self.__sync_send_and_receive(msg)
 
         if resp[1] != 0:
@@ -225,11 +459,136 @@ class SimulationDriver(object):
         return -1
 
     def elev_get_stop_signal(self):
-        msg = bytes([8, 0, 0, 0])
+        msg = bytes([COMMAND_GET_STOP_SIGNAL, 0, 0, 0])
         resp = self.__sync_send_and_receive(msg)
         return resp[1]
 
     def elev_get_obstruction_signal(self):
-        msg = bytes([9, 0, 0, 0])
+        msg = bytes([COMMAND_GET_OBSTRUCTION_SIGNAL, 0, 0, 0])
         resp = self.__sync_send_and_receive(msg)
         return resp[1]
+
+    def elev_get_inputs(self, floor_number):
+        """
+        Reads all the inputs in one round trip, returns a DriverInputs.
+        """
+
+        if self.__batch_read:
+            inputs = self.__get_inputs_batch(floor_number)
+            if inputs is not None:
+                return inputs
+
+        return self.__get_inputs_pipelined(floor_number)
+
+    def __get_inputs_batch(self, floor_number):
+        """
+        Reads all the inputs with the batch command, returns None if the
+        simulator does not support it.
+        """
+
+        size = self.COMMAND_SIZE * 2 + 3 * floor_number
+
+        with self.__socket_lock:
+            self.__socket.sendall(
+                bytes([COMMAND_GET_INPUTS, floor_number, 0, 0]))
+
+            if self.__batch_probed:
+                header = self.__receive(self.COMMAND_SIZE)
+            else:
+                self.__socket.settimeout(self.BATCH_PROBE_TIMEOUT)
+                try:
+                    header = self.__receive(self.COMMAND_SIZE)
+                except socket.timeout:
+                    header = None
+                finally:
+                    self.__socket.settimeout(None)
+
+                self.__batch_probed = True
+
+            if header is None or header[0] != COMMAND_GET_INPUTS or \
+                    header[1] != floor_number:
+                logging.error("Simulator does not support the batch "
+                              "command, use pipelined commands")
+                self.__batch_read = False
+                self.__reconnect()
+                return None
+
+            recv = self.__receive(size - self.COMMAND_SIZE)
+
+        buttons = tuple(
+            tuple(recv[floor * 3 + button]
+                  if has_button(button, floor, floor_number) else 0
+                  for button in FloorButton)
+            for floor in range(floor_number))
+
+        at_floor, floor, stop, obstruction = recv[floor_number * 3:]
+
+        return DriverInputs(buttons, floor if at_floor != 0 else -1,
+                            stop, obstruction)
+
+    def __get_inputs_pipelined(self, floor_number):
+        """
+        Reads all the inputs with one command each, all sent at once.
+        """
+
+        msg_list = list()
+        button_list = list()  # (button, floor) of the button commands
+        for floor in range(floor_number):
+            for button in FloorButton:
+                if has_button(button, floor, floor_number):
+                    msg_list.append(
+                        bytes([COMMAND_GET_BUTTON_SIGNAL, button, floor, 0]))
+                    button_list.append((button, floor))
+
+        msg_list.append(bytes([COMMAND_GET_FLOOR_SENSOR_SIGNAL, 0, 0, 0]))
+        msg_list.append(bytes([COMMAND_GET_STOP_SIGNAL, 0, 0, 0]))
+        msg_list.append(bytes([COMMAND_GET_OBSTRUCTION_SIGNAL, 0, 0, 0]))
+
+        resp_list = self.__sync_exchange(msg_list)
+
+        buttons = [[0] * len(FloorButton) for _ in range(floor_number)]
+        for ((button, floor), resp) in zip(button_list, resp_list):
+            buttons[floor][button] = resp[1]
+
+        floor_resp, stop_resp, obstruction_resp = resp_list[-3:]
+
+        return DriverInputs(tuple(tuple(values) for values in buttons),
+                            floor_resp[2] if floor_resp[1] != 0 else -1,
+                            stop_resp[1], obstruction_resp[1])
+
+
+class DriverInputs(object):
+    """
+    Values of all the inputs read at the same time (sample_time). The
+    instances are shared by all the readers, so they cannot be changed.
+
+    @param buttons buttons[floor][button] (see FloorButton), 1 if pushed
+    @param floor Floor sensor signal, -1 between floors
+    @param stop Stop signal
+    @param obstruction Obstruction signal
+    @param valid False if the values have not been read from the inputs
+    """
+
+    __slots__ = ("buttons", "floor", "stop", "obstruction", "valid",
+                 "sample_time")
+
+    def __init__(self, buttons, floor, stop, obstruction, valid=True):
+        object.__setattr__(self, "buttons", buttons)
+        object.__setattr__(self, "floor", floor)
+        object.__setattr__(self, "stop", stop)
+        object.__setattr__(self, "obstruction", obstruction)
+        object.__setattr__(self, "valid", valid)
+        object.__setattr__(self, "sample_time", time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Driver inputs cannot be changed")
+
+    @staticmethod
+    def make_safe(floor_number, valid=True):
+        """
+        Returns the "safe" values of the inputs when the motor box has lost
+        power (valid) or when the inputs cannot be read (not valid).
+        """
+
+        return DriverInputs(((0,) * len(FloorButton),) * floor_number,
+                            -1, 0, 0, valid)
@@ -29,6 +29,23 @@ class ElevatorController(module_base.ModuleBase):
     of requests from the request manager, determines the state and next
     destination of the elevator and call the motor controller to reach
     that floor.
+
+    The floor panels subscribe to the state of the elevator (position,
+    direction, etc.) with the "elev_state_subscribe" packet. The state is
+    pushed to the subscribers ("floor_elev_state_push") only when it has
+    changed, or every keepalive period to show that the elevator is alive.
+    A subscription expires when the pushes have not been acknowledged for
+    a while; the floor panel then subscribes again. The subscriptions are
+    not part of the module state, after a failover the floor panels
+    subscribe to the new primary when the pushes stop.
+
+    If multicast is enabled in the network module, the state with the
+    requests being served at every floor is announced once to the whole
+    building ("floor_elev_state_announce") instead.
+
+    The state is published from a snapshot taken by the control thread at
+    the end of every committed transaction, so that publishing never takes
+    the transaction slot from the packet handlers.
     """
 
     def __init__(self):
@@ -36,14 +53,34 @@ class ElevatorController(module_base.ModuleBase):
 
         # Related modules
         self.__transaction_manager = None
+        self.__network = None
         self.__request_manager = None
         self.__motor_controller = None
         self.__user_interface = None
 
         # Configurations
+        self.__elevator = None
         self.__floor_number = None
         self.__period = None
         self.__stay_time = None
+        self.__publish_period = None
+        self.__keepalive_period = None
+        self.__subscription_lease = None
+        self.__floor_address = None
+
+        # Subscriptions, only accessed under the subscription lock
+        self.__subscriptions = dict()  # Floor => Subscription
+        self.__subscriptions_lock = threading.Lock()
+
+        # Last multicast announcement, only accessed by the publishing thread
+        self.__last_announcement = None
+        self.__announce_time = 0.0
+
+        # State seen by every floor at the last commit of the control
+        # thread, only accessed under the snapshot condition
+        self.__snapshot = None
+        self.__snapshot_version = 0
+        self.__snapshot_changed = threading.Condition()
 
         # States
         self.__state = ElevatorState.Stop
@@ -71,6 +108,7 @@ class ElevatorController(module_base.ModuleBase):
 
         # Related modules
         self.__transaction_manager = transaction_manager
+        self.__network = _network
         self.__request_manager = request_manager
         self.__motor_controller = motor_controller
         self.__user_interface = user_interface
@@ -80,10 +118,24 @@ class ElevatorController(module_base.ModuleBase):
         self.__period = config.get_float(
             "elevator", "elevator_control_period")
         self.__stay_time = config.get_float("elevator", "stay_time")
+        self.__elevator = config.get_int("elevator", "elevator")
+        self.__publish_period = config.get_float(
+            "elevator", "state_publish_period", 0.1)
+        self.__keepalive_period = config.get_float(
+            "elevator", "state_keepalive_period", 0.5)
+        self.__subscription_lease = config.get_float(
+            "elevator", "state_subscription_lease", 3.0)
+        self.__floor_address = [
+            (config.get_value("network", "floor_%d.ip_address" % (index)),
+             config.get_int("network", "floor_%d.port" % (index)))
+            for index in range(self.__floor_number)
+        ]
 
         # Registers incoming packet handler
         _network.add_packet_handler("elev_state_get",
                                     self.__on_elev_state_get_received)
+        _network.add_packet_handler("elev_state_subscribe",
+                                    self.__on_elev_state_subscribe_received)
 
         logging.debug("Finish initializing elevator controller")
 
@@ -99,6 +151,10 @@ class ElevatorController(module_base.ModuleBase):
         threading.Thread(target=self.__control_thread,
                          daemon=True).start()
 
+        # Starts the thread which publishes the state
+        threading.Thread(target=self.__state_publishing_thread,
+                         daemon=True).start()
+
         logging.debug("Finish activating elevator controller")
 
     def export_state(self, tid):
@@ -143,7 +199,49 @@ class ElevatorController(module_base.ModuleBase):
         logging.debug("Start handling the \"elev_state_get\" packet "
                       "from floor %d", data["floor"])
 
+        state = self.__get_state(tid, data["floor"])
+
+        logging.debug("Finish handling the \"elev_state_get\" packet "
+                      "from floor %d", data["floor"])
+
+        return state
+
+    def __on_elev_state_subscribe_received(self, tid, address, data):
+        """
+        Called when the elevator controller receives a packet from a floor
+        panel which subscribes to the state of this elevator. Returns the
+        current state, the next ones are pushed to the floor panel.
+        """
+
+        self._join_transaction(tid)
+        logging.debug("Start handling the \"elev_state_subscribe\" packet "
+                      "from floor %d", data["floor"])
+
         floor = data["floor"]
+        state = self.__get_state(tid, floor)
+
+        with self.__subscriptions_lock:
+            if floor not in self.__subscriptions:
+                logging.info("Floor %d subscribes to the elevator state",
+                             floor)
+
+            # The floor panel already has the current state
+            subscription = Subscription(time.time())
+            subscription.last_state = state
+            self.__subscriptions[floor] = subscription
+
+        logging.debug("Finish handling the \"elev_state_subscribe\" packet "
+                      "from floor %d", floor)
+
+        return state
+
+    def __get_state(self, tid, floor):
+        """
+        Returns the current state (position, direction, etc.) of this
+        elevator seen by the specified floor.
+        """
+
+        self._join_transaction(tid)
 
         # Gets list of requests belongs to that floor
         logging.debug("Get current list of request from request manager")
@@ -162,7 +260,6 @@ class ElevatorController(module_base.ModuleBase):
             self.__motor_controller.get_current_position_direction(tid)
         motor_stuck = self.__motor_controller.is_stuck(tid)
 
-        # Sends back the state
         return {
             "position": motor_position,
             "direction": self.__direction,
@@ -170,8 +267,126 @@ class ElevatorController(module_base.ModuleBase):
             "motor_stuck": motor_stuck,
         }
 
-        logging.debug("Finish handling the \"elev_state_get\" packet "
-                      "from floor %d", floor)
+    def __set_snapshot(self, states):
+        """
+        Keeps the state seen by every floor for the publishing thread, wakes
+        it up if the state has changed. Called by the control thread after
+        its transaction has been committed.
+        """
+
+        with self.__snapshot_changed:
+            if states != self.__snapshot:
+                self.__snapshot = states
+                self.__snapshot_version += 1
+                self.__snapshot_changed.notify()
+
+    def __state_publishing_thread(self):
+        """
+        Publishes the state of the elevator when it has changed or the
+        keepalive period has passed: announces it to the whole building if
+        multicast is enabled, otherwise pushes it to the subscribed floor
+        panels. The thread wakes up at every change of the snapshot, or
+        every state_publish_period to send the keepalives and retry the
+        failed pushes.
+        """
+
+        logging.debug("Start elevator state publishing thread")
+
+        version = 0
+
+        while True:
+            with self.__snapshot_changed:
+                self.__snapshot_changed.wait_for(
+                    lambda: self.__snapshot_version != version,
+                    self.__publish_period)
+                version = self.__snapshot_version
+                states = self.__snapshot
+
+            if states is None:
+                continue  # The control thread has not committed yet
+
+            if self.__network.is_multicast_enabled():
+                self.__announce_state(states)
+            else:
+                self.__push_state(states)
+
+        # Never reach here
+
+    def __announce_state(self, states):
+        """
+        Announces the state of the elevator (with the requests being served
+        at every floor) to all the floor panels with one multicast packet.
+        """
+
+        data = {
+            "elevator": self.__elevator,
+            "position": states[0]["position"],
+            "direction": states[0]["direction"],
+            "serving_requests": [state["serving_requests"]
+                                 for state in states],
+            "motor_stuck": states[0]["motor_stuck"],
+        }
+
+        now = time.time()
+        if data == self.__last_announcement and \
+                now - self.__announce_time < self.__keepalive_period:
+            return
+
+        logging.debug("Announce the elevator state")
+        if self.__network.publish_packet("floor_elev_state_announce", data):
+            self.__last_announcement = data
+            self.__announce_time = now
+
+    def __push_state(self, states):
+        """
+        Pushes the state of the elevator to the subscribed floor panels.
+        """
+
+        # Finds the states to push
+        now = time.time()
+        packet_list = list()
+        push_list = list()
+
+        with self.__subscriptions_lock:
+            for (floor, subscription) in list(self.__subscriptions.items()):
+                state = states[floor]
+
+                if now - subscription.ack_time > \
+                        self.__subscription_lease:
+                    logging.warning("Subscription of floor %d has "
+                                    "expired", floor)
+                    del self.__subscriptions[floor]
+                    continue
+
+                if state == subscription.last_state and \
+                        now - subscription.sent_time < \
+                        self.__keepalive_period:
+                    continue
+
+                data = dict(state)
+                data["elevator"] = self.__elevator
+                packet_list.append((self.__floor_address[floor],
+                                    "floor_elev_state_push", data))
+                push_list.append((floor, state))
+
+        if len(packet_list) == 0:
+            return
+
+        # Pushes the states (outside of any transaction)
+        logging.debug("Push the elevator state to %d floors",
+                      len(packet_list))
+        resp_list = self.__network.send_packets(packet_list)
+
+        # The state is pushed again in the next round if failed
+        with self.__subscriptions_lock:
+            for ((floor, state), resp) in zip(push_list, resp_list):
+                subscription = self.__subscriptions.get(floor)
+                if subscription is None or resp is False:
+                    continue
+
+                subscription.last_state = state
+                subscription.sent_time = now
+                subscription.ack_time = time.time()
 
     def __control_thread(self):
         """
@@ -302,7 +517,13 @@ class ElevatorController(module_base.ModuleBase):
                         self.__motor_controller.set_target_floor(
                             tid, target_floor)
 
-            self.__transaction_manager.finish(tid)
+            # The state to publish is read in the transaction and kept once
+            # it has been committed
+            states = [self.__get_state(tid, floor)
+                      for floor in range(self.__floor_number)]
+
+            if self.__transaction_manager.finish(tid):
+                self.__set_snapshot(states)
 
             time.sleep(self.__period)
 
@@ -373,3 +594,20 @@ class ElevatorController(module_base.ModuleBase):
                         break
 
         return next_destination
+
+
+class Subscription(object):
+    """
+    Subscription of a floor panel to the elevator state, including:
+      - The last state acknowledged by the floor panel
+      - Time of the last push
+      - Time of the last acknowledgement, the subscription expires when
+        it is too old
+    All fields are public and directly accessible by the elevator
+    controller.
+    """
+
+    def __init__(self, subscribe_time):
+        self.last_state = None
+        self.sent_time = subscribe_time
+        self.ack_time = subscribe_time
@@ -155,20 +155,23 @@ class MotorController(module_base.ModuleBase):
 
         # Moves the elevator down until it reaches any floor to be able to
         # detect the current position of the elevator at initialization.
-        tid = self.__transaction_manager.start()
-        self._join_transaction(tid)
-
+        # The wait is done outside of any transaction to not block the
+        # other modules.
         if self.__prev_floor == -1:
             logging.debug("Move elevator down to any floor")
             self.__driver.set_motor_direction(driver.MotorDirection.Down)
-            self.__direction = core.Direction.Down
 
-            while True:
-                self.__prev_floor = self.__driver.get_floor_sensor_signal()
-                if self.__prev_floor != -1:
-                    break
+            inputs = self.__driver.get_inputs()
+            while inputs.floor == -1:
+                inputs = self.__driver.wait_for_inputs(inputs)
+
+            tid = self.__transaction_manager.start()
+            self._join_transaction(tid)
+
+            self.__direction = core.Direction.Down
+            self.__prev_floor = inputs.floor
 
-        self.__transaction_manager.finish(tid)
+            self.__transaction_manager.finish(tid)
 
         while True:
             tid = self.__transaction_manager.start()
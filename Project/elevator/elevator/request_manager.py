@@ -201,12 +201,26 @@ class RequestManager(module_base.ModuleBase):
             self.__user_interface.turn_button_light_off(
                 tid, floor)
 
-        # Sends request served message to the floor panel
+        # Notifies the floor panel without waiting for its reply, the
+        # transaction goes on while the packet is being delivered
         logging.debug("Sends the request served packet to the floor panel")
-        self.__network.send_packet(
+        self.__network.notify(
             self.__floor_address[floor],
             "floor_request_served",
-            {"elevator": self.__elevator, "direction": direction})
+            {"elevator": self.__elevator, "direction": direction},
+            lambda success: self.__on_request_served_notified(
+                floor, direction, success))
 
         logging.debug("Finish setting the request as served "
                       "(floor = %d, direction = %s)", floor, direction)
+
+    def __on_request_served_notified(self, floor, direction, success):
+        """
+        Called when the request served packet has been delivered to the
+        floor panel, or has finally failed.
+        """
+
+        if not success:
+            logging.warning("Floor panel has not been told that the request "
+                            "has been served (floor = %d, direction = %s)",
+                            floor, direction)
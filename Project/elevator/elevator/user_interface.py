@@ -156,6 +156,11 @@ class UserInterface(module_base.ModuleBase):
 
         self._join_transaction(tid)
 
+        # Read-only transactions (e.g. state snapshot) cannot change
+        # the lights
+        if self._is_read_only(tid):
+            return module_base.ModuleBase.prepare_to_commit(self, tid)
+
         logging.debug("Updates the lights")
         if self._get_can_commit(tid):
             if self.__started:
@@ -183,12 +188,14 @@ class UserInterface(module_base.ModuleBase):
 
         while True:
 
+            # Reads all the buttons at once
+            inputs = self.__driver.get_inputs()
+
             # Checks each elevator panel button(0,1,2,3)
             # TODO: When any of the buttons is pushed, send a request to the
             # RequestManager
             for floor in range(len(is_pushed)):
-                value = self.__driver.get_button_signal(
-                    driver.FloorButton.Command, floor)
+                value = inputs.buttons[floor][driver.FloorButton.Command]
                 if is_pushed[floor] == 0 and value == 1:
                     # This button is pushed
                     logging.info("Button to floor %d is pushed", floor)
@@ -63,6 +63,7 @@ def main():
     # Starts
     pair = process_pairs.ProcessPair()
     pair.init(config, transaction_manager, args)
+    _network.add_diagnostics("process_pairs", pair.get_statistics)
     pair.start(module_list)
 
     while True:
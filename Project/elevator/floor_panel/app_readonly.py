@@ -19,6 +19,16 @@ class FloorReadonly(module_base.ModuleBase):
     """
     This is a special node which only shows all the floor panels lights
     without any button interaction.
+
+    If multicast is enabled in the network module, the floor panels are not
+    polled: the lights show the requests being served by the elevators,
+    taken from their announcements ("floor_elev_state_announce"). This is
+    not exactly what polling shows. A request registered by a floor panel
+    but not assigned to any elevator yet (e.g. while all of them are
+    disconnected) is not shown, nor are the requests of an elevator whose
+    last announcement is older than floor.elevator_state_timeout. Without
+    multicast, the lights show the requests registered by the floor panels
+    as before.
     """
 
     def __init__(self):
@@ -33,6 +43,10 @@ class FloorReadonly(module_base.ModuleBase):
         self.__period = None
         self.__floor_number = None
         self.__floor_address = None
+        self.__state_timeout = None
+
+        # States
+        self.__announcements = dict()  # Elevator => (time, requests)
 
     def init(self, config, transaction_manager, _network, _driver):
         """
@@ -54,6 +68,8 @@ class FloorReadonly(module_base.ModuleBase):
 
         # Configurations
         self.__period = config.get_float("floor", "readonly_period")
+        self.__state_timeout = config.get_float(
+            "floor", "elevator_state_timeout", 1.5)
         self.__floor_number = config.get_int("core", "floor_number")
         self.__floor_address = [
             (config.get_value("network", "floor_%d.ip_address" % (index)),
@@ -61,6 +77,10 @@ class FloorReadonly(module_base.ModuleBase):
             for index in range(self.__floor_number)
         ]
 
+        # Registers incoming packet handler
+        _network.add_packet_handler("floor_elev_state_announce",
+                                    self.__on_elev_state_announce_received)
+
         logging.debug("Finish initializing read-only floor panel")
 
     def start(self, tid):
@@ -93,6 +113,19 @@ class FloorReadonly(module_base.ModuleBase):
 
         self._join_transaction(tid)
 
+    def __on_elev_state_announce_received(self, tid, address, data):
+        """
+        Called when an elevator has announced its state, keeps the requests
+        being served by that elevator.
+        """
+
+        self._join_transaction(tid)
+        logging.debug("Elevator %d serves requests: %s",
+                      data["elevator"], data["serving_requests"])
+
+        self.__announcements[data["elevator"]] = \
+            (time.time(), data["serving_requests"])
+
     def __show_floor_button_light_thread(self):
         """
         Periodically gets the current requests from all the floor panels
@@ -100,39 +133,78 @@ class FloorReadonly(module_base.ModuleBase):
         """
 
         while True:
-            tid = self.__transaction_manager.start()
-            self._join_transaction(tid)
+            if self.__network.is_multicast_enabled():
+                self.__show_announced_requests()
+                time.sleep(self.__period)
+                continue
 
-            for floor in range(self.__floor_number):
+            # Asks all the floors at the same time, so that a dead floor
+            # panel only delays the round by one timeout
+            logging.debug("Get request list of all floors")
+            resp_list = self.__network.broadcast_packet(
+                self.__floor_address, "floor_get_all_requests", True)
 
-                logging.debug("Get floor %d request list", floor)
-                resp = self.__network.send_packet(
-                    self.__floor_address[floor],
-                    "floor_get_all_requests",
-                    True)
+            tid = self.__transaction_manager.start()
+            self._join_transaction(tid)
 
+            for (floor, resp) in enumerate(resp_list):
                 if resp is not False:
-                    logging.debug("Update button lights of floor %d", floor)
-
                     call_up, call_down = resp
-                    if call_up:
-                        self.__driver.set_button_lamp(
-                            driver.FloorButton.CallUp, floor, 1)
-                    else:
-                        self.__driver.set_button_lamp(
-                            driver.FloorButton.CallUp, floor, 0)
-
-                    if call_down:
-                        self.__driver.set_button_lamp(
-                            driver.FloorButton.CallDown, floor, 1)
-                    else:
-                        self.__driver.set_button_lamp(
-                            driver.FloorButton.CallDown, floor, 0)
+                    self.__set_button_lights(tid, floor, call_up, call_down)
 
             self.__transaction_manager.finish(tid)
 
             time.sleep(self.__period)
 
+    def __show_announced_requests(self):
+        """
+        Shows the requests being served by the elevators on the button
+        lights.
+        """
+
+        tid = self.__transaction_manager.start()
+        self._join_transaction(tid)
+
+        now = time.time()
+        requests = [set() for floor in range(self.__floor_number)]
+
+        for (announce_time, serving_requests) in \
+                self.__announcements.values():
+            if now - announce_time >= self.__state_timeout:
+                continue  # The elevator may be dead
+
+            for (floor, directions) in enumerate(serving_requests):
+                requests[floor].update(directions)
+
+        for (floor, directions) in enumerate(requests):
+            self.__set_button_lights(tid, floor,
+                                     core.Direction.Up in directions,
+                                     core.Direction.Down in directions)
+
+        self.__transaction_manager.finish(tid)
+
+    def __set_button_lights(self, tid, floor, call_up, call_down):
+        """
+        Shows the requests of the floor on its button lights.
+        """
+
+        self._join_transaction(tid)
+        logging.debug("Update button lights of floor %d", floor)
+
+        if call_up:
+            self.__driver.set_button_lamp(
+                driver.FloorButton.CallUp, floor, 1)
+        else:
+            self.__driver.set_button_lamp(
+                driver.FloorButton.CallUp, floor, 0)
+
+        if call_down:
+            self.__driver.set_button_lamp(
+                driver.FloorButton.CallDown, floor, 1)
+        else:
+            self.__driver.set_button_lamp(
+                driver.FloorButton.CallDown, floor, 0)
+
 
 def main():
     """
@@ -171,6 +243,7 @@ def main():
     # Starts
     pair = process_pairs.ProcessPair()
     pair.init(config, transaction_manager, args)
+    _network.add_diagnostics("process_pairs", pair.get_statistics)
     pair.start(module_list)
 
     while True:
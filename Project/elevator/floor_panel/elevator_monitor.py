@@ -4,6 +4,7 @@ import time
 import core
 import transaction
 import network
+import membership
 import module_base
 import floor_panel.request_manager
 
@@ -34,6 +35,25 @@ class ElevatorMonitor(module_base.ModuleBase):
       - Direction (going up/down, stopping)
       - Connected/disconnected
       - Serving requests from this floor
+
+    The module subscribes to the state of every elevator, the elevators then
+    push their state when it changes and periodically as a keepalive (see
+    elevator.elevator_controller.ElevatorController). When an elevator has
+    not pushed its state for floor.elevator_state_timeout seconds, the
+    module subscribes to it again; the reply of the subscription is the
+    current state. After some failed subscriptions, the elevator is
+    considered as disconnected. An elevator which is too busy to admit the
+    request is alive, it is asked again in the next round without counting
+    a failed attempt.
+
+    If multicast is enabled in the network module, the elevators announce
+    their state to the whole building instead and a silent elevator is
+    asked directly ("elev_state_get").
+
+    If the network module takes part in a gossip membership group, an
+    elevator declared dead by the group is considered as disconnected at
+    once, so that all the floors agree on it without waiting for their own
+    failed attempts.
     """
 
     def __init__(self):
@@ -51,10 +71,12 @@ class ElevatorMonitor(module_base.ModuleBase):
         self.__elevator_number = None
         self.__period = None
         self.__max_attempts = None
+        self.__state_timeout = None
         self.__elevator_address = None
 
         # States
         self.__elevator_list = None
+        self.__update_time = None  # Time of the last state of each elevator
 
         logging.debug("Finish initializing elevator monitor")
 
@@ -84,6 +106,8 @@ class ElevatorMonitor(module_base.ModuleBase):
         self.__period = config.get_float("floor", "elevator_monitor_period")
         self.__max_attempts = config.get_int(
             "floor", "elevator_monitor_attempts")
+        self.__state_timeout = config.get_float(
+            "floor", "elevator_state_timeout", 1.5)
         self.__elevator_address = [
             (config.get_value("network", "elevator_%d.ip_address" % (index)),
              config.get_int("network", "elevator_%d.port" % (index)))
@@ -93,6 +117,13 @@ class ElevatorMonitor(module_base.ModuleBase):
         # Initializes state
         self.__elevator_list = [ElevatorState()
                                 for i in range(self.__elevator_number)]
+        self.__update_time = [0.0] * self.__elevator_number
+
+        # Registers incoming packet handler
+        _network.add_packet_handler("floor_elev_state_push",
+                                    self.__on_elev_state_push_received)
+        _network.add_packet_handler("floor_elev_state_announce",
+                                    self.__on_elev_state_announce_received)
 
         logging.debug("Finish initializing elevator monitor module")
 
@@ -104,12 +135,10 @@ class ElevatorMonitor(module_base.ModuleBase):
         self._join_transaction(tid)
         logging.debug("Start activating elevator monitor module")
 
-        # Starts new threads to periodically retrieve the current state
+        # Starts new thread to periodically retrieve the current state
         # of all the elevators
-        for index in range(self.__elevator_number):
-            threading.Thread(target=self.__monitor_elevator_state_thread,
-                             daemon=True,
-                             args=(index,)).start()
+        threading.Thread(target=self.__monitor_elevator_state_thread,
+                         daemon=True).start()
 
         logging.debug("Finish activating elevator monitor module")
 
@@ -215,55 +244,170 @@ class ElevatorMonitor(module_base.ModuleBase):
                       direction)
         return best_elevator
 
-    def __monitor_elevator_state_thread(self, index):
+    def __on_elev_state_push_received(self, tid, address, data):
+        """
+        Called when an elevator has pushed its new state.
+        """
+
+        self._join_transaction(tid)
+        logging.debug("Start handling the \"floor_elev_state_push\" packet "
+                      "from elevator %d", data["elevator"])
+
+        index = data["elevator"]
+        self.__update_elevator_state(tid, index, data)
+
+        logging.debug("Finish handling the \"floor_elev_state_push\" "
+                      "packet from elevator %d", index)
+
+        return True
+
+    def __on_elev_state_announce_received(self, tid, address, data):
         """
-        Monitors the specified elevator state.
+        Called when an elevator has announced its new state to all the
+        floors. The announcement includes the requests being served at every
+        floor, only the ones of this floor are kept.
         """
 
-        logging.debug("Start elevator %d monitoring thread", index)
+        self._join_transaction(tid)
+        logging.debug("Start handling the \"floor_elev_state_announce\" "
+                      "packet from elevator %d", data["elevator"])
+
+        new_state = dict(data)
+        new_state["serving_requests"] = data["serving_requests"][self.__floor]
+
+        self.__update_elevator_state(tid, data["elevator"], new_state)
+
+        logging.debug("Finish handling the \"floor_elev_state_announce\" "
+                      "packet from elevator %d", data["elevator"])
+
+    def __update_elevator_state(self, tid, index, new_state):
+        """
+        Saves the received state of the elevator and informs the request
+        manager.
+        """
+
+        self._join_transaction(tid)
+        logging.debug("Elevator %d current state: %s", index, new_state)
+
+        state = self.__elevator_list[index]
+
+        state.is_connected = True
+        state.position = new_state["position"]
+        state.direction = new_state["direction"]
+        state.serving_requests = new_state["serving_requests"]
+        state.motor_stuck = new_state["motor_stuck"]
+
+        self.__update_time[index] = time.time()
+
+        self.__request_manager.on_elevator_state_changed(tid, index, state)
+
+    def __is_dead_member(self, index):
+        """
+        Returns whether the elevator has been declared dead by the gossip
+        membership group (always False if the group is disabled).
+        """
 
-        attempts = 0
-        address = self.__elevator_address[index]
+        return self.__network.get_member_state(
+            self.__elevator_address[index]) == membership.MemberState.Dead
+
+    def __disconnect_dead_elevators(self, dead_list):
+        """
+        Considers the elevators declared dead by the gossip membership group
+        as disconnected, the request manager then rearranges their requests.
+        """
+
+        logging.error("Elevators %s have been declared dead", dead_list)
+
+        tid = self.__transaction_manager.start()
+        self._join_transaction(tid)
+
+        for index in dead_list:
+            state = self.__elevator_list[index]
+            state.is_connected = False
+
+            self.__request_manager.on_elevator_state_changed(
+                tid, index, state)
+
+        self.__transaction_manager.finish(tid)
+
+    def __monitor_elevator_state_thread(self):
+        """
+        Subscribes to the state of the elevators which have not pushed their
+        state recently. All of them are asked at the same time, so that
+        a dead elevator only delays the round by one timeout.
+        """
+
+        logging.debug("Start elevator monitoring thread")
+
+        attempts = [0] * self.__elevator_number
 
         out_data = {"floor": self.__floor}
 
         while True:
-            logging.debug("Ask elevator %d for its current state", index)
+            # Finds the elevators without recent state
+            tid = self.__transaction_manager.start(read_only=True)
+            self._join_transaction(tid)
+
+            now = time.time()
+            silent_list = [index for index in range(self.__elevator_number)
+                           if now - self.__update_time[index] >=
+                           self.__state_timeout]
+            dead_list = [index for index in range(self.__elevator_number)
+                         if self.__elevator_list[index].is_connected and
+                         self.__is_dead_member(index)]
+
+            self.__transaction_manager.finish(tid)
+
+            if len(dead_list) > 0:
+                self.__disconnect_dead_elevators(dead_list)
+
+            if len(silent_list) == 0:
+                time.sleep(self.__period)
+                continue
 
-            # Sends request to get the current elevator state
-            attempts += 1
-            new_state = self.__network.send_packet(
-                address, "elev_state_get", out_data)
+            logging.debug("Subscribe to the state of elevators %s",
+                          silent_list)
+
+            # Subscribes again, the reply is the current elevator state.
+            # With multicast, the state is announced without subscription.
+            if self.__network.is_multicast_enabled():
+                packet_type = "elev_state_get"
+            else:
+                packet_type = "elev_state_subscribe"
+
+            new_state_list = self.__network.broadcast_packet(
+                [self.__elevator_address[index] for index in silent_list],
+                packet_type, out_data, busy=network.BUSY)
 
             # Starts new transaction to update the data
             tid = self.__transaction_manager.start()
             self._join_transaction(tid)
 
-            state = self.__elevator_list[index]
+            for (index, new_state) in zip(silent_list, new_state_list):
+                if new_state is network.BUSY:
+                    continue
 
-            if new_state is not False:
-                logging.debug(
-                    "Elevator %d current state: %s", index, new_state)
+                attempts[index] += 1
+                state = self.__elevator_list[index]
 
-                state.is_connected = True
-                attempts = 0
+                if new_state is not False:
+                    attempts[index] = 0
+                    self.__update_elevator_state(tid, index, new_state)
+                else:
+                    logging.error(
+                        "Cannot get the state of elevator %d (attempt: %d)",
+                        index, attempts[index])
 
-                state.position = new_state["position"]
-                state.direction = new_state["direction"]
-                state.serving_requests = new_state["serving_requests"]
-                state.motor_stuck = new_state["motor_stuck"]
-            else:
-                logging.error(
-                    "Cannot get the state of elevator %d (attempt: %d)",
-                    index, attempts)
+                    # After some failed attempts, the elevator is considered
+                    # as disconnected and the request manager has to
+                    # rearrange their request to another one
+                    if attempts[index] > self.__max_attempts or \
+                            self.__is_dead_member(index):
+                        state.is_connected = False
 
-                # After some failed attempts, the elevator is considered as
-                # disconnected and the request manager has to rearrange their
-                # request to another one
-                if attempts > self.__max_attempts:
-                    state.is_connected = False
+                    self.__request_manager.on_elevator_state_changed(
+                        tid, index, state)
 
-            self.__request_manager.on_elevator_state_changed(tid, index, state)
             _ = self.__transaction_manager.finish(tid)
 
             # Waits for a while
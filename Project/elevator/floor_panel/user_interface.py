@@ -110,7 +110,11 @@ class UserInterface(module_base.ModuleBase):
         """
 
         self._join_transaction(tid)
-        self.__update_button_light(tid)
+
+        # Read-only transactions (e.g. state snapshot) cannot change
+        # the lights
+        if not self._is_read_only(tid):
+            self.__update_button_light(tid)
 
         return module_base.ModuleBase.prepare_to_commit(self, tid)
 
@@ -173,10 +177,13 @@ class UserInterface(module_base.ModuleBase):
 
         while True:
 
+            # Reads all the buttons at once
+            inputs = self.__driver.get_inputs()
+
             # Checks each button (up, down, command). If any of them is pushed,
             # sends request to the request manager
             for button in is_pushed:
-                value = self.__driver.get_button_signal(button, self.__floor)
+                value = inputs.buttons[self.__floor][button]
                 if is_pushed[button] == 0 and value == 1:
                     # This button is pushed
 
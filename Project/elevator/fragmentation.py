@@ -0,0 +1,194 @@
+import logging
+import struct
+import threading
+import time
+import random
+import collections
+
+
+# Header of a fragment (network byte order): magic byte, message identifier,
+# fragment index and number of fragments. The magic byte distinguishes
+# fragments from whole packets (see codec.decode).
+MAGIC = 0xB8
+HEADER = struct.Struct("!BIHH")
+
+
+def is_fragment(data):
+    """
+    Returns whether the received datagram is a fragment of a larger packet.
+    """
+
+    return len(data) > 0 and data[0] == MAGIC
+
+
+class Fragmenter(object):
+    """
+    Splits the packets which are larger than the datagram size into
+    fragments. Every packet gets a new message identifier, so that the
+    receiver can put the fragments of the same packet together.
+
+    Usage: fragmenter = Fragmenter(datagram_size)
+        for datagram in fragmenter.split(packet_bytes):
+            sock.sendto(datagram, addr)
+    """
+
+    def __init__(self, datagram_size):
+        """
+        Initializes a new instance of the fragmentation.Fragmenter class.
+
+        @param datagram_size Maximum size of a datagram in bytes
+        """
+
+        self.__payload_size = datagram_size - HEADER.size
+        if self.__payload_size <= 0:
+            raise RuntimeError("Datagram size is too small for fragments")
+
+        self.__message_id = random.randrange(1 << 30)
+        self.__message_id_lock = threading.Lock()
+
+    def split(self, packet_bytes):
+        """
+        Returns the list of datagrams to send: the packet itself if it fits
+        into one datagram, otherwise its fragments.
+        """
+
+        if len(packet_bytes) <= self.__payload_size + HEADER.size and \
+                not is_fragment(packet_bytes):
+            return [packet_bytes]
+
+        count = (len(packet_bytes) + self.__payload_size - 1) // \
+            self.__payload_size
+        if count >= (1 << 16):
+            raise ValueError("Packet is too large")
+
+        with self.__message_id_lock:
+            self.__message_id = (self.__message_id + 1) % (1 << 32)
+            message_id = self.__message_id
+
+        return [HEADER.pack(MAGIC, message_id, index, count) +
+                packet_bytes[index * self.__payload_size:
+                             (index + 1) * self.__payload_size]
+                for index in range(count)]
+
+
+class Reassembler(object):
+    """
+    Puts the received fragments together. A packet whose fragments have not
+    all arrived within the timeout is dropped (fragments_expired). The total
+    size of the incomplete packets is limited; when it is exceeded, the
+    oldest incomplete packets are dropped (fragments_dropped).
+
+    Usage: reassembler = Reassembler(timeout, max_size, statistics)
+        if is_fragment(data):
+            data = reassembler.add(address, data)
+            if data is None:
+                <wait for the other fragments>
+    """
+
+    def __init__(self, timeout, max_size, statistics):
+        """
+        Initializes a new instance of the fragmentation.Reassembler class.
+
+        @param timeout Time to wait for all the fragments in seconds
+        @param max_size Maximum total size of the incomplete packets in bytes
+        @param statistics metrics.Statistics which counts the dropped packets
+        """
+
+        self.__lock = threading.Lock()
+
+        self.__timeout = timeout
+        self.__max_size = max_size
+        self.__statistics = statistics
+
+        # (Sender address, message identifier) => PartialMessage, oldest first
+        self.__messages = collections.OrderedDict()
+        self.__size = 0
+
+    def add(self, address, data):
+        """
+        Adds the received fragment. Returns the whole packet if this is its
+        last missing fragment, otherwise None.
+        """
+
+        try:
+            _, message_id, index, count = HEADER.unpack_from(data)
+        except struct.error:
+            logging.error("Fragment is in wrong format! (addr = %s:%d)",
+                          address[0], address[1])
+            return None
+
+        if count == 0 or index >= count:
+            logging.error("Fragment is in wrong format! (addr = %s:%d)",
+                          address[0], address[1])
+            return None
+
+        payload = bytes(data[HEADER.size:])
+        key = (address, message_id)
+        now = time.time()
+
+        with self.__lock:
+            self.__remove_expired(now)
+
+            message = self.__messages.get(key)
+            if message is None:
+                message = PartialMessage(now, count)
+                self.__messages[key] = message
+
+            if message.count != count or index in message.fragments:
+                return None  # Duplicated or inconsistent fragment
+
+            message.fragments[index] = payload
+            self.__size += len(payload)
+
+            if len(message.fragments) == count:
+                del self.__messages[key]
+                self.__size -= sum(len(fragment) for fragment
+                                   in message.fragments.values())
+
+                return b"".join(message.fragments[index]
+                                for index in range(count))
+
+            # Keeps the memory usage bounded
+            while self.__size > self.__max_size and \
+                    len(self.__messages) > 0:
+                logging.warning("Too many incomplete packets, drop the "
+                                "oldest one")
+                self.__remove_oldest("fragments_dropped")
+
+            return None
+
+    def __remove_expired(self, now):
+        """
+        Removes the incomplete packets which have waited too long.
+        """
+
+        while len(self.__messages) > 0:
+            message = next(iter(self.__messages.values()))
+            if now - message.start_time < self.__timeout:
+                break
+
+            logging.warning("Fragments have not arrived in time, drop "
+                            "the packet")
+            self.__remove_oldest("fragments_expired")
+
+    def __remove_oldest(self, counter_name):
+        """
+        Removes the oldest incomplete packet.
+        """
+
+        _, message = self.__messages.popitem(last=False)
+        self.__size -= sum(len(fragment)
+                           for fragment in message.fragments.values())
+        self.__statistics.increase(counter_name)
+
+
+class PartialMessage(object):
+    """
+    Packet whose fragments are being received.
+    All fields are public and directly accessible by the reassembler.
+    """
+
+    def __init__(self, start_time, count):
+        self.start_time = start_time
+        self.count = count
+        self.fragments = dict()  # Index => payload
@@ -0,0 +1,189 @@
+import logging
+import random
+import threading
+
+
+def make_peer_key(addr):
+    """
+    Returns the key of the rules of the peer: the address as a tuple, or
+    (socket path, 0) for the path of an AF_UNIX socket, like the address of
+    a sender over AF_UNIX.
+    """
+
+    if isinstance(addr, (str, bytes)):
+        return (addr, 0)
+
+    return tuple(addr)
+
+
+class Impairment(object):
+    """
+    Emulates an imperfect network on the outgoing datagrams of a node, so
+    that the timeouts, retransmissions and packet dispatching can be tested
+    and measured locally without any special kernel tool.
+
+    Every datagram to a peer follows the rule of that peer, or the default
+    rule (see ImpairmentRule): it may be lost, delayed (with jitter),
+    duplicated or held back so that the next datagrams overtake it. The
+    datagrams to a partitioned peer are all lost. The rules and the
+    partition can be changed at any time; without any rule or partition
+    the datagrams are sent directly.
+
+    Usage: impairment = Impairment(statistics)
+        impairment.set_rule(ImpairmentRule(loss=0.1), addr)
+        impairment.set_partition([addr])
+        impairment.send(datagram, addr, sock.sendto)
+    """
+
+    def __init__(self, statistics):
+        """
+        Initializes a new instance of the impairment.Impairment class.
+
+        @param statistics metrics.Statistics which counts the impaired
+                          datagrams
+        """
+
+        self.__lock = threading.Lock()
+        self.__statistics = statistics
+
+        self.__default_rule = None
+        self.__rules = dict()  # Peer address => ImpairmentRule
+        self.__partition = frozenset()
+
+        self.__enabled = False
+
+    def set_rule(self, rule, addr=None):
+        """
+        Sets the rule of the datagrams to the peer, or the default rule if
+        the address is None. A None rule removes the rule.
+        """
+
+        with self.__lock:
+            if addr is None:
+                self.__default_rule = rule
+            elif rule is None:
+                self.__rules.pop(make_peer_key(addr), None)
+            else:
+                self.__rules[make_peer_key(addr)] = rule
+
+            self.__update_enabled()
+
+    def set_partition(self, addr_list):
+        """
+        Cuts this node off from the specified peers. An empty list heals the
+        partition.
+        """
+
+        with self.__lock:
+            self.__partition = frozenset(make_peer_key(addr)
+                                         for addr in addr_list)
+            self.__update_enabled()
+
+    def clear(self):
+        """
+        Removes all the rules and heals the partition.
+        """
+
+        with self.__lock:
+            self.__default_rule = None
+            self.__rules = dict()
+            self.__partition = frozenset()
+            self.__update_enabled()
+
+    def send(self, datagram, addr, send_func, call_later=None):
+        """
+        Sends the datagram to the peer through send_func(datagram, addr)
+        according to the rules.
+
+        @param call_later call_later(delay, func, *args) which calls the
+                          function after the delay (default: a timer
+                          thread), e.g. loop.call_later of an event loop
+        """
+
+        if not self.__enabled:
+            send_func(datagram, addr)
+            return
+
+        with self.__lock:
+            key = make_peer_key(addr)
+            partitioned = key in self.__partition
+            rule = self.__rules.get(key, self.__default_rule)
+
+        if partitioned:
+            self.__statistics.increase("impaired_partitioned")
+            return
+
+        if rule is None:
+            send_func(datagram, addr)
+            return
+
+        if random.random() < rule.loss:
+            self.__statistics.increase("impaired_lost")
+            return
+
+        copies = 1
+        if random.random() < rule.duplicate:
+            self.__statistics.increase("impaired_duplicated")
+            copies = 2
+
+        for _ in range(copies):
+            delay = max(0.0, rule.delay +
+                        random.uniform(-rule.jitter, rule.jitter))
+
+            if random.random() < rule.reorder:
+                self.__statistics.increase("impaired_reordered")
+                delay += rule.reorder_delay
+
+            if delay <= 0.0:
+                send_func(datagram, addr)
+            elif call_later is None:
+                timer = threading.Timer(delay, self.__send_delayed,
+                                        (datagram, addr, send_func))
+                timer.daemon = True
+                timer.start()
+            else:
+                call_later(delay, self.__send_delayed,
+                           datagram, addr, send_func)
+
+    @staticmethod
+    def __send_delayed(datagram, addr, send_func):
+        """
+        Sends the delayed datagram. The error cannot be reported to the
+        sender anymore, the datagram is considered lost.
+        """
+
+        try:
+            send_func(datagram, addr)
+        except OSError:
+            logging.warning("Cannot send delayed datagram")
+
+    def __update_enabled(self):
+        """
+        Updates whether any datagram may be impaired.
+        """
+
+        self.__enabled = self.__default_rule is not None or \
+            len(self.__rules) > 0 or len(self.__partition) > 0
+
+
+class ImpairmentRule(object):
+    """
+    Impairment of the datagrams to a peer.
+    All fields are public and directly accessible by the impairment layer.
+
+    @param loss Probability that a datagram is lost (0.0 - 1.0)
+    @param delay Mean delay of a datagram in seconds
+    @param jitter Maximum deviation from the mean delay in seconds
+    @param duplicate Probability that a datagram is sent twice
+    @param reorder Probability that a datagram is held back by reorder_delay
+    @param reorder_delay Additional delay of a held back datagram in seconds
+    """
+
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, duplicate=0.0,
+                 reorder=0.0, reorder_delay=0.01):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
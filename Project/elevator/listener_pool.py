@@ -0,0 +1,288 @@
+import logging
+import os
+import json
+import socket
+import struct
+import threading
+import time
+import multiprocessing
+import collections
+import codec
+import fragmentation
+
+
+# Header of a packet forwarded by a worker to the owner (network byte
+# order): magic byte, IPv4 address and port of the original sender
+FORWARD_MAGIC = 0xB9
+FORWARD_HEADER = struct.Struct("!B4sH")
+
+
+def make_replica_key(packet_type, data, sender=None):
+    """
+    Returns the key of the replicated reply of the request. The sender
+    address is part of the key only if given, for the packet types whose
+    reply depends on the sender.
+    """
+
+    if sender is not None:
+        packet_type += "@%s:%d" % (sender[0], sender[1])
+
+    return packet_type + ":" + json.dumps(data, sort_keys=True)
+
+
+class ListenerPool(object):
+    """
+    Pool of worker processes listening to the same UDP port as the owner
+    (SO_REUSEPORT), so that the kernel spreads the incoming packets over
+    several processes and cores.
+
+    The workers answer the read-only requests from the replicated replies
+    sent by the owner (see update_replica) as long as they are recent
+    enough. All the other packets (mutating requests, unknown or outdated
+    read-only requests, fragments) are forwarded to the owner, which
+    handles them as if they had been received directly and replies to the
+    original sender from the shared port. The owner replicates the reply of
+    a read-only request when it handles one (replica_updates), so the
+    replies are only refreshed while they are requested and the handlers
+    are never called without a request; a worker drops the outdated replies
+    and keeps at most replica_size of them. The packet handlers of the
+    replicated packet types must not change any state.
+
+    The owner already runs threads when the pool is started, so the workers
+    are started as new interpreters (spawn), never as forked copies of the
+    owner whose locks may be held by another thread.
+
+    A worker exits as soon as the owner process has gone: the owner holds
+    the only write end of a pipe read by all the workers, which is closed by
+    the system when the owner exits, whatever the cause.
+
+    Usage: pool = ListenerPool(port, buffer_size, process_count,
+                               replicated_packets, max_age, size,
+                               per_sender_packets, statistics)
+        pool.start(on_forwarded)  # on_forwarded(address, data)
+        <read-only request handled> pool.update_replica(packet_type, data,
+                                                        resp_data, sender)
+    """
+
+    def __init__(self, port, buffer_size, process_count, replicated_packets,
+                 replica_max_age, replica_size, per_sender_packets,
+                 statistics):
+        """
+        Initializes a new instance of the listener_pool.ListenerPool class.
+
+        @param port Port shared by the owner and the workers
+        @param buffer_size Maximum size of the received datagrams
+        @param process_count Number of worker processes
+        @param replicated_packets Read-only packet types answered by the
+                                  workers
+        @param replica_max_age Maximum age of a replicated reply in seconds
+        @param replica_size Maximum number of replicated replies per worker
+        @param per_sender_packets Packet types whose reply depends on the
+                                  sender (see make_replica_key)
+        @param statistics metrics.Statistics which counts the forwarded
+                          packets and the replica updates
+        """
+
+        self.__port = port
+        self.__buffer_size = buffer_size
+        self.__process_count = process_count
+        self.__replicated_packets = frozenset(replicated_packets)
+        self.__replica_max_age = replica_max_age
+        self.__replica_size = replica_size
+        self.__per_sender_packets = frozenset(per_sender_packets)
+        self.__statistics = statistics
+
+        self.__forward = None
+        self.__owner_writer = None  # Never written, closed at exit
+        self.__connections = list()
+        self.__connections_lock = threading.Lock()
+
+    def start(self, on_forwarded):
+        """
+        Starts the worker processes and the thread which receives the packets
+        forwarded by them.
+        """
+
+        logging.debug("Start %d listener processes (port = %d)",
+                      self.__process_count, self.__port)
+
+        self.__forward = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__forward.bind(("127.0.0.1", 0))
+
+        context = multiprocessing.get_context("spawn")
+        owner_reader, self.__owner_writer = context.Pipe(False)
+
+        for _ in range(self.__process_count):
+            connection, worker_connection = context.Pipe()
+
+            process = context.Process(
+                target=_worker_main,
+                args=(self.__port, self.__buffer_size,
+                      self.__forward.getsockname(), self.__replica_max_age,
+                      self.__replica_size, self.__per_sender_packets,
+                      worker_connection, owner_reader, self.__owner_writer),
+                daemon=True)
+            process.start()
+
+            worker_connection.close()
+            self.__connections.append(connection)
+
+        owner_reader.close()
+
+        threading.Thread(target=self.__forward_listening_thread,
+                         args=(on_forwarded,), daemon=True).start()
+
+    def update_replica(self, packet_type, data, resp_data, sender):
+        """
+        Sends the current reply of the request of the sender to all the
+        workers, if its packet type is replicated.
+        """
+
+        # The pool is not started, or the packet type is not replicated
+        if self.__forward is None or \
+                packet_type not in self.__replicated_packets:
+            return
+
+        if packet_type not in self.__per_sender_packets:
+            sender = None
+
+        update = (make_replica_key(packet_type, data, sender), resp_data,
+                  time.time())
+
+        with self.__connections_lock:
+            for connection in self.__connections:
+                try:
+                    connection.send(update)
+                except OSError:
+                    logging.error("Cannot update the replica of "
+                                  "a listener process")
+
+        self.__statistics.increase("replica_updates")
+
+    def __forward_listening_thread(self, on_forwarded):
+        """
+        Thread which receives the packets forwarded by the workers.
+        """
+
+        buf = bytearray(self.__buffer_size + FORWARD_HEADER.size)
+        view = memoryview(buf)
+
+        while True:
+            size, _ = self.__forward.recvfrom_into(buf)
+
+            try:
+                magic, ip_address, port = FORWARD_HEADER.unpack_from(buf)
+            except struct.error:
+                magic = None
+
+            if magic != FORWARD_MAGIC:
+                logging.error("Forwarded packet is in wrong format!")
+                continue
+
+            self.__statistics.increase("packets_forwarded")
+
+            # The packet is copied since the buffer is reused
+            on_forwarded((socket.inet_ntoa(ip_address), port),
+                         bytes(view[FORWARD_HEADER.size:size]))
+
+
+def _worker_main(port, buffer_size, forward_address, replica_max_age,
+                 replica_size, per_sender_packets, connection, owner_reader,
+                 owner_writer):
+    """
+    Main function of a worker process.
+    """
+
+    # Only the owner keeps the write end (a forked worker inherits it), so
+    # that the read end is at its end as soon as the owner has gone
+    owner_writer.close()
+
+    # Key => (reply data, time), oldest update first
+    replicas = collections.OrderedDict()
+
+    def owner_watching_thread():
+        try:
+            owner_reader.recv()
+        except (EOFError, OSError):
+            pass
+
+        logging.debug("Owner has gone, stop listener process")
+        os._exit(0)
+
+    def replica_updating_thread():
+        while True:
+            try:
+                key, resp_data, update_time = connection.recv()
+            except (EOFError, OSError):
+                os._exit(0)
+
+            replicas.pop(key, None)
+            replicas[key] = (resp_data, update_time)
+
+            # Drops the replies which cannot be used any more
+            while len(replicas) > 0:
+                _, (_, oldest_time) = next(iter(replicas.items()))
+                if len(replicas) <= replica_size and \
+                        time.time() - oldest_time <= replica_max_age:
+                    break
+                replicas.popitem(last=False)
+
+    threading.Thread(target=owner_watching_thread, daemon=True).start()
+    threading.Thread(target=replica_updating_thread, daemon=True).start()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+
+    while True:
+        size, address = sock.recvfrom_into(buf)
+        data = view[:size]
+
+        resp = _reply_from_replica(replicas, address, data, replica_max_age,
+                                   per_sender_packets, buffer_size)
+        if resp is not None:
+            sock.sendto(resp, address)
+            continue
+
+        header = FORWARD_HEADER.pack(
+            FORWARD_MAGIC, socket.inet_aton(address[0]), address[1])
+        sock.sendto(header + data, forward_address)
+
+
+def _reply_from_replica(replicas, address, data, replica_max_age,
+                        per_sender_packets, buffer_size):
+    """
+    Returns the encoded reply of the request from its replicated reply, or
+    None if the request must be handled by the owner.
+    """
+
+    if fragmentation.is_fragment(data):
+        return None
+
+    try:
+        packet = codec.decode(data)
+    except ValueError:
+        return None
+
+    if packet.kind != codec.PacketKind.Request or packet.request_id is None:
+        return None
+
+    sender = None
+    if packet.packet_type in per_sender_packets:
+        sender = address
+
+    replica = replicas.get(
+        make_replica_key(packet.packet_type, packet.data, sender))
+    if replica is None or time.time() - replica[1] > replica_max_age:
+        return None
+
+    resp = packet.codec.encode(codec.Packet(
+        codec.PacketKind.Reply, packet.packet_type, packet.request_id,
+        replica[0]))
+    if len(resp) > buffer_size:
+        return None
+
+    return resp
@@ -0,0 +1,456 @@
+import logging
+import threading
+import time
+import random
+import math
+import enum
+
+
+# Maximum number of changes piggybacked on one message
+MAX_UPDATES = 16
+
+
+class MemberState(enum.IntEnum):
+    """
+    States of a member of the group, in the order of precedence of the
+    updates with the same incarnation number:
+      - Alive: the member answers the probes
+      - Suspect: the member has not answered a direct nor an indirect probe
+      - Dead: the member has been suspected for too long
+    """
+
+    Alive = 0
+    Suspect = 1
+    Dead = 2
+
+
+def is_valid_address(value):
+    """
+    Returns whether the value of a message is an address [ip, port].
+    """
+
+    return isinstance(value, (list, tuple)) and len(value) == 2 and \
+        isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def is_valid_message(message, fields=()):
+    """
+    Returns whether the received message (probe or reply) is well-formed,
+    so that a broken or hostile packet cannot stop the probing nor the
+    network handler threads. The additional fields must be addresses.
+    """
+
+    if not isinstance(message, dict) or \
+            not is_valid_address(message.get("from")) or \
+            not isinstance(message.get("incarnation", 0), int) or \
+            not isinstance(message.get("updates"), list):
+        return False
+
+    for name in fields:
+        if not is_valid_address(message.get(name)):
+            return False
+
+    for update in message["updates"]:
+        if not isinstance(update, (list, tuple)) or len(update) != 4 or \
+                not is_valid_address(update[:2]) or \
+                not isinstance(update[2], int) or \
+                update[2] not in list(MemberState) or \
+                not isinstance(update[3], int):
+            return False
+
+    return True
+
+
+class Membership(object):
+    """
+    Gossip membership and failure detection (SWIM). Every period, the node
+    probes one member in round-robin order ("network_gossip_ping"). If the
+    member does not answer in time, some other members are asked to probe
+    it as well ("network_gossip_ping_req"), so that a lost packet or a bad
+    link between two nodes does not make a member suspected. A member which
+    answers none of them is suspected, and declared dead when it has not
+    refuted the suspicion within the suspect timeout.
+
+    The changes of the member states are piggybacked on the probes and
+    their replies, every change a few times (multiplier * log2 of the group
+    size), so all the nodes get the same view of the group with a constant
+    number of messages per node and period. Every change carries the
+    incarnation number of the member: a member which learns that it is
+    suspected or dead increases its incarnation number and announces that
+    it is alive; it announces it again when it hears an older claim. Every
+    message also carries the incarnation number of its sender, so a member
+    which answers with a newer incarnation than the known one is alive,
+    whatever view has been gossiped before. The incarnation number starts
+    from the start time, so that a restarted node overrides its old death.
+
+    The members are identified by their configured addresses. The states
+    are soft, they are neither transactional nor exported to the backup
+    process.
+
+    Usage: membership = Membership(address, member_list, period,
+                                   ack_timeout, indirect_probes,
+                                   suspect_timeout, retransmit_mult,
+                                   statistics)
+        membership.start(send_packets)  # send_packets(packet_list, timeout)
+        <"network_gossip_ping" handler> membership.on_ping_received(data)
+        <"network_gossip_ping_req" handler> membership.on_ping_req_received
+        membership.get_state(addr)
+    """
+
+    def __init__(self, address, member_list, period, ack_timeout,
+                 indirect_probes, suspect_timeout, retransmit_mult,
+                 statistics):
+        """
+        Initializes a new instance of the membership.Membership class.
+
+        @param address Configured address of this node
+        @param member_list Configured addresses of all the members
+        @param period Time between two probes in seconds
+        @param ack_timeout Time to wait for the reply of a probe in seconds
+        @param indirect_probes Number of members asked to probe a member
+                               which has not answered
+        @param suspect_timeout Time after which a suspected member is
+                               declared dead in seconds
+        @param retransmit_mult Multiplier of the number of times a change
+                               is piggybacked
+        @param statistics metrics.Statistics which counts the probes
+        """
+
+        self.__lock = threading.Lock()
+
+        self.__address = tuple(address)
+        self.__period = period
+        self.__ack_timeout = ack_timeout
+        self.__indirect_probes = indirect_probes
+        self.__suspect_timeout = suspect_timeout
+        self.__statistics = statistics
+
+        self.__send_packets = None
+
+        self.__incarnation = int(time.time())
+
+        # Address => Member, all the members except this node
+        self.__members = {tuple(addr): Member()
+                          for addr in member_list
+                          if tuple(addr) != self.__address}
+
+        # Address => [state, incarnation, remaining transmissions]
+        self.__updates = dict()
+        self.__max_transmissions = retransmit_mult * max(
+            1, int(math.ceil(math.log2(len(self.__members) + 2))))
+
+        self.__probe_list = list()
+
+    def start(self, send_packets):
+        """
+        Starts probing the members.
+
+        @param send_packets send_packets(packet_list, timeout) function of
+                            the network module
+        """
+
+        logging.debug("Start gossip membership (%d members)",
+                      len(self.__members))
+
+        self.__send_packets = send_packets
+
+        # Announces that this node is alive (again)
+        with self.__lock:
+            self.__queue_update(self.__address, MemberState.Alive,
+                                self.__incarnation)
+
+        threading.Thread(target=self.__probing_thread, daemon=True).start()
+
+    def get_state(self, addr):
+        """
+        Returns the state of the member (MemberState), or None if the address
+        is not a member.
+        """
+
+        with self.__lock:
+            if tuple(addr) == self.__address:
+                return MemberState.Alive
+
+            member = self.__members.get(tuple(addr))
+            return member.state if member is not None else None
+
+    def get_members(self):
+        """
+        Returns the states of all the other members: address => MemberState.
+        """
+
+        with self.__lock:
+            return {addr: member.state
+                    for (addr, member) in self.__members.items()}
+
+    def on_ping_received(self, data):
+        """
+        Called when a member has probed this node. Returns the reply, or
+        False if the probe is not well-formed.
+        """
+
+        if not self.__check_message(data):
+            return False
+
+        self.__merge(data)
+        return self.__make_message(data["from"])
+
+    def on_ping_req_received(self, data):
+        """
+        Called when a member asks this node to probe another member. Returns
+        the reply, whose "ack" tells whether the member has answered, or
+        False if the request is not well-formed.
+        """
+
+        if not self.__check_message(data, ("target",)):
+            return False
+
+        self.__merge(data)
+
+        target = tuple(data["target"])
+        resp = self.__ping(target)
+
+        reply = self.__make_message(data["from"])
+        reply["ack"] = resp
+        return reply
+
+    def __probing_thread(self):
+        """
+        Thread which probes one member every period.
+        """
+
+        while True:
+            start_time = time.time()
+
+            self.__expire_suspects(start_time)
+
+            target = self.__next_target()
+            if target is not None:
+                self.__probe(target)
+
+            time.sleep(max(0.0, self.__period - (time.time() - start_time)))
+
+    def __next_target(self):
+        """
+        Returns the next member to probe. The members are probed in a random
+        order, every member once per round.
+        """
+
+        if len(self.__probe_list) == 0:
+            self.__probe_list = list(self.__members.keys())
+            random.shuffle(self.__probe_list)
+
+        if len(self.__probe_list) == 0:
+            return None
+
+        return self.__probe_list.pop()
+
+    def __probe(self, target):
+        """
+        Probes the member directly, then indirectly through other members,
+        and suspects it if none of them has an answer.
+        """
+
+        self.__statistics.increase("gossip_probes")
+
+        if self.__ping(target):
+            return
+
+        # Asks other members to probe it
+        with self.__lock:
+            helper_list = [addr for (addr, member) in self.__members.items()
+                           if addr != target and
+                           member.state == MemberState.Alive]
+
+        helper_list = random.sample(
+            helper_list, min(self.__indirect_probes, len(helper_list)))
+
+        if len(helper_list) > 0:
+            logging.debug("Probe %s:%d indirectly", target[0], target[1])
+            self.__statistics.increase("gossip_indirect_probes")
+
+            packet_list = list()
+            for addr in helper_list:
+                message = self.__make_message(addr)
+                message["target"] = list(target)
+                packet_list.append((addr, "network_gossip_ping_req",
+                                    message))
+
+            # The helpers wait for the ack timeout themselves
+            resp_list = self.__send_packets(packet_list,
+                                            self.__ack_timeout * 3)
+
+            acked = False
+            for resp in resp_list:
+                if resp is not False and self.__check_message(resp):
+                    self.__merge(resp)
+                    acked = acked or resp.get("ack") is True
+
+            if acked:
+                return
+
+        with self.__lock:
+            member = self.__members[target]
+            if member.state == MemberState.Alive:
+                logging.warning("Member %s:%d is suspected",
+                                target[0], target[1])
+                self.__statistics.increase("gossip_suspected")
+                self.__apply(target, MemberState.Suspect, member.incarnation)
+
+    def __ping(self, target):
+        """
+        Sends a probe to the member, returns whether it has answered.
+        """
+
+        resp = self.__send_packets(
+            [(target, "network_gossip_ping", self.__make_message(target))],
+            self.__ack_timeout)[0]
+
+        if resp is False or not self.__check_message(resp):
+            return False
+
+        self.__merge(resp)
+        return True
+
+    def __check_message(self, message, fields=()):
+        """
+        Returns whether the received message is well-formed, counts the
+        broken ones.
+        """
+
+        if is_valid_message(message, fields):
+            return True
+
+        logging.warning("Gossip message is not well-formed, ignore it")
+        self.__statistics.increase("gossip_invalid_messages")
+        return False
+
+    def __expire_suspects(self, now):
+        """
+        Declares dead the members which have been suspected for too long.
+        """
+
+        with self.__lock:
+            for (addr, member) in self.__members.items():
+                if member.state == MemberState.Suspect and \
+                        now - member.change_time >= self.__suspect_timeout:
+                    logging.warning("Member %s:%d is dead", addr[0], addr[1])
+                    self.__statistics.increase("gossip_dead")
+                    self.__apply(addr, MemberState.Dead, member.incarnation)
+
+    def __make_message(self, peer):
+        """
+        Returns a probe message (or reply) to the peer with the piggybacked
+        changes. The state of the peer is always included if it is not
+        alive, so that it can refute it.
+        """
+
+        peer = tuple(peer)
+
+        with self.__lock:
+            update_list = sorted(self.__updates.items(),
+                                 key=lambda item: -item[1][2])
+            update_list = update_list[:MAX_UPDATES]
+
+            updates = list()
+            for (addr, update) in update_list:
+                updates.append([addr[0], addr[1], update[0], update[1]])
+
+                update[2] -= 1
+                if update[2] <= 0:
+                    del self.__updates[addr]
+
+            member = self.__members.get(peer)
+            if member is not None and member.state != MemberState.Alive and \
+                    peer not in self.__updates:
+                updates.append([peer[0], peer[1], member.state,
+                                member.incarnation])
+
+            return {"from": list(self.__address),
+                    "incarnation": self.__incarnation, "updates": updates}
+
+    def __merge(self, message):
+        """
+        Applies the changes piggybacked on the received message.
+        """
+
+        with self.__lock:
+            # The sender is alive with its own incarnation
+            sender = tuple(message["from"])
+            member = self.__members.get(sender)
+            incarnation = message.get("incarnation")
+            if member is not None and incarnation is not None and \
+                    incarnation > member.incarnation:
+                if member.state != MemberState.Alive:
+                    logging.info("Member %s:%d is Alive", sender[0],
+                                 sender[1])
+                self.__apply(sender, MemberState.Alive, incarnation)
+
+            for (ip_address, port, state, incarnation) in message["updates"]:
+                addr = (ip_address, port)
+                state = MemberState(state)
+
+                if addr == self.__address:
+                    if state == MemberState.Alive:
+                        continue
+
+                    if incarnation >= self.__incarnation:
+                        # Refutes the suspicion
+                        logging.warning("This node is considered %s, "
+                                        "refute it", state.name)
+                        self.__statistics.increase("gossip_refuted")
+                        self.__incarnation = incarnation + 1
+
+                    # An older claim is still around => Announces again
+                    # that this node is alive
+                    self.__queue_update(self.__address, MemberState.Alive,
+                                        self.__incarnation)
+                    continue
+
+                member = self.__members.get(addr)
+                if member is None:
+                    continue  # Not a member
+
+                # A higher incarnation always wins; with the same one, the
+                # worse state wins
+                if (incarnation, state) > (member.incarnation, member.state):
+                    if state != member.state:
+                        logging.info("Member %s:%d is %s", addr[0], addr[1],
+                                     state.name)
+                    self.__apply(addr, state, incarnation)
+
+    def __apply(self, addr, state, incarnation):
+        """
+        Changes the state of the member and disseminates the change.
+        Must be called with the lock held.
+        """
+
+        member = self.__members[addr]
+        if member.state != state:
+            member.change_time = time.time()
+
+        member.state = state
+        member.incarnation = incarnation
+
+        self.__queue_update(addr, state, incarnation)
+
+    def __queue_update(self, addr, state, incarnation):
+        """
+        Queues the change to be piggybacked on the next messages.
+        Must be called with the lock held.
+        """
+
+        self.__updates[addr] = [int(state), incarnation,
+                                self.__max_transmissions]
+
+
+class Member(object):
+    """
+    View of a member of the group.
+    All fields are public and directly accessible by the membership module.
+    """
+
+    def __init__(self):
+        self.state = MemberState.Alive
+        self.incarnation = 0
+        self.change_time = time.time()
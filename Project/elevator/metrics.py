@@ -0,0 +1,326 @@
+import threading
+import collections
+
+
+# Packet type of the packets which cannot be decoded
+UNKNOWN_PACKET_TYPE = "unknown"
+
+
+class Statistics(object):
+    """
+    Thread-safe collection of run-time measurements of a module. Three kinds
+    of measurements are supported:
+      - Counter: number of events, only increased (e.g. packets sent)
+      - Gauge: the last value of a quantity (e.g. queue depth)
+      - Sample: series of measured values (e.g. latency), summarized by
+        count, min, max, mean and percentiles of the recent values
+
+    Usage: stats = Statistics()
+        stats.increase("sent")
+        stats.set_gauge("queue_depth", 3)
+        stats.add_sample("latency", 0.002)
+        stats.get()  => {"counters": ..., "gauges": ..., "samples": ...}
+    """
+
+    def __init__(self, window_size=1000):
+        """
+        Initializes a new instance of the metrics.Statistics class.
+
+        @param window_size Number of recent values kept per sample series
+                           to calculate the percentiles
+        """
+
+        self.__lock = threading.Lock()
+        self.__window_size = window_size
+
+        self.__counters = dict()
+        self.__gauges = dict()
+        self.__samples = dict()
+
+    def increase(self, name, value=1):
+        """
+        Increases the specified counter.
+        """
+
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """
+        Sets the current value of the specified gauge.
+        """
+
+        with self.__lock:
+            self.__gauges[name] = value
+
+    def add_sample(self, name, value):
+        """
+        Adds a measured value to the specified sample series.
+        """
+
+        with self.__lock:
+            series = self.__samples.get(name)
+            if series is None:
+                series = SampleSeries(self.__window_size)
+                self.__samples[name] = series
+
+            series.add(value)
+
+    def get_counter(self, name):
+        """
+        Returns the current value of the specified counter (0 if the counter
+        has never been increased).
+        """
+
+        with self.__lock:
+            return self.__counters.get(name, 0)
+
+    def get(self):
+        """
+        Returns a snapshot of all the measurements in serializable format.
+        """
+
+        with self.__lock:
+            return {
+                "counters": dict(self.__counters),
+                "gauges": dict(self.__gauges),
+                "samples": {name: series.summarize()
+                            for (name, series) in self.__samples.items()},
+            }
+
+    def reset(self):
+        """
+        Removes all the measurements.
+        """
+
+        with self.__lock:
+            self.__counters.clear()
+            self.__gauges.clear()
+            self.__samples.clear()
+
+
+class TrafficStatistics(object):
+    """
+    Run-time measurements of the traffic of the network module, per peer and
+    packet type:
+      - Requests sent to the peer: requests_sent, replies_received,
+        timeouts, round trip time of the replied requests (rtt)
+      - Requests received from the peer: requests_received, replies_sent
+      - Both ways: bytes_sent, bytes_received, decode_errors
+    and the time spent in the packet handlers per packet type (handler_time,
+    handled). The datagrams of a retransmitted request are counted every
+    time, its round trip time is not measured (Karn's algorithm). The
+    loopback transport does not count any byte.
+
+    Usage: traffic = TrafficStatistics()
+        traffic.on_request_sent(addr, packet_type, len(packet_bytes))
+        traffic.on_reply_received(addr, packet_type, rtt)
+        traffic.on_handled(packet_type, handler_time)
+        traffic.get_peers()  => {"<ip>:<port>": {<packet type>: ...}}
+        traffic.get_handlers()  => {<packet type>: ...}
+    """
+
+    def __init__(self, window_size=1000):
+        """
+        Initializes a new instance of the metrics.TrafficStatistics class.
+
+        @param window_size Number of recent values kept per sample series
+                           to calculate the percentiles
+        """
+
+        self.__lock = threading.Lock()
+        self.__window_size = window_size
+
+        # (peer address, packet type) => Statistics
+        self.__peers = dict()
+        # Packet type => Statistics
+        self.__handlers = dict()
+
+    def on_request_sent(self, addr, packet_type, size):
+        """
+        Called when a request (or its retransmission) has been sent.
+        """
+
+        statistics = self.__get_peer(addr, packet_type)
+        statistics.increase("requests_sent")
+        statistics.increase("bytes_sent", size)
+
+    def on_reply_received(self, addr, packet_type, rtt=None):
+        """
+        Called when the reply of a request has been received.
+
+        @param rtt Round trip time in seconds, None if the request has been
+                   retransmitted
+        """
+
+        statistics = self.__get_peer(addr, packet_type)
+        statistics.increase("replies_received")
+        if rtt is not None:
+            statistics.add_sample("rtt", rtt)
+
+    def on_request_timeout(self, addr, packet_type):
+        """
+        Called when a request has not been replied in time.
+        """
+
+        self.__get_peer(addr, packet_type).increase("timeouts")
+
+    def on_request_received(self, addr, packet_type, size):
+        """
+        Called when a request has been received and decoded.
+        """
+
+        statistics = self.__get_peer(addr, packet_type)
+        statistics.increase("requests_received")
+        statistics.increase("bytes_received", size)
+
+    def on_reply_sent(self, addr, packet_type, size):
+        """
+        Called when the reply of a request has been encoded to send.
+        """
+
+        statistics = self.__get_peer(addr, packet_type)
+        statistics.increase("replies_sent")
+        statistics.increase("bytes_sent", size)
+
+    def on_bytes_received(self, addr, packet_type, size):
+        """
+        Called when the reply of a request has been received from a socket.
+        """
+
+        self.__get_peer(addr, packet_type).increase("bytes_received", size)
+
+    def on_decode_error(self, addr, packet_type=None):
+        """
+        Called when a packet from the peer cannot be decoded. The packet type
+        may be unknown.
+        """
+
+        self.__get_peer(addr, packet_type).increase("decode_errors")
+
+    def on_handled(self, packet_type, handler_time):
+        """
+        Called when the packet handler has returned.
+        """
+
+        with self.__lock:
+            statistics = self.__handlers.get(packet_type)
+            if statistics is None:
+                statistics = Statistics(self.__window_size)
+                self.__handlers[packet_type] = statistics
+
+        statistics.increase("handled")
+        statistics.add_sample("handler_time", handler_time)
+
+    def get_peers(self):
+        """
+        Returns a snapshot of the measurements of all the peers in
+        serializable format: "<ip>:<port>" => packet type => measurements
+        (see Statistics.get).
+        """
+
+        with self.__lock:
+            items = list(self.__peers.items())
+
+        peers = dict()
+        for ((addr, packet_type), statistics) in items:
+            peer = peers.setdefault("%s:%d" % (addr[0], addr[1]), dict())
+            peer[packet_type] = statistics.get()
+
+        return peers
+
+    def get_handlers(self):
+        """
+        Returns a snapshot of the handler measurements in serializable
+        format: packet type => measurements (see Statistics.get).
+        """
+
+        with self.__lock:
+            items = list(self.__handlers.items())
+
+        return {packet_type: statistics.get()
+                for (packet_type, statistics) in items}
+
+    def reset(self):
+        """
+        Removes all the measurements.
+        """
+
+        with self.__lock:
+            self.__peers.clear()
+            self.__handlers.clear()
+
+    def __get_peer(self, addr, packet_type):
+        """
+        Returns the measurements of the peer and packet type, creates them at
+        the first call.
+        """
+
+        if packet_type is None:
+            packet_type = UNKNOWN_PACKET_TYPE
+
+        key = (tuple(addr), packet_type)
+
+        with self.__lock:
+            statistics = self.__peers.get(key)
+            if statistics is None:
+                statistics = Statistics(self.__window_size)
+                self.__peers[key] = statistics
+
+            return statistics
+
+
+class SampleSeries(object):
+    """
+    Series of measured values. The total count, min, max and mean are
+    calculated from all the values while the percentiles are only calculated
+    from the recent values to bound the memory usage.
+    """
+
+    def __init__(self, window_size):
+        self.__window = collections.deque(maxlen=window_size)
+
+        self.__count = 0
+        self.__total = 0.0
+        self.__min = None
+        self.__max = None
+        self.__last = None
+
+    def add(self, value):
+        """
+        Adds a new value to the series.
+        """
+
+        self.__window.append(value)
+
+        self.__count += 1
+        self.__total += value
+        self.__last = value
+
+        if self.__min is None or value < self.__min:
+            self.__min = value
+        if self.__max is None or value > self.__max:
+            self.__max = value
+
+    def summarize(self):
+        """
+        Returns the summary of the series.
+        """
+
+        values = sorted(self.__window)
+
+        def percentile(ratio):
+            if len(values) == 0:
+                return None
+            return values[min(len(values) - 1, int(ratio * len(values)))]
+
+        return {
+            "count": self.__count,
+            "last": self.__last,
+            "min": self.__min,
+            "max": self.__max,
+            "mean": self.__total / self.__count if self.__count else None,
+            "p50": percentile(0.50),
+            "p90": percentile(0.90),
+            "p99": percentile(0.99),
+        }
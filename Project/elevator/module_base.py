@@ -21,6 +21,7 @@ class ModuleBase(process_pairs.PrimaryBackupSwitchable,
 
         self.__prev_state = None
         self.__can_commit = True
+        self.__read_only = False
 
     def init(self, transaction_manager):
         """
@@ -48,11 +49,26 @@ class ModuleBase(process_pairs.PrimaryBackupSwitchable,
             self.__transaction_manager.join(tid, self)
 
             self.__transaction_id = tid
-            self.__prev_state = copy.deepcopy(self.export_state(tid))
+            self.__read_only = self.__transaction_manager.is_read_only(tid)
             self.__can_commit = True
 
+            # A read-only transaction never changes the state,
+            # so no need to keep the previous one for rollback
+            if self.__read_only:
+                self.__prev_state = None
+            else:
+                self.__prev_state = copy.deepcopy(self.export_state(tid))
+
             logging.debug("Finish joining transaction (tid = %s)", tid)
 
+    def _is_read_only(self, tid):
+        """
+        Gets whether the specified transaction is read-only.
+        """
+
+        self._join_transaction(tid)
+        return self.__read_only
+
     def _get_can_commit(self, tid):
         """
         Gets whether the specified transaction can commit.
@@ -110,7 +126,8 @@ class ModuleBase(process_pairs.PrimaryBackupSwitchable,
         logging.debug("Start aborting the transaction (tid = %s)", tid)
 
         # Recovers the old state and resets the commit flag
-        self.import_state(tid, self.__prev_state)
+        if not self.__read_only:
+            self.import_state(tid, self.__prev_state)
 
         logging.debug("Finish aborting the transaction (tid = %s)", tid)
         self._leave_transaction(tid)
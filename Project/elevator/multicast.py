@@ -0,0 +1,329 @@
+import logging
+import random
+import socket
+import struct
+import threading
+import collections
+import concurrent.futures
+import codec
+import fragmentation
+
+
+# Header of the multicast announcements: magic byte, epoch of the sender,
+# sequence number of the announcement (network byte order)
+ANNOUNCEMENT_MAGIC = 0xBA
+ANNOUNCEMENT_HEADER = struct.Struct("!BII")
+
+# Number of threads asking the senders for the missed announcements
+REPAIR_THREADS = 2
+
+
+class Multicast(object):
+    """
+    Announces packets to all the nodes of the building at once with UDP
+    multicast, without waiting for any reply, and receives the
+    announcements of the other nodes.
+
+    Every announcement carries the epoch (new every start) and a sequence
+    number of its sender. A receiver which sees a gap asks the sender for
+    the missed announcements with a unicast "network_repair" request; the
+    sender keeps the recent announcements for that (see
+    on_repair_received). The missed announcements are asked for in
+    a repair thread; until they have been handled, the later announcements
+    of the same sender wait for them, the other senders do not. A gap
+    larger than the history kept by the sender cannot be repaired: the
+    receiver starts again from the new announcement (multicast_resyncs).
+
+    The announcements are sent from the listening socket of the node, so
+    that the receivers know where to send the repair requests. Only the
+    announcements of the packet types handled by the node are received,
+    they are never replied.
+
+    Usage: multicast = Multicast(group, interface, ttl, history_size,
+                                 packet_codec, buffer_size, reassembler,
+                                 statistics)
+        multicast.start(sock, send_func, is_handled_func, handle_func,
+                        request_func)
+        # send_func(sock, packet_bytes, addr) sends the datagrams
+        # handle_func(address, packet_type, data) handles an announcement
+        # request_func(addr, packet_type, data) returns the response data
+        multicast.publish(packet_type, data)
+        <"network_repair" handler> multicast.on_repair_received
+    """
+
+    def __init__(self, group, interface, ttl, history_size, packet_codec,
+                 buffer_size, reassembler, statistics):
+        """
+        Initializes a new instance of the multicast.Multicast class.
+
+        @param group Address (IP address, port) of the multicast group
+        @param interface IP address of the interface joining the group
+        @param ttl Time-to-live of the announcements
+        @param history_size Number of recent announcements kept for
+                            repairing
+        @param packet_codec Codec of the announcements (see codec)
+        @param buffer_size Maximum size of the received datagrams
+        @param reassembler fragmentation.Reassembler of the announcements
+        @param statistics metrics.Statistics which counts the announcements
+        """
+
+        self.__group = group
+        self.__interface = interface
+        self.__ttl = ttl
+        self.__history_size = history_size
+        self.__codec = packet_codec
+        self.__buffer_size = buffer_size
+        self.__reassembler = reassembler
+        self.__statistics = statistics
+
+        self.__sock = None
+        self.__listening_sock = None
+        self.__send = None
+        self.__is_handled = None
+        self.__handle = None
+        self.__send_request = None
+
+        # A new epoch every time the process starts (e.g. the backup which
+        # has taken over the address of the primary)
+        self.__epoch = random.randrange(1 << 32)
+        self.__sequence = 0
+        self.__sequence_lock = threading.Lock()
+        # (sequence, packet type, data)
+        self.__history = collections.deque(maxlen=history_size)
+
+        # Sender => (epoch, last sequence)
+        self.__received_sequences = dict()
+        # Sender being repaired => [(missed announcements or None, packet
+        # type, data)] waiting to be handled in order
+        self.__repairing = dict()
+        self.__repairing_lock = threading.Lock()
+        self.__repairer = None
+
+    def start(self, sock, send_func, is_handled_func, handle_func,
+              request_func):
+        """
+        Joins the multicast group and listens to the announcements. The
+        announcements are sent from the socket.
+        """
+
+        group, port = self.__group
+        logging.debug("Join multicast group (group = %s:%d)", group, port)
+
+        self.__sock = sock
+        self.__send = send_func
+        self.__is_handled = is_handled_func
+        self.__handle = handle_func
+        self.__send_request = request_func
+
+        interface = socket.inet_aton(self.__interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                        self.__ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+
+        # Many nodes on the same host listen to the same group
+        self.__listening_sock = socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM)
+        self.__listening_sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__listening_sock.bind(("", port))
+        self.__listening_sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+            socket.inet_aton(group) + interface)
+
+        # The repairs wait for the senders, not the listening thread
+        self.__repairer = concurrent.futures.ThreadPoolExecutor(
+            max_workers=REPAIR_THREADS)
+
+        threading.Thread(target=self.__listening_thread, daemon=True).start()
+
+    def is_started(self):
+        """
+        Returns whether the node has joined the multicast group.
+        """
+
+        return self.__listening_sock is not None
+
+    def publish(self, packet_type, data):
+        """
+        Announces the packet to all the nodes in the multicast group.
+        Returns whether the packet has been sent.
+        """
+
+        with self.__sequence_lock:
+            self.__sequence = (self.__sequence + 1) % (1 << 32)
+            self.__history.append((self.__sequence, packet_type, data))
+
+            packet_bytes = ANNOUNCEMENT_HEADER.pack(
+                ANNOUNCEMENT_MAGIC, self.__epoch, self.__sequence) + \
+                self.__codec.encode(codec.Packet(
+                    codec.PacketKind.Request, packet_type, self.__sequence,
+                    data))
+
+        try:
+            self.__send(self.__sock, packet_bytes, self.__group)
+        except (OSError, ValueError):
+            logging.error("Cannot publish the packet! "
+                          "(packet_type = \"%s\")", packet_type)
+            return False
+
+        self.__statistics.increase("multicast_sent")
+        return True
+
+    def on_repair_received(self, tid, address, data):
+        """
+        Called when another node asks for the announcements it has missed.
+        Returns the ones still kept in the history, none if they have been
+        announced in another epoch.
+        """
+
+        first = data["first"]
+        count = data["count"]
+
+        with self.__sequence_lock:
+            if data.get("epoch") != self.__epoch:
+                return []
+
+            return [[sequence, packet_type, announced_data]
+                    for (sequence, packet_type, announced_data)
+                    in self.__history
+                    if (sequence - first) % (1 << 32) < count]
+
+    def __listening_thread(self):
+        """
+        Thread which receives the announcements of the other nodes.
+        """
+
+        logging.debug("Start listening to announcements")
+
+        # The announcements are handled one by one, one buffer is enough
+        buf = bytearray(self.__buffer_size)
+        view = memoryview(buf)
+
+        while True:
+            size, address = self.__listening_sock.recvfrom_into(buf)
+            data = view[:size]
+
+            if fragmentation.is_fragment(data):
+                data = self.__reassembler.add(address, data)
+                if data is None:
+                    continue
+
+            try:
+                magic, epoch, sequence = \
+                    ANNOUNCEMENT_HEADER.unpack_from(data)
+                packet = codec.decode(data[ANNOUNCEMENT_HEADER.size:])
+            except (struct.error, ValueError):
+                magic = None
+                packet = None
+
+            if magic != ANNOUNCEMENT_MAGIC or packet is None or \
+                    packet.kind != codec.PacketKind.Request:
+                logging.error("Announcement is in wrong format! "
+                              "(addr = %s:%d, data = %s)",
+                              address[0], address[1], bytes(data))
+                continue
+
+            # Only the announcements this node is interested in
+            if not self.__is_handled(packet.packet_type):
+                continue
+
+            self.__statistics.increase("multicast_received")
+            self.__receive_announcement(address, epoch, sequence,
+                                        packet.packet_type, packet.data)
+
+    def __receive_announcement(self, address, epoch, sequence, packet_type,
+                               data):
+        """
+        Handles the announcement after the missed ones (if any) of the same
+        sender. Old and duplicated announcements are dropped. A sender with
+        a new epoch (restarted, or the backup which has taken over) starts
+        a new sequence, the previous one is forgotten.
+        """
+
+        missed = None
+        last = self.__received_sequences.get(address)
+
+        if last is not None and last[0] != epoch:
+            logging.warning("Sender has a new epoch, start again from its "
+                            "announcement (addr = %s:%d)",
+                            address[0], address[1])
+            self.__statistics.increase("multicast_resyncs")
+        elif last is not None:
+            distance = (sequence - last[1]) % (1 << 32)
+
+            if distance == 0 or distance >= (1 << 31):
+                logging.debug("Old announcement, drop it (addr = %s:%d)",
+                              address[0], address[1])
+                self.__statistics.increase("multicast_duplicates")
+                return
+
+            if distance > self.__history_size + 1:
+                logging.warning("Missed %d announcements, too many to "
+                                "repair (addr = %s:%d)", distance - 1,
+                                address[0], address[1])
+                self.__statistics.increase("multicast_resyncs")
+            elif distance > 1:
+                missed = (epoch, (last[1] + 1) % (1 << 32), distance - 1)
+
+        self.__received_sequences[address] = (epoch, sequence)
+
+        with self.__repairing_lock:
+            waiting = self.__repairing.get(address)
+            if waiting is not None or missed is not None:
+                if waiting is None:
+                    waiting = self.__repairing[address] = list()
+                    self.__repairer.submit(self.__repairing_thread, address)
+
+                waiting.append((missed, packet_type, data))
+                return
+
+        self.__handle(address, packet_type, data)
+
+    def __repairing_thread(self, address):
+        """
+        Thread which handles the waiting announcements of the sender in
+        order, after the missed ones.
+        """
+
+        while True:
+            with self.__repairing_lock:
+                waiting = self.__repairing[address]
+                if len(waiting) == 0:
+                    del self.__repairing[address]
+                    return
+
+                self.__repairing[address] = list()
+
+            for (missed, packet_type, data) in waiting:
+                # A broken repair must not stop the announcements
+                if missed is not None:
+                    try:
+                        self.__repair_announcements(address, *missed)
+                    except Exception as error:
+                        logging.error("Cannot repair the announcements "
+                                      "(addr = %s:%d, error = %s)",
+                                      address[0], address[1], error)
+
+                self.__handle(address, packet_type, data)
+
+    def __repair_announcements(self, address, epoch, first, count):
+        """
+        Asks the sender for the missed announcements and handles them.
+        """
+
+        logging.warning("Missed %d announcements, ask for them "
+                        "(addr = %s:%d)", count, address[0], address[1])
+        self.__statistics.increase("multicast_gaps")
+
+        missed_list = self.__send_request(
+            address, "network_repair",
+            {"epoch": epoch, "first": first, "count": count})
+        if missed_list is False:
+            logging.error("Cannot repair the announcements (addr = %s:%d)",
+                          address[0], address[1])
+            return
+
+        for (_, packet_type, data) in missed_list:
+            self.__statistics.increase("multicast_repaired")
+            self.__handle(address, packet_type, data)
@@ -1,12 +1,34 @@
 import logging
+import os
 import socket
-import json
 import threading
 import time
 import random
+import collections
+import json
+import concurrent.futures
 import process_pairs
 import transaction
 import core
+import metrics
+import codec
+import peer_health
+import fragmentation
+import buffer_pool
+import listener_pool
+import transport
+import impairment
+import membership
+import multicast
+import admission
+
+
+# Response of a request which the receiver has not admitted because it is
+# busy (see Network.send_packets)
+BUSY = object()
+
+# Number of threads handling the network's own packets (e.g. gossip probes)
+INTERNAL_HANDLER_THREADS = 2
 
 
 class Network(process_pairs.PrimaryBackupSwitchable):
@@ -18,11 +40,86 @@ class Network(process_pairs.PrimaryBackupSwitchable):
     All the packets have packet type which determines the type of content
     and which packet handler network module would "forward" to.
 
-    JSON-encoded packet format:
-        {
-          "type": "packet type",
-          "data": packet_data
-        }
+    The packets are encoded by the configured codec; incoming packets in
+    any format are accepted and replied in the same format (see codec).
+    Every request carries an identifier which is copied to the reply, so
+    many requests can be in flight at the same time from one client socket;
+    a late reply is dropped (late_replies_dropped).
+
+    The other features are described where they are implemented:
+      - Peer health: the reply timeout follows the round-trip time of the
+        peer, a circuit breaker stops the requests to a dead peer and the
+        idempotent packet types are retransmitted (see peer_health and
+        send_packets).
+        A retransmitted request is answered from the response cache, so
+        the handler runs at most once (see ResponseCache).
+      - Handler queue: incoming packets wait in a bounded queue for the
+        handler threads. Under overload, identical packets are coalesced,
+        expired and sheddable packets are dropped and the protected packets
+        go first; a request must also be admitted by the limits of its
+        packet type, otherwise it is answered with a busy reply (see
+        admission).
+      - Packets larger than network.buffer_size are fragmented (see
+        fragmentation), the packets are received into reusable buffers
+        (see buffer_pool).
+      - Notifications are delivered in the background and retried (see
+        notify).
+      - Announcements to the whole building with UDP multicast, repaired by
+        the receivers (see multicast).
+      - Transports: the network modules of the same process can be reached
+        without sockets (see transport), the nodes on the same host over
+        AF_UNIX datagram sockets, the other peers over UDP.
+      - Listener processes share the port and answer the read-only packet
+        types from replicated replies (see listener_pool).
+      - Gossip membership of the nodes (see membership).
+      - Traffic measurements and diagnostics (see metrics and
+        get_diagnostics), impairment of the outgoing datagrams for tests
+        (see impairment).
+    Multicast, the loopback transport, AF_UNIX sockets and the listener
+    processes are not supported by async_network.AsyncNetwork.
+
+    Optional configuration (default in parentheses):
+        - network.codec: json or binary (json)
+        - network.min_timeout, network.breaker_failures,
+          network.breaker_probe_period: bounds of the peer health, see
+          peer_health.PeerHealth (0.05, 3, 1.0), network.timeout is the
+          maximum reply timeout
+        - network.retransmit_packets: comma-separated list of idempotent
+          packet types (none), network.retransmit_attempts (2)
+        - network.response_cache_size: 0 disables (256)
+        - network.handler_threads (4), network.handler_queue_size (64)
+        - network.sheddable_packets, network.protected_packets,
+          network.coalesced_packets: comma-separated lists of packet types
+          shed first, handled first, or whose identical read-only requests
+          share one handler call (none)
+        - network.shed_threshold: queue fill ratio above which the
+          sheddable packets are dropped (0.5)
+        - network.rate_limits, network.concurrency_limits: comma-separated
+          lists of <packet type>:<limit>, see admission.parse_limits (none)
+        - network.reassembly_timeout (network.timeout),
+          network.reassembly_memory: in bytes per socket (1048576)
+        - network.notify_threads (2), network.notify_attempts (3),
+          network.notify_retry_delay: doubled every retry (0.1)
+        - network.multicast_group: e.g. 239.0.0.1 (none, disabled),
+          network.multicast_port (12400), network.multicast_interface
+          (0.0.0.0), network.multicast_ttl (1), network.multicast_history:
+          announcements kept for repairing (64)
+        - network.transport: udp or loopback (udp),
+          network.loopback_latency, network.loopback_loss (0.0)
+        - network.unix_socket_dir: directory of the AF_UNIX sockets of the
+          nodes on this host (none, disabled)
+        - network.listener_processes (0, disabled),
+          network.replicated_packets, network.replica_per_sender_packets:
+          comma-separated lists of packet types (none),
+          network.replica_max_age (0.5), network.replica_size (64)
+        - network.gossip_members: comma-separated list of node names (none,
+          disabled), network.gossip_period (0.5), network.gossip_ack_timeout
+          (0.2), network.gossip_indirect_probes (3),
+          network.gossip_suspect_timeout (2.0),
+          network.gossip_retransmit_mult (3)
+        - network.impairment_loss, network.impairment_delay,
+          network.impairment_jitter, network.impairment_duplicate,
+          network.impairment_reorder: see impairment.ImpairmentRule (0.0)
     """
 
     def __init__(self):
@@ -34,12 +131,86 @@ class Network(process_pairs.PrimaryBackupSwitchable):
         self.__address = None
         self.__timeout = 0.0
         self.__buffer_size = 0
+        self.__handler_threads = 0
+        self.__handler_queue_size = 0
+        self.__codec = None
+        self.__breaker_failures = 0
+        self.__breaker_probe_period = 0.0
+        self.__min_timeout = 0.0
+        self.__retransmit_packets = set()
+        self.__retransmit_attempts = 0
+        self.__reassembly_timeout = 0.0
+        self.__reassembly_memory = 0
+        self.__coalesced_packets = set()
+        self.__unix_socket_dir = None
+        self.__notify_threads = 0
+        self.__notify_attempts = 0
+        self.__notify_retry_delay = 0.0
 
         # States
         self.__handler_list = dict()
+        # Handlers of the network's own packets, called without transaction
+        self.__internal_handler_list = dict()
+        self.__diagnostics_list = dict()  # Name => function
 
         self.__server = None
 
+        self.__client = None
+        self.__client_lock = threading.Lock()
+
+        self.__request_id = random.randrange(1 << 30)
+        self.__request_id_lock = threading.Lock()
+        # Request identifier => (future, peer address, packet type)
+        self.__waiting_replies = dict()
+        self.__waiting_replies_lock = threading.Lock()
+
+        self.__peers = dict()  # Peer address => peer_health.PeerHealth
+        self.__peers_lock = threading.Lock()
+
+        self.__response_cache = None
+
+        self.__multicast = None
+
+        self.__fragmenter = None
+        self.__server_reassembler = None
+        self.__client_reassembler = None
+
+        self.__buffer_pool = None
+
+        self.__notifier = None
+
+        self.__loopback = None
+
+        # The network's own packets do not wait behind the packet handlers
+        self.__internal_handlers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=INTERNAL_HANDLER_THREADS)
+        self.__internal_pending = 0
+        self.__internal_pending_lock = threading.Lock()
+
+        self.__impairment = None
+
+        self.__membership = None
+
+        self.__unix_server = None
+        self.__unix_client = None
+        self.__unix_peers = dict()  # Peer address => (path, check time)
+        self.__unix_peers_lock = threading.Lock()
+
+        self.__listener_pool = None
+
+        self.__admission = None
+
+        # Item of the queued packets: (buffer, coalescing key)
+        self.__packet_queue = None
+        # Coalescing key => [(address, decoded request)] waiting for the
+        # reply of the queued request with the same key
+        self.__coalesced_requests = dict()
+        self.__packet_queue_lock = threading.Condition()
+
+        self.__statistics = metrics.Statistics()
+        self.__traffic = metrics.TrafficStatistics()
+        self.__transport_name = None
+
     def init(self, config, transaction_manager):
         """
         Initializes the network module.
@@ -61,6 +232,156 @@ class Network(process_pairs.PrimaryBackupSwitchable):
 
         self.__timeout = config.get_float("network", "timeout", 0.5)
         self.__buffer_size = config.get_int("network", "buffer_size", 1024)
+        self.__handler_threads = config.get_int(
+            "network", "handler_threads", 4)
+        self.__handler_queue_size = config.get_int(
+            "network", "handler_queue_size", 64)
+        self.__codec = codec.get_codec(
+            config.get_value("network", "codec", "json"))
+        self.__breaker_failures = config.get_int(
+            "network", "breaker_failures", 3)
+        self.__breaker_probe_period = config.get_float(
+            "network", "breaker_probe_period", 1.0)
+        self.__min_timeout = config.get_float(
+            "network", "min_timeout", 0.05)
+        self.__retransmit_packets = set(
+            packet_type.strip() for packet_type
+            in config.get_value("network", "retransmit_packets", "").split(",")
+            if packet_type.strip() != "")
+        self.__retransmit_attempts = config.get_int(
+            "network", "retransmit_attempts", 2)
+
+        self.__response_cache = ResponseCache(config.get_int(
+            "network", "response_cache_size", 256))
+
+        self.__reassembly_timeout = config.get_float(
+            "network", "reassembly_timeout", self.__timeout)
+        self.__reassembly_memory = config.get_int(
+            "network", "reassembly_memory", 1 << 20)
+
+        self.__fragmenter = fragmentation.Fragmenter(self.__buffer_size)
+        self.__server_reassembler = self._new_reassembler()
+        self.__client_reassembler = self._new_reassembler()
+
+        self.__admission = admission.AdmissionControl(
+            admission.parse_limits(
+                config.get_value("network", "rate_limits", ""), float),
+            admission.parse_limits(
+                config.get_value("network", "concurrency_limits", ""), int),
+            self.__statistics)
+        self.__packet_queue = admission.AdmissionQueue(
+            self.__handler_queue_size,
+            config.get_float("network", "shed_threshold", 0.5),
+            [packet_type.strip() for packet_type
+             in config.get_value("network", "sheddable_packets", "").split(",")
+             if packet_type.strip() != ""],
+            [packet_type.strip() for packet_type
+             in config.get_value("network", "protected_packets", "").split(",")
+             if packet_type.strip() != ""],
+            self.__statistics)
+        self.__coalesced_packets = set(
+            packet_type.strip() for packet_type
+            in config.get_value("network", "coalesced_packets", "").split(",")
+            if packet_type.strip() != "")
+
+        self.__buffer_pool = buffer_pool.BufferPool(
+            self.__buffer_size,
+            self.__handler_threads + self.__handler_queue_size + 1)
+
+        self.__unix_socket_dir = config.get_value(
+            "network", "unix_socket_dir", "")
+
+        member_names = [
+            name.strip() for name
+            in config.get_value("network", "gossip_members", "").split(",")
+            if name.strip() != ""]
+        if len(member_names) > 0:
+            self.__membership = membership.Membership(
+                self.__address,
+                [(config.get_value("network", "%s.ip_address" % name,
+                                   "127.0.0.1"),
+                  config.get_int("network", "%s.port" % name))
+                 for name in member_names],
+                config.get_float("network", "gossip_period", 0.5),
+                config.get_float("network", "gossip_ack_timeout", 0.2),
+                config.get_int("network", "gossip_indirect_probes", 3),
+                config.get_float("network", "gossip_suspect_timeout", 2.0),
+                config.get_int("network", "gossip_retransmit_mult", 3),
+                self.__statistics)
+
+            # The probes must not wait for the transaction slot
+            self.__internal_handler_list["network_gossip_ping"] = \
+                self.__membership.on_ping_received
+            self.__internal_handler_list["network_gossip_ping_req"] = \
+                self.__membership.on_ping_req_received
+
+        self.__internal_handler_list["network_diagnostics_get"] = \
+            self.__on_diagnostics_requested
+
+        self.__impairment = impairment.Impairment(self.__statistics)
+        rule = impairment.ImpairmentRule(
+            loss=config.get_float("network", "impairment_loss", 0.0),
+            delay=config.get_float("network", "impairment_delay", 0.0),
+            jitter=config.get_float("network", "impairment_jitter", 0.0),
+            duplicate=config.get_float(
+                "network", "impairment_duplicate", 0.0),
+            reorder=config.get_float("network", "impairment_reorder", 0.0))
+        if rule.loss > 0.0 or rule.delay > 0.0 or rule.jitter > 0.0 or \
+                rule.duplicate > 0.0 or rule.reorder > 0.0:
+            logging.warning("Outgoing packets are impaired!")
+            self.__impairment.set_rule(rule)
+
+        self.__notify_threads = config.get_int(
+            "network", "notify_threads", 2)
+        self.__notify_attempts = config.get_int(
+            "network", "notify_attempts", 3)
+        self.__notify_retry_delay = config.get_float(
+            "network", "notify_retry_delay", 0.1)
+
+        self.__notifier = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.__notify_threads)
+
+        transport_name = config.get_value("network", "transport", "udp")
+        self.__transport_name = transport_name
+        if transport_name == "loopback":
+            self.__loopback = transport.LoopbackTransport(
+                config.get_float("network", "loopback_latency", 0.0),
+                config.get_float("network", "loopback_loss", 0.0),
+                self.__handler_threads, INTERNAL_HANDLER_THREADS)
+        elif transport_name != "udp":
+            raise RuntimeError("Unknown transport: %s" % transport_name)
+
+        listener_processes = config.get_int(
+            "network", "listener_processes", 0)
+        if listener_processes > 0:
+            self.__listener_pool = listener_pool.ListenerPool(
+                self.__address[1], self.__buffer_size, listener_processes,
+                [packet_type.strip() for packet_type
+                 in config.get_value(
+                     "network", "replicated_packets", "").split(",")
+                 if packet_type.strip() != ""],
+                config.get_float("network", "replica_max_age", 0.5),
+                config.get_int("network", "replica_size", 64),
+                [packet_type.strip() for packet_type
+                 in config.get_value(
+                     "network", "replica_per_sender_packets", "").split(",")
+                 if packet_type.strip() != ""],
+                self.__statistics)
+
+        multicast_group = config.get_value("network", "multicast_group", "")
+        if multicast_group != "":
+            self.__multicast = multicast.Multicast(
+                (multicast_group,
+                 config.get_int("network", "multicast_port", 12400)),
+                config.get_value(
+                    "network", "multicast_interface", "0.0.0.0"),
+                config.get_int("network", "multicast_ttl", 1),
+                config.get_int("network", "multicast_history", 64),
+                self.__codec, self.__buffer_size, self._new_reassembler(),
+                self.__statistics)
+
+            self.add_packet_handler("network_repair",
+                                    self.__multicast.on_repair_received)
 
         logging.debug("Finish initializing network module")
 
@@ -75,6 +396,8 @@ class Network(process_pairs.PrimaryBackupSwitchable):
         # Opens a socket
         logging.debug("Open a UDP socket")
         self.__server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.__listener_pool is not None:
+            self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         while True:
             try:
@@ -88,14 +411,140 @@ class Network(process_pairs.PrimaryBackupSwitchable):
                 time.sleep(1)
                 continue
 
+        # Starts the listener processes before any other thread
+        if self.__listener_pool is not None:
+            self.__listener_pool.start(self.__receive_forwarded_packet)
+
+        # Starts the packet handler threads
+        logging.debug("Create %d packet handler threads",
+                      self.__handler_threads)
+        for _ in range(self.__handler_threads):
+            threading.Thread(target=self.__packet_handler_thread,
+                             daemon=True).start()
+
         # Starts listening to incoming packets
         logging.debug("Create new thread to listen to incoming packets")
         listening = threading.Thread(
-            target=self.__server_listening_thread, daemon=True)
+            target=self.__server_listening_thread, args=(self.__server,),
+            daemon=True)
         listening.start()
 
+        if self.__unix_socket_dir != "":
+            self.__start_unix_sockets()
+
+        if self.__multicast is not None:
+            # The announcements are sent from the listening socket, so that
+            # the receivers know where to send the repair requests
+            self.__multicast.start(
+                self.__server, self.__sendto,
+                lambda packet_type: packet_type in self.__handler_list,
+                self.__handle_announcement, self.send_packet)
+
+        if self.__loopback is not None:
+            # The network's own packets do not wait behind the others
+            self.__loopback.register(self.__address,
+                                     self.__handle_loopback_request,
+                                     self.__internal_handler_list.keys())
+
+        self._start_membership()
+
         logging.debug("Finish activating UDP server")
 
+    def __start_unix_sockets(self):
+        """
+        Opens the AF_UNIX sockets which receive the requests and the replies
+        from the nodes on the same host. The requests to the peers on the
+        same host which listen to such a socket are sent through it instead
+        of UDP (see __send_to_peer); a sender over AF_UNIX is identified by
+        the address (socket path, 0).
+        """
+
+        logging.debug("Open AF_UNIX sockets (directory = %s)",
+                      self.__unix_socket_dir)
+
+        os.makedirs(self.__unix_socket_dir, exist_ok=True)
+
+        self.__unix_server = self.__open_unix_socket(
+            self.__get_unix_path(self.__address[1]))
+        self.__unix_client = self.__open_unix_socket(
+            self.__get_unix_path(self.__address[1]) + ".client")
+
+        threading.Thread(target=self.__server_listening_thread,
+                         args=(self.__unix_server,), daemon=True).start()
+        threading.Thread(target=self.__client_listening_thread,
+                         args=(self.__unix_client,), daemon=True).start()
+
+    @staticmethod
+    def __open_unix_socket(path):
+        """
+        Opens an AF_UNIX datagram socket bound to the path. The socket file
+        left by a previous process (e.g. the dead primary) is removed.
+        """
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+
+        return sock
+
+    def __get_unix_path(self, port):
+        """
+        Returns the path of the AF_UNIX socket of the node listening to
+        the port on this host.
+        """
+
+        return os.path.join(self.__unix_socket_dir, "network-%d.sock" % port)
+
+    def __get_unix_peer(self, addr):
+        """
+        Returns the path of the AF_UNIX socket of the peer, or None if the
+        peer is on another host or does not listen to such a socket.
+        """
+
+        if self.__unix_client is None or \
+                addr[0] not in ("127.0.0.1", "localhost", self.__address[0]):
+            return None
+
+        now = time.time()
+
+        with self.__unix_peers_lock:
+            path, check_time = self.__unix_peers.get(addr, (None, 0.0))
+
+            if path is None and \
+                    now - check_time >= self.__breaker_probe_period:
+                path = self.__get_unix_path(addr[1])
+                if not os.path.exists(path):
+                    path = None
+
+                self.__unix_peers[addr] = (path, now)
+
+            return path
+
+    def __send_to_peer(self, packet_bytes, addr):
+        """
+        Sends the request through the AF_UNIX socket of the peer if it is on
+        the same host, otherwise over UDP. When sending to the socket fails,
+        the packet is sent over UDP (unix_fallbacks) and the socket of the
+        peer is checked again after network.breaker_probe_period.
+        """
+
+        path = self.__get_unix_peer(addr)
+        if path is not None:
+            try:
+                self.__sendto(self.__unix_client, packet_bytes, path, addr)
+                return
+            except OSError:
+                logging.warning("Cannot send to AF_UNIX socket, use UDP "
+                                "(addr = %s:%d)", addr[0], addr[1])
+                self.__statistics.increase("unix_fallbacks")
+
+                with self.__unix_peers_lock:
+                    self.__unix_peers[addr] = (None, time.time())
+
+        self.__sendto(self.__get_client(), packet_bytes, addr)
+
     def export_state(self, tid):
         """
         Implements process_pairs.PrimaryBackupSwitchable interface.
@@ -123,6 +572,211 @@ class Network(process_pairs.PrimaryBackupSwitchable):
 
         logging.debug("Finish adding packet handler")
 
+    def get_statistics(self):
+        """
+        Returns the network counters in serializable format.
+        """
+
+        self.__statistics.set_gauge(
+            "receive_buffers", self.__buffer_pool.get_allocated_count())
+        return self.__statistics.get()
+
+    def get_peer_statistics(self):
+        """
+        Returns the traffic measurements per peer and packet type in
+        serializable format (see metrics.TrafficStatistics.get_peers).
+        """
+
+        return self.__traffic.get_peers()
+
+    def get_handler_statistics(self):
+        """
+        Returns the time spent in the packet handlers per packet type in
+        serializable format (see metrics.TrafficStatistics.get_handlers).
+        """
+
+        return self.__traffic.get_handlers()
+
+    def add_diagnostics(self, name, get_func):
+        """
+        Adds the measurements of another module (e.g. the replication
+        telemetry of process_pairs.ProcessPair) to the diagnostics, see
+        get_diagnostics.
+
+        @param name Key of the measurements in the diagnostics
+        @param get_func Function which returns the measurements in
+                        serializable format, called without transaction
+        """
+
+        self.__diagnostics_list[name] = get_func
+
+    def get_diagnostics(self):
+        """
+        Returns all the measurements of the node in serializable format,
+        with the codec and the transport they have been measured with, and
+        those of the other modules added with add_diagnostics. This is also
+        the reply of the "network_diagnostics_get" packet.
+        """
+
+        diagnostics = {
+            "address": "%s:%d" % (self.__address[0], self.__address[1]),
+            "codec": self.__codec.name,
+            "transport": self.__transport_name,
+            "statistics": self.get_statistics(),
+            "peers": self.get_peer_statistics(),
+            "handlers": self.get_handler_statistics(),
+        }
+
+        for (name, get_func) in self.__diagnostics_list.items():
+            diagnostics[name] = get_func()
+
+        return diagnostics
+
+    def is_multicast_enabled(self):
+        """
+        Returns whether the packets can be announced with multicast (the
+        multicast group is configured and the module has been started).
+        """
+
+        return self.__multicast is not None and \
+            self.__multicast.is_started()
+
+    def publish_packet(self, packet_type, data):
+        """
+        Announces the packet to all the nodes in the multicast group without
+        waiting for any reply. Returns whether the packet has been sent.
+        The announcements are handled by the registered packet handlers of
+        the receivers (in a new transaction), see multicast.Multicast.
+        """
+
+        if not self.is_multicast_enabled():
+            logging.error("Multicast is not enabled, cannot publish packet "
+                          "(packet_type = \"%s\")", packet_type)
+            return False
+
+        return self.__multicast.publish(packet_type, data)
+
+    def _start_membership(self):
+        """
+        Starts probing the members of the gossip membership group, if
+        enabled. The packet handlers must already receive the packets.
+        """
+
+        if self.__membership is not None:
+            self.__membership.start(self._send_probes)
+
+    def _is_internal_packet(self, packet_type):
+        """
+        Returns whether the packet type is handled by the network itself
+        (e.g. gossip probes), without admission and transaction.
+        """
+
+        return packet_type in self.__internal_handler_list
+
+    def _send_probes(self, packet_list, timeout):
+        """
+        Sends the probes of the gossip membership and waits for the replies
+        until the timeout. Unlike send_packets, the probes are sent once,
+        even to a peer whose circuit breaker is open, and the result does
+        not change the health of the peer (see get_peer_state), so that
+        a slow probe cannot make a peer unavailable. The probes are handled
+        by the internal handler threads, ahead of the queued packets.
+        """
+
+        return self.__send_requests(packet_list, timeout, probe=True)
+
+    def is_membership_enabled(self):
+        """
+        Returns whether the node takes part in the gossip membership group
+        (see membership.Membership).
+        """
+
+        return self.__membership is not None
+
+    def get_member_state(self, addr):
+        """
+        Returns the state (membership.MemberState) of the specified node in
+        the gossip membership group, or None if the membership is disabled
+        or the node is not a member.
+        """
+
+        if self.__membership is None:
+            return None
+
+        return self.__membership.get_state(addr)
+
+    def get_members(self):
+        """
+        Returns the states of all the other members of the gossip membership
+        group: address => membership.MemberState (empty if disabled).
+        """
+
+        if self.__membership is None:
+            return dict()
+
+        return self.__membership.get_members()
+
+    def get_impairment(self):
+        """
+        Returns the impairment layer (impairment.Impairment) of the outgoing
+        datagrams, whose rules and partition can be changed at runtime.
+        The rule of a peer reached over AF_UNIX is looked up by its
+        configured address for the requests, and by its sender address
+        (socket path, 0) for the replies.
+        """
+
+        return self.__impairment
+
+    def get_peer_state(self, addr):
+        """
+        Returns the circuit breaker state (peer_health.BreakerState) of the
+        specified node.
+        """
+
+        return self._get_peer_health(addr).get_state()
+
+    def _get_peer_health(self, addr):
+        """
+        Returns the health tracker of the specified node.
+        """
+
+        with self.__peers_lock:
+            peer = self.__peers.get(addr)
+            if peer is None:
+                peer = peer_health.PeerHealth(
+                    self.__breaker_failures, self.__breaker_probe_period,
+                    self.__min_timeout, self.__timeout)
+                self.__peers[addr] = peer
+
+            return peer
+
+    def _get_traffic(self):
+        """
+        Returns the traffic measurements (metrics.TrafficStatistics).
+        """
+
+        return self.__traffic
+
+    def _get_retransmit_attempts(self, packet_type):
+        """
+        Returns the maximum number of retransmissions of the packet type
+        (0 if the packet type is not idempotent).
+        """
+
+        if packet_type in self.__retransmit_packets:
+            return self.__retransmit_attempts
+
+        return 0
+
+    def _get_retransmit_timeout(self, timeout):
+        """
+        Returns the timeout of the next retransmission: the previous timeout
+        doubled and randomized, so that the retransmissions of many senders
+        do not arrive at the same time.
+        """
+
+        return min(timeout * 2, self.__timeout) * random.uniform(0.75, 1.25)
+
     def send_packet(self, addr, packet_type, data):
         """
         Sends the packet to other node. The packet includes data as well as
@@ -136,58 +790,710 @@ class Network(process_pairs.PrimaryBackupSwitchable):
             - The receiver must reply the packet, even just answers "1".
             - Anything wrong (timeout, lost connection, no reply) is considered
               failed and returns False.
+            - After some consecutive failures, the packets to that node fail
+              immediately until the node replies a probe packet again (see
+              get_peer_state).
+            - The time to wait for the reply depends on the measured
+              round-trip time of the node.
         """
 
         logging.debug(
             "Start sending packet (addr = %s:%d, packet_type = \"%s\")",
             addr[0], addr[1], packet_type)
 
+        resp_data = self.__send_requests([(addr, packet_type, data)])[0]
+
+        logging.debug("Finish sending packet")
+
+        return resp_data
+
+    def send_packets(self, packet_list, timeout=None, busy=False):
+        """
+        Sends many packets at the same time and waits for the replies until
+        the same deadline, so that a dead node only costs one timeout for
+        the whole list instead of one timeout per packet.
+
+        @param packet_list list of (addr, packet_type, data) tuples
+        @param timeout time to wait for all the replies in seconds
+                       (default: network timeout), the requests to fast
+                       nodes may fail earlier
+        @param busy response of a packet which the receiver has not admitted
+                    because it is busy (default False, BUSY to tell it apart
+                    from a failure)
+        @return list of the response data in the same order as the packets.
+                The response of a packet which has failed or not been replied
+                before the deadline is False.
+
+        The requests of the idempotent packet types are retransmitted until
+        the deadline. A busy reply proves that the receiver is alive, the
+        request is not retransmitted (busy_replies).
+        """
+
+        logging.debug("Start sending %d packets", len(packet_list))
+
+        resp_list = self.__send_requests(packet_list, timeout, busy)
+
+        logging.debug("Finish sending %d packets", len(packet_list))
+
+        return resp_list
+
+    def broadcast_packet(self, addr_list, packet_type, data, timeout=None,
+                         busy=False):
+        """
+        Sends the same packet to all the specified nodes at the same time.
+        See send_packets.
+        """
+
+        return self.send_packets(
+            [(addr, packet_type, data) for addr in addr_list], timeout, busy)
+
+    def notify(self, addr, packet_type, data, callback=None):
+        """
+        Sends the packet to the specified node in the background and returns
+        immediately. The packet is sent again if it has not been replied,
+        see network.notify_attempts. When the delivery is finished,
+        callback(success) is called from a notifier thread, where success
+        is False if the packet has not been delivered.
+
+        The notifications are sent by a small pool of notifier threads, so
+        that the caller and its transaction do not wait for the round trip.
+        The notified packet handlers must be idempotent, since the reply of
+        a handled notification may be lost.
+        """
+
+        logging.debug("Notify (addr = %s:%d, packet_type = \"%s\")",
+                      addr[0], addr[1], packet_type)
+
+        self.__notifier.submit(self.__notification_thread,
+                               addr, packet_type, data, callback)
+
+    def __notification_thread(self, addr, packet_type, data, callback):
+        """
+        Delivers the notification, retrying with exponential backoff.
+        """
+
+        success = False
+        delay = self.__notify_retry_delay
+
+        for attempt in range(self.__notify_attempts):
+            if attempt > 0:
+                time.sleep(delay)
+                delay *= 2
+                self.__statistics.increase("notification_retries")
+
+            if self.send_packet(addr, packet_type, data) is not False:
+                success = True
+                break
+
+        if success:
+            self.__statistics.increase("notifications_delivered")
+        else:
+            logging.warning("Cannot deliver notification (addr = %s:%d, "
+                            "packet_type = \"%s\")",
+                            addr[0], addr[1], packet_type)
+            self.__statistics.increase("notifications_failed")
+
+        if callback is not None:
+            try:
+                callback(success)
+            except Exception:
+                logging.exception("Notification callback has failed")
+
+    def __send_requests(self, packet_list, timeout=None, busy=False,
+                        probe=False):
+        """
+        Sends the requests, retransmits the idempotent ones until they are
+        replied and returns the list of the response data (False for failed
+        requests).
+
+        @param timeout deadline of all the requests in seconds
+                       (default: network timeout)
+        @param busy response of the requests which have not been admitted
+        @param probe whether the requests are sent once, without the health
+                     of the peers (see _send_probes)
+        """
+
+        if timeout is None:
+            timeout = self.__timeout
+        deadline = time.time() + timeout
+
+        # Sends all the packets without waiting
+        requests = list()
+        for (addr, packet_type, data) in packet_list:
+            request = PendingRequest(addr, packet_type,
+                                     self._next_request_id(), data)
+
+            # A loopback request may be replied before returning
+            sent_time = time.time()
+            request.packet_bytes, request.future = self.__send_request(
+                addr, request.request_id, packet_type, data, probe)
+
+            if request.future is not None:
+                request.future.add_done_callback(request.on_replied)
+                request.sent_time = sent_time
+                if probe:
+                    request.timeout = timeout
+                else:
+                    request.retries_left = \
+                        self._get_retransmit_attempts(packet_type)
+                    request.timeout = \
+                        self._get_peer_health(addr).get_timeout()
+
+            requests.append(request)
+
+        # Waits for the replies, retransmits the requests which have not been
+        # replied in time
+        logging.debug("Wait for reply from server")
+        while True:
+            pending = [request for request in requests
+                       if request.future is not None and
+                       not request.future.done() and not request.expired]
+            if len(pending) == 0:
+                break
+
+            next_time = min(min(request.sent_time + request.timeout
+                                for request in pending), deadline)
+
+            concurrent.futures.wait(
+                [request.future for request in pending],
+                max(0.0, next_time - time.time()),
+                concurrent.futures.FIRST_COMPLETED)
+
+            now = time.time()
+            if now >= deadline:
+                break
+
+            for request in pending:
+                if request.future.done() or \
+                        now < request.sent_time + request.timeout:
+                    continue
+
+                if request.retries_left == 0:
+                    request.expired = True
+                    continue
+
+                logging.debug(
+                    "Retransmit packet (addr = %s:%d, packet_type = \"%s\")",
+                    request.addr[0], request.addr[1], request.packet_type)
+
+                request.retries_left -= 1
+                request.retransmitted = True
+                request.sent_time = now
+                request.timeout = self._get_retransmit_timeout(
+                    request.timeout)
+                self.__statistics.increase("retransmissions")
+
+                try:
+                    if request.packet_bytes is None:  # Loopback transport
+                        self.__loopback.send_request(
+                            self.__address, request.addr, request.request_id,
+                            request.packet_type, request.data, request.future)
+                    else:
+                        self.__send_to_peer(request.packet_bytes,
+                                            request.addr)
+
+                    self.__traffic.on_request_sent(
+                        request.addr, request.packet_type,
+                        len(request.packet_bytes or b""))
+                except (OSError, ValueError):
+                    logging.error("Cannot retransmit the packet! "
+                                  "(addr = %s:%d, packet_type = \"%s\")",
+                                  request.addr[0], request.addr[1],
+                                  request.packet_type)
+
+        # Collects the replies
+        resp_list = list()
+        for request in requests:
+            if request.future is None:
+                resp_list.append(False)
+                continue
+
+            if probe:
+                # A probe does not change the health of the peer
+                if request.future.done():
+                    resp_list.append(request.future.result())
+                else:
+                    with self.__waiting_replies_lock:
+                        self.__waiting_replies.pop(request.request_id, None)
+                    resp_list.append(False)
+                continue
+
+            peer = self._get_peer_health(request.addr)
+
+            if request.future.done() and request.future.result() is BUSY:
+                # The receiver is alive, the time of the busy reply is not
+                # a sample of its handling time
+                logging.warning("Receiver is busy (addr = %s:%d, "
+                                "packet_type = \"%s\")", request.addr[0],
+                                request.addr[1], request.packet_type)
+                peer.on_success()
+                self.__statistics.increase("busy_replies")
+                resp_list.append(busy)
+                continue
+
+            if request.future.done():
+                peer.on_success()
+                rtt = None
+                if not request.retransmitted:
+                    # Karn's algorithm: the reply of a retransmitted request
+                    # may belong to any of the copies. The reply callback
+                    # may not have been called yet => Now is the reply time
+                    replied_time = request.replied_time or time.time()
+                    rtt = replied_time - request.sent_time
+                    peer.add_rtt_sample(rtt)
+
+                self.__traffic.on_reply_received(
+                    request.addr, request.packet_type, rtt)
+                resp_list.append(request.future.result())
+                continue
+
+            peer.on_failure()
+            self.__traffic.on_request_timeout(request.addr,
+                                              request.packet_type)
+            with self.__waiting_replies_lock:
+                self.__waiting_replies.pop(request.request_id, None)
+
+            logging.error(
+                "Cannot receive reply! (addr = %s:%d, packet_type = \"%s\")",
+                request.addr[0], request.addr[1], request.packet_type)
+            resp_list.append(False)
+
+        return resp_list
+
+    def __send_request(self, addr, request_id, packet_type, data,
+                       probe=False):
+        """
+        Sends the request and returns the encoded packet and the future which
+        will receive the response data (None if the request cannot be sent).
+        A probe is sent whatever the health of the peer.
+        """
+
+        # Fails immediately if the node is considered dead
+        peer = self._get_peer_health(addr)
+        if not probe and not peer.allow_request():
+            logging.debug("Peer is unavailable, drop the packet "
+                          "(addr = %s:%d, packet_type = \"%s\")",
+                          addr[0], addr[1], packet_type)
+            self.__statistics.increase("requests_rejected")
+            return None, None
+
+        if self.__loopback is not None and \
+                self.__loopback.is_registered(addr):
+            future = concurrent.futures.Future()
+            self.__loopback.send_request(self.__address, addr, request_id,
+                                         packet_type, data, future)
+            self.__traffic.on_request_sent(addr, packet_type, 0)
+            return None, future
+
         # Encodes the data to sent
-        packet = {"type": packet_type, "data": data}
-        packet_json = json.dumps(packet)
+        packet_bytes = self._encode_request(request_id, packet_type, data)
 
-        # Sends the packet
-        logging.debug("Open a UDP socket to send packet")
-        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        client.settimeout(self.__timeout)
+        future = concurrent.futures.Future()
+        with self.__waiting_replies_lock:
+            self.__waiting_replies[request_id] = (future, addr, packet_type)
 
+        # Sends the packet
         try:
-            # if random.randrange(0, 100) > 50:  # Not part of system
-            client.sendto(packet_json.encode(), addr)
-        except OSError:
+            self.__send_to_peer(packet_bytes, addr)
+        except (OSError, ValueError):
             logging.error(
                 "Cannot send the packet! (addr = %s:%d, packet_type = \"%s\")",
                 addr[0], addr[1], packet_type)
-            return False
+            if not probe:
+                peer.on_failure()
+
+            with self.__waiting_replies_lock:
+                del self.__waiting_replies[request_id]
+            return packet_bytes, None
+
+        self.__traffic.on_request_sent(addr, packet_type, len(packet_bytes))
+        return packet_bytes, future
+
+    def __get_client(self):
+        """
+        Returns the client socket which sends all the requests. The socket
+        is opened at the first call.
+        """
+
+        with self.__client_lock:
+            if self.__client is None:
+                logging.debug("Open a UDP socket to send packets")
+                self.__client = socket.socket(
+                    socket.AF_INET, socket.SOCK_DGRAM)
+                self.__statistics.increase("sockets_created")
+
+                # The replies are received by a separate thread
+                threading.Thread(target=self.__client_listening_thread,
+                                 args=(self.__client,), daemon=True).start()
+
+            return self.__client
+
+    def __client_listening_thread(self, sock):
+        """
+        Thread which receives the replies from the client socket (UDP or
+        AF_UNIX) and gives them to the waiting requests.
+        """
+
+        logging.debug("Start listening to replies")
+
+        # The replies are handled one by one, one buffer is enough
+        buf = bytearray(self.__buffer_size)
+        view = memoryview(buf)
+
+        while True:
+            size, address = sock.recvfrom_into(buf)
+            if sock.family == socket.AF_UNIX:
+                address = (address, 0)
+
+            resp = view[:size]
+
+            if fragmentation.is_fragment(resp):
+                resp = self.__client_reassembler.add(address, resp)
+                if resp is None:
+                    continue
+
+            reply = self._decode_reply(address, resp)
+            if reply is None:
+                continue
+
+            request_id, resp_data = reply
+            with self.__waiting_replies_lock:
+                waiting = self.__waiting_replies.pop(request_id, None)
+
+            if waiting is None:
+                # The request has timed out
+                logging.warning("Late reply, drop it (addr = %s:%d)",
+                                address[0], address[1])
+                self.__statistics.increase("late_replies_dropped")
+                continue
+
+            future, addr, packet_type = waiting
+            self.__traffic.on_bytes_received(addr, packet_type, len(resp))
+            future.set_result(resp_data)
+
+    def _split_packet(self, packet_bytes):
+        """
+        Returns the list of datagrams to send the packet: the packet itself,
+        or its fragments if it is larger than the buffer size. Throws
+        ValueError if the packet is too large even for fragmentation.
+        """
+
+        return self.__fragmenter.split(packet_bytes)
+
+    def _new_reassembler(self):
+        """
+        Returns a new fragmentation.Reassembler for a receiving socket.
+        """
+
+        return fragmentation.Reassembler(self.__reassembly_timeout,
+                                         self.__reassembly_memory,
+                                         self.__statistics)
+
+    def __sendto(self, sock, packet_bytes, addr, peer=None):
+        """
+        Sends the packet from the socket, in fragments if necessary. The
+        datagrams are impaired by the rule of the peer (default: the
+        destination address).
+        """
+
+        datagram_list = self._split_packet(packet_bytes)
+        if len(datagram_list) > 1:
+            self.__statistics.increase("packets_fragmented")
+
+        if peer is None:
+            for datagram in datagram_list:
+                self.__impairment.send(datagram, addr, sock.sendto)
+        else:
+            for datagram in datagram_list:
+                self.__impairment.send(
+                    datagram, peer,
+                    lambda datagram, _: sock.sendto(datagram, addr))
+
+    def _next_request_id(self):
+        """
+        Returns a new request identifier.
+        """
+
+        with self.__request_id_lock:
+            self.__request_id = (self.__request_id + 1) % (1 << 32)
+            return self.__request_id
+
+    def _encode_request(self, request_id, packet_type, data):
+        """
+        Encodes the packet to send to other node.
+        """
+
+        packet = codec.Packet(
+            codec.PacketKind.Request, packet_type, request_id, data)
+        return self.__codec.encode(packet)
+
+    def _decode_reply(self, addr, resp):
+        """
+        Decodes the reply received from the specified node. Returns the
+        request identifier and the response data (BUSY for a busy reply),
+        or None if the reply is in wrong format.
+        """
 
-        # Receives the respond
-        logging.debug("Wait for reply from server")
         try:
-            resp_json, _ = client.recvfrom(self.__buffer_size)
-        except OSError:
+            reply = codec.decode(resp)
+        except ValueError:
+            reply = None
+
+        if reply is not None and reply.kind == codec.PacketKind.Busy:
+            return reply.request_id, BUSY
+
+        if reply is None or reply.kind != codec.PacketKind.Reply:
             logging.error(
-                "Cannot receive reply! (addr = %s:%d, packet_type = \"%s\")",
-                addr[0], addr[1], packet_type)
-            return False
+                "Response is in wrong format! (addr = %s:%d, "
+                "resp_data = %s)", addr[0], addr[1], bytes(resp))
+            self.__traffic.on_decode_error(addr)
+            return None
+
+        return reply.request_id, reply.data
+
+    def _process_packet(self, address, data):
+        """
+        Decodes the incoming packet and calls the registered packet handler
+        in a new transaction. Returns the encoded reply to send back, or None
+        if the packet cannot be handled.
+
+        Note: the packet handler may block (e.g. waiting for the transaction
+              slot), it must not be called from an event loop.
+
+        A retransmitted request is answered from the response cache
+        (duplicates_replied) or dropped if the first copy is still being
+        handled (duplicates_dropped).
+        """
 
         try:
-            resp_data = json.loads(resp_json.decode())
-        except json.JSONDecodeError:
-            logging.error(
-                "Response is not JSON-encoded format! (addr = %s:%d, "
-                "packet_type = \"%s\", resp_data = \"%s\")",
-                addr[0], addr[1], packet_type, resp_json.decode())
+            packet = codec.decode(data)
+        except ValueError:
+            packet = None
+
+        if packet is None or packet.kind != codec.PacketKind.Request:
+            logging.error("Packet is in wrong format! "
+                          "(addr = %s:%d, data = %s)",
+                          address[0], address[1], bytes(data))
+            self.__traffic.on_decode_error(address,
+                                           codec.peek_packet_type(data))
+            return None
+
+        packet_type = packet.packet_type
+        self.__traffic.on_request_received(address, packet_type, len(data))
+
+        logging.debug(
+            "Received packet (address = %s:%d, packet_type = \"%s\"",
+            address[0], address[1], packet_type)
+
+        if packet.request_id is None:  # Older packet format
+            return self.__handle_request(address, packet)[0]
+
+        # Answers a retransmitted request without calling the handler again
+        key = (address, packet.request_id)
+        is_new, resp = self.__response_cache.begin(key)
+        if not is_new:
+            if resp is None:
+                logging.debug("Request is being handled, drop duplicate "
+                              "(addr = %s:%d)", address[0], address[1])
+                self.__statistics.increase("duplicates_dropped")
+            else:
+                logging.debug("Reply duplicate from the cache "
+                              "(addr = %s:%d)", address[0], address[1])
+                self.__statistics.increase("duplicates_replied")
+
+            return resp
+
+        resp = None
+        busy = False
+        try:
+            resp, busy = self.__handle_request(address, packet)
+        finally:
+            # A busy reply is not cached, a retransmission may be admitted
+            self.__response_cache.finish(key, None if busy else resp)
+
+        return resp
+
+    def __handle_request(self, address, packet):
+        """
+        Calls the packet handler of the decoded request in a new transaction
+        and returns the encoded reply (None if there is no handler) and
+        whether it is a busy reply.
+        """
+
+        packet_type = packet.packet_type
+
+        # Forwards the packet to corresponding module
+        logging.debug("Find and call packet handler")
+        if packet_type not in self.__handler_list and \
+                packet_type not in self.__internal_handler_list:
+            logging.warning(
+                "Unknown packet! (addr = %s:%d, packet_type = \"%s\")",
+                address[0], address[1], packet_type)
+            return None, False
+
+        resp_data = self.__call_handler(address, packet_type, packet.data)
+
+        # Replies in the same format as the request. The older packet format
+        # cannot tell a busy reply from a failure.
+        busy = resp_data is BUSY
+        if not busy:
+            reply = codec.Packet(codec.PacketKind.Reply, packet_type,
+                                 packet.request_id, resp_data)
+        elif packet.request_id is None:
+            reply = codec.Packet(codec.PacketKind.Reply, packet_type,
+                                 None, False)
+        else:
+            reply = codec.Packet(codec.PacketKind.Busy, packet_type,
+                                 packet.request_id, None)
+        resp = packet.codec.encode(reply)
+
+        self.__traffic.on_reply_sent(address, packet_type, len(resp))
+        return resp, busy
+
+    def __call_handler(self, address, packet_type, data):
+        """
+        Calls the packet handler in a new transaction and returns the
+        response data, BUSY if the request has not been admitted, or False
+        if the transaction has failed or the handler has raised an
+        exception. The network's own packets are handled without admission
+        and transaction.
+        """
+
+        try:
+            if packet_type in self.__internal_handler_list:
+                start_time = time.time()
+                resp_data = self.__internal_handler_list[packet_type](data)
+                self.__traffic.on_handled(packet_type,
+                                          time.time() - start_time)
+                return resp_data
+
+            if not self.__admission.admit(packet_type):
+                return BUSY
+
+            try:
+                return self.__call_admitted_handler(
+                    address, packet_type, data)
+            finally:
+                self.__admission.release(packet_type)
+        except Exception as error:
+            logging.error("Packet handler has failed! (addr = %s:%d, "
+                          "packet_type = \"%s\", error = %s)",
+                          address[0], address[1], packet_type, error)
+            self.__statistics.increase("handler_errors")
             return False
 
-        logging.debug("Finish sending packet")
+    def __call_admitted_handler(self, address, packet_type, data):
+        """
+        Calls the packet handler of the admitted request in a new
+        transaction, see __call_handler.
+        """
+
+        start_time = time.time()
+        success, resp_data = self.__call_in_transaction(
+            packet_type, address, data)
+        self.__traffic.on_handled(packet_type, time.time() - start_time)
+
+        if not success:
+            resp_data = False
+        elif self.__listener_pool is not None:
+            self.__listener_pool.update_replica(
+                packet_type, data, resp_data, address)
 
         return resp_data
 
-    def __server_listening_thread(self):
+    def __call_in_transaction(self, packet_type, address, data):
+        """
+        Calls the packet handler in a new transaction, returns whether the
+        transaction has been committed and the response data. If the
+        handler raises an exception, the transaction is aborted (so that
+        the transaction slot is released) and the exception is raised
+        again.
+        """
+
+        tid = self.__transaction_manager.start()
+
+        try:
+            resp_data = self.__handler_list[packet_type](tid, address, data)
+        except Exception:
+            self.__transaction_manager.abort(tid)
+            raise
+
+        return self.__transaction_manager.finish(tid), resp_data
+
+    def __handle_loopback_request(self, address, request_id, packet_type,
+                                  data, reply):
         """
-        Thread which listens to incoming packet. The packet will be processed
-        and replied by one of the registered packet handler functions
-        depends on the packet type.
+        Called in a handler thread of the loopback transport when a network
+        module of this process has sent a request. Handles the request and
+        replies the response data (BUSY if not admitted). A duplicate is
+        answered from the response cache or dropped, as over UDP.
+        """
+
+        self.__statistics.increase("loopback_requests")
+
+        key = (address, request_id)
+        is_new, resp = self.__response_cache.begin(key)
+        if not is_new:
+            if resp is None:
+                self.__statistics.increase("duplicates_dropped")
+            else:
+                self.__statistics.increase("duplicates_replied")
+                reply(resp[0])
+            return
+
+        self.__traffic.on_request_received(address, packet_type, 0)
+
+        # The response data is cached in a tuple, since it may be None
+        resp = None
+        try:
+            if packet_type in self.__handler_list or \
+                    packet_type in self.__internal_handler_list:
+                resp = (self.__call_handler(address, packet_type, data),)
+            else:
+                logging.warning(
+                    "Unknown packet! (addr = %s:%d, packet_type = \"%s\")",
+                    address[0], address[1], packet_type)
+        finally:
+            # A busy reply is not cached, a retransmission may be admitted
+            if resp is not None and resp[0] is BUSY:
+                self.__response_cache.finish(key, None)
+            else:
+                self.__response_cache.finish(key, resp)
+
+        if resp is not None:
+            self.__traffic.on_reply_sent(address, packet_type, 0)
+            reply(resp[0])
+
+    def __handle_announcement(self, address, packet_type, data):
+        """
+        Calls the packet handler of the announcement in a new transaction.
+        """
+
+        if packet_type not in self.__handler_list:
+            return
+
+        try:
+            self.__call_in_transaction(packet_type, address, data)
+        except Exception as error:
+            logging.error("Packet handler has failed! (addr = %s:%d, "
+                          "packet_type = \"%s\", error = %s)",
+                          address[0], address[1], packet_type, error)
+            self.__statistics.increase("handler_errors")
+
+    def __on_diagnostics_requested(self, data):
+        """
+        Called when another node asks for the measurements of this node.
+        """
+
+        return self.get_diagnostics()
+
+    def __server_listening_thread(self, sock):
+        """
+        Thread which listens to incoming packet on the socket (UDP or
+        AF_UNIX). The packet will be processed and replied by one of the
+        registered packet handler functions depends on the packet type.
+        The packets are received into reusable buffers of the pool and
+        decoded directly from them without copying.
         """
 
         logging.debug("Start listening to incoming packet")
@@ -197,66 +1503,401 @@ class Network(process_pairs.PrimaryBackupSwitchable):
             # Waits for incoming packet
             logging.debug("Wait for incoming packet")
 
+            buf = self.__buffer_pool.get()
+
             # try:
-            data, address = self.__server.recvfrom(self.__buffer_size)
+            size, address = sock.recvfrom_into(buf)
             # except OSError:
             #    continue
 
-            threading.Thread(target=self.__handle_incoming_packet,
-                             daemon=True,
-                             args=(address, data,)).start()
+            if sock.family == socket.AF_UNIX:
+                address = (address, 0)
+
+            data = memoryview(buf)[:size]
+
+            if fragmentation.is_fragment(data):
+                # The fragment is copied, the buffer can be reused now
+                data = self.__server_reassembler.add(address, data)
+                self.__buffer_pool.put(buf)
+                if data is None:
+                    continue
+                buf = None
+
+            self.__enqueue_packet(address, data, buf)
 
         logging.debug("Finish listening to incoming packet")
 
-    def __handle_incoming_packet(self, address, data):
+    def __receive_forwarded_packet(self, address, data):
         """
-        Each incoming packet will be handled in a seperate thread to make
-        sure that the server is always ready for incoming packets.
+        Called when a listener process has forwarded a packet received from
+        the address.
         """
 
-        try:
-            packet = json.loads(data.decode())
+        if fragmentation.is_fragment(data):
+            data = self.__server_reassembler.add(address, data)
+            if data is None:
+                return
 
-            packet_type = packet["type"]
-            packet_data = packet["data"]
-        except json.JSONDecodeError:
-            logging.error("Packet is in wrong format! "
-                          "(addr = %s:%d, data = \"%s\")",
-                          address[0], address[1], data.decode())
+        self.__enqueue_packet(address, data, None)
+
+    def __enqueue_packet(self, address, data, buf):
+        """
+        Puts the incoming packet to the queue of the handler threads. The
+        buffer holding the packet (if any) goes back to the pool when the
+        packet is dropped or handled.
+
+        When the handlers cannot keep up:
+          - A packet identical to one waiting in the queue (same sender and
+            content) is coalesced with it (packets_coalesced).
+          - A request of a coalesced packet type with the same data as one
+            waiting in the queue, from any sender, waits for its reply (see
+            __coalesce_request).
+          - The other packets are shed by packet type (see
+            admission.AdmissionQueue).
+        The packet type is read from the header (see
+        codec.peek_packet_type), the network's own packets do not wait in
+        the queue.
+        """
+
+        packet_type = codec.peek_packet_type(data)
+        if packet_type in self.__internal_handler_list:
+            self.__submit_internal_packet(address, data, buf)
             return
 
-        logging.debug(
-            "Received packet (address = %s:%d, packet_type = \"%s\"",
-            address[0], address[1], packet_type)
+        with self.__packet_queue_lock:
+            if self.__packet_queue.is_queued(address, data):
+                # The same packet is already waiting, e.g. the sender has
+                # sent it again => Handles and replies once
+                logging.debug("Coalesce packet (addr = %s:%d)",
+                              address[0], address[1])
+                self.__statistics.increase("packets_coalesced")
+                self.__release_buffer(buf)
+                return
 
-        # Forwards the packet to corresponding module
-        # Sends back the reply of the module
-        logging.debug("Find and call packet handler")
-        if packet_type in self.__handler_list:
-            # Starts a new transaction and calls the packet handler
-            tid = self.__transaction_manager.start()
+            coalescing_key = None
+            if packet_type in self.__coalesced_packets:
+                coalescing_key = self.__coalesce_request(address, data)
+                if coalescing_key is True:
+                    self.__release_buffer(buf)
+                    return
+
+            queued, evicted_item = self.__packet_queue.put(
+                address, data, packet_type, (buf, coalescing_key))
+            if evicted_item is not None:
+                self.__drop_evicted_packet(*evicted_item)
+
+            if not queued:
+                self.__release_buffer(buf)
+                return
+
+            if coalescing_key is not None:
+                self.__coalesced_requests[coalescing_key] = list()
+
+            self.__packet_queue_lock.notify()
+
+    def __submit_internal_packet(self, address, data, buf):
+        """
+        Hands the network's own packet (e.g. gossip probe) to the internal
+        handler threads, so that it does not wait behind the packet handlers
+        and their transactions. At most handler_queue_size of them wait.
+        """
 
-            resp_data = self.__handler_list[packet_type](
-                tid, address, packet_data)
+        with self.__internal_pending_lock:
+            if self.__internal_pending >= self.__handler_queue_size:
+                logging.warning("Too many internal packets, drop packet "
+                                "(addr = %s:%d)", address[0], address[1])
+                self.__statistics.increase("packets_shed")
+                self.__release_buffer(buf)
+                return
 
-            success = self.__transaction_manager.finish(tid)
-            if not success:
-                resp_data = False
+            self.__internal_pending += 1
 
-            # Answers the client
-            logging.debug("Answer the client")
-            resp_json = json.dumps(resp_data)
+        self.__internal_handlers.submit(
+            self.__handle_internal_packet, address, data, buf)
 
+    def __handle_internal_packet(self, address, data, buf):
+        """
+        Handles the network's own packet in an internal handler thread.
+        """
+
+        try:
+            self.__handle_incoming_packet(address, data)
+        except Exception as error:
+            logging.error("Packet handler has failed! (addr = %s:%d, "
+                          "error = %s)", address[0], address[1], error)
+            self.__statistics.increase("handler_errors")
+        finally:
+            self.__release_buffer(buf)
+
+            with self.__internal_pending_lock:
+                self.__internal_pending -= 1
+
+    def __coalesce_request(self, address, data):
+        """
+        Adds the read-only request to the queued request with the same
+        packet type and data, from any sender: the handler is called once
+        and its reply is sent to every sender with their own request
+        identifier (requests_coalesced). Returns True if it has been added,
+        otherwise the coalescing key of the request to queue (None if it
+        cannot be coalesced). Must be called with the queue lock held.
+        """
+
+        try:
+            packet = codec.decode(data)
+        except ValueError:
+            return None
+
+        if packet.kind != codec.PacketKind.Request or \
+                packet.request_id is None:
+            return None
+
+        coalescing_key = (packet.packet_type,
+                          json.dumps(packet.data, sort_keys=True))
+
+        waiting = self.__coalesced_requests.get(coalescing_key)
+        if waiting is None:
+            return coalescing_key
+
+        # A retransmission is answered from the response cache later
+        is_new, _ = self.__response_cache.begin((address, packet.request_id))
+        if not is_new:
+            return None
+
+        logging.debug("Coalesce \"%s\" request (addr = %s:%d)",
+                      packet.packet_type, address[0], address[1])
+        self.__statistics.increase("requests_coalesced")
+        self.__traffic.on_request_received(address, packet.packet_type,
+                                           len(data))
+        waiting.append((address, packet))
+        return True
+
+    def __reply_coalesced_requests(self, waiting, resp):
+        """
+        Sends the reply of the handled request (None if there is none) to
+        the requests which have been coalesced with it.
+        """
+
+        reply = None
+        if resp is not None:
             try:
-                client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                client.settimeout(self.__timeout)
+                reply = codec.decode(resp)
+            except ValueError:
+                reply = None
 
-                # if random.randrange(0, 100) > 50:  # Not part of system
-                client.sendto(resp_json.encode(), address)
-            except OSError:
-                logging.error("Cannot reply! (addr = %s:%d)",
-                              address[0], address[1])
-        else:
-            logging.warning(
-                "Unknown packet! (addr = %s:%d, packet_type = \"%s\")",
-                address[0], address[1], packet_type)
+        for (address, packet) in waiting:
+            key = (address, packet.request_id)
+
+            if reply is None or reply.kind == codec.PacketKind.Request:
+                self.__response_cache.finish(key, None)
+                continue
+
+            waiting_resp = packet.codec.encode(codec.Packet(
+                reply.kind, packet.packet_type, packet.request_id,
+                reply.data))
+
+            # A busy reply is not cached, a retransmission may be admitted
+            self.__response_cache.finish(
+                key, None if reply.kind == codec.PacketKind.Busy
+                else waiting_resp)
+
+            self.__traffic.on_reply_sent(address, packet.packet_type,
+                                         len(waiting_resp))
+            self.__send_reply(address, waiting_resp)
+
+    def __drop_evicted_packet(self, buf, coalescing_key):
+        """
+        Releases the sheddable packet which has been dropped from the queue
+        to make room for a protected one. Must be called with the queue lock
+        held.
+        """
+
+        if coalescing_key is not None:
+            self.__reply_coalesced_requests(
+                self.__coalesced_requests.pop(coalescing_key), None)
+
+        self.__release_buffer(buf)
+
+    def __packet_handler_thread(self):
+        """
+        Thread which takes the incoming packets from the queue and handles
+        them one by one. A packet which has waited longer than the timeout
+        is dropped since the sender has already given up (packets_expired).
+        """
+
+        while True:
+            with self.__packet_queue_lock:
+                entry = self.__packet_queue.get()
+                while entry is None:
+                    self.__packet_queue_lock.wait()
+                    entry = self.__packet_queue.get()
+
+                received_time, address, data, (buf, coalescing_key) = entry
+
+                # The requests arriving from now on wait for the next call
+                waiting = list()
+                if coalescing_key is not None:
+                    waiting = self.__coalesced_requests.pop(coalescing_key)
+
+            start_time = time.time()
+            self.__statistics.add_sample(
+                "queue_wait", start_time - received_time)
+
+            if start_time - received_time > self.__timeout:
+                # The sender does not wait for the reply anymore
+                logging.warning("Packet has waited too long, drop packet "
+                                "(addr = %s:%d)", address[0], address[1])
+                self.__statistics.increase("packets_expired")
+                self.__release_buffer(buf)
+                self.__reply_coalesced_requests(waiting, None)
+                continue
+
+            # A failing packet handler must not stop the handler thread
+            resp = None
+            try:
+                resp = self.__handle_incoming_packet(address, data)
+            except Exception as error:
+                logging.error("Packet handler has failed! (addr = %s:%d, "
+                              "error = %s)", address[0], address[1], error)
+                self.__statistics.increase("handler_errors")
+            finally:
+                self.__release_buffer(buf)
+                self.__reply_coalesced_requests(waiting, resp)
+
+            self.__statistics.add_sample(
+                "handler_time", time.time() - start_time)
+
+    def __release_buffer(self, buf):
+        """
+        Puts the receive buffer back to the pool (if the packet is in one).
+        """
+
+        if buf is not None:
+            self.__buffer_pool.put(buf)
+
+    def __handle_incoming_packet(self, address, data):
+        """
+        Handles the incoming packet and replies the sender. Returns the
+        encoded reply, or None if there is none.
+        """
+
+        resp = self._process_packet(address, data)
+        if resp is not None:
+            self.__send_reply(address, resp)
+
+        return resp
+
+    def __send_reply(self, address, resp):
+        """
+        Sends the encoded reply to the sender of the request.
+        """
+
+        # Answers the client
+        logging.debug("Answer the client")
+
+        try:
+            # Replies from the listening socket, no need to open
+            # a new one for every packet
+            if address[1] == 0:  # AF_UNIX sender
+                self.__sendto(self.__unix_server, resp, address[0], address)
+            else:
+                self.__sendto(self.__server, resp, address)
+        except (OSError, ValueError):
+            logging.error("Cannot reply! (addr = %s:%d)",
+                          address[0], address[1])
+
+
+class PendingRequest(object):
+    """
+    Request which has been sent and is waiting for the reply.
+    All fields are public and directly accessible by the network module.
+    """
+
+    def __init__(self, addr, packet_type, request_id, data):
+        self.addr = addr
+        self.packet_type = packet_type
+        self.request_id = request_id
+        self.data = data
+
+        self.packet_bytes = None
+        self.future = None
+
+        self.sent_time = 0.0
+        self.replied_time = 0.0
+        self.timeout = 0.0
+        self.retries_left = 0
+        self.retransmitted = False
+        self.expired = False
+
+    def on_replied(self, future):
+        """
+        Called when the reply has been received.
+        """
+
+        self.replied_time = time.time()
+
+
+class ResponseCache(object):
+    """
+    Bounded LRU cache of the encoded replies of the recent requests, keyed by
+    (sender address, request identifier). The requests being handled are
+    also tracked so that a duplicate arriving in the meantime is detected.
+
+    Usage: is_new, resp = cache.begin(key)
+        if is_new:
+            resp = <handle the request>
+            cache.finish(key, resp)
+    """
+
+    def __init__(self, capacity):
+        """
+        Initializes a new instance of the network.ResponseCache class.
+
+        @param capacity Maximum number of cached replies (0 disables
+                        the cache)
+        """
+
+        self.__lock = threading.Lock()
+        self.__capacity = capacity
+
+        self.__replies = collections.OrderedDict()  # Key => encoded reply
+        self.__in_progress = set()
+
+    def begin(self, key):
+        """
+        Starts handling the request. Returns (True, None) if the request is
+        new, otherwise (False, cached reply); the cached reply is None if
+        the first copy is still being handled.
+        """
+
+        if self.__capacity <= 0:
+            return True, None
+
+        with self.__lock:
+            if key in self.__in_progress:
+                return False, None
+
+            resp = self.__replies.get(key)
+            if resp is not None:
+                self.__replies.move_to_end(key)
+                return False, resp
+
+            self.__in_progress.add(key)
+            return True, None
+
+    def finish(self, key, resp):
+        """
+        Finishes handling the request and caches the reply (if any).
+        """
+
+        if self.__capacity <= 0:
+            return
+
+        with self.__lock:
+            self.__in_progress.discard(key)
+
+            if resp is None:
+                return
+
+            self.__replies[key] = resp
+            while len(self.__replies) > self.__capacity:
+                self.__replies.popitem(last=False)
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+import enum
+
+
+class BreakerState(enum.IntEnum):
+    """
+    Circuit breaker states:
+      - Closed: the peer is healthy, all requests are sent
+      - Open: the peer is considered dead, requests fail immediately
+      - HalfOpen: one probe request is sent to check if the peer has
+        recovered, the other requests fail immediately
+    """
+
+    Closed = 0
+    Open = 1
+    HalfOpen = 2
+
+
+class PeerHealth(object):
+    """
+    Tracks the health of a peer with a circuit breaker. After a number of
+    consecutive failed requests, the breaker opens and the requests to that
+    peer fail immediately instead of waiting for the timeout. Periodically,
+    one request is let through as a probe; the breaker closes again when the
+    probe succeeds.
+
+    It also estimates the round-trip time of the peer (Jacobson/Karels) to
+    calculate the reply timeout: smoothed RTT + 4 * RTT variance, bounded by
+    the minimum and maximum timeouts. The timeout is doubled after every
+    failure until a new RTT sample is added. Following Karn's algorithm,
+    the caller must not add samples of retransmitted requests since their
+    replies are ambiguous.
+
+    A small minimum timeout lets the timeout follow a fast peer, so that
+    lost packets are retransmitted and dead peers are detected early;
+    a reply delayed beyond it (e.g. a handler waiting for a transaction)
+    costs a retransmission, or a failure for a request which cannot be
+    retransmitted.
+
+    Usage: health = PeerHealth(failure_threshold, probe_period,
+                               min_timeout, max_timeout)
+        if health.allow_request():
+            <send the request, wait for health.get_timeout()>
+            health.on_success() + health.add_rtt_sample(rtt)
+            or health.on_failure()
+    """
+
+    # Gains of the RTT estimator (RFC 6298)
+    RTT_GAIN = 1 / 8
+    RTT_VARIANCE_GAIN = 1 / 4
+
+    def __init__(self, failure_threshold, probe_period,
+                 min_timeout, max_timeout):
+        """
+        Initializes a new instance of the peer_health.PeerHealth class.
+
+        @param failure_threshold Number of consecutive failures which opens
+                                 the breaker (0 disables the breaker)
+        @param probe_period Time between two probes in seconds
+        @param min_timeout Lower bound of the reply timeout in seconds
+        @param max_timeout Upper bound of the reply timeout in seconds, also
+                           the timeout before the first RTT sample
+        """
+
+        self.__lock = threading.Lock()
+
+        self.__failure_threshold = failure_threshold
+        self.__probe_period = probe_period
+        self.__min_timeout = min_timeout
+        self.__max_timeout = max_timeout
+
+        self.__state = BreakerState.Closed
+        self.__failures = 0
+        self.__opened_time = 0.0
+
+        self.__smoothed_rtt = None
+        self.__rtt_variance = None
+        self.__timeout = max_timeout
+
+    def get_state(self):
+        """
+        Returns the current breaker state.
+        """
+
+        with self.__lock:
+            return self.__state
+
+    def get_timeout(self):
+        """
+        Returns the current reply timeout of the peer in seconds.
+        """
+
+        with self.__lock:
+            return self.__timeout
+
+    def get_rtt(self):
+        """
+        Returns the smoothed RTT and the RTT variance of the peer in seconds
+        (None if no sample has been added).
+        """
+
+        with self.__lock:
+            return self.__smoothed_rtt, self.__rtt_variance
+
+    def add_rtt_sample(self, rtt):
+        """
+        Updates the RTT estimation and the timeout with a measured RTT of
+        a request which has not been retransmitted.
+        """
+
+        with self.__lock:
+            if self.__smoothed_rtt is None:
+                self.__smoothed_rtt = rtt
+                self.__rtt_variance = rtt / 2
+            else:
+                self.__rtt_variance += self.RTT_VARIANCE_GAIN * \
+                    (abs(self.__smoothed_rtt - rtt) - self.__rtt_variance)
+                self.__smoothed_rtt += self.RTT_GAIN * \
+                    (rtt - self.__smoothed_rtt)
+
+            timeout = self.__smoothed_rtt + 4 * self.__rtt_variance
+            self.__timeout = min(max(timeout, self.__min_timeout),
+                                 self.__max_timeout)
+
+    def allow_request(self):
+        """
+        Returns whether a request can be sent to the peer now.
+        """
+
+        with self.__lock:
+            if self.__state == BreakerState.Closed:
+                return True
+
+            if self.__state == BreakerState.Open and \
+                    time.time() - self.__opened_time >= self.__probe_period:
+                # Lets this request through as a probe
+                self.__state = BreakerState.HalfOpen
+                return True
+
+            return False
+
+    def on_success(self):
+        """
+        Called when a request to the peer has succeeded.
+        """
+
+        with self.__lock:
+            if self.__state != BreakerState.Closed:
+                logging.info("Peer has recovered, close the breaker")
+
+            self.__state = BreakerState.Closed
+            self.__failures = 0
+
+    def on_failure(self):
+        """
+        Called when a request to the peer has failed (e.g. timeout).
+        """
+
+        with self.__lock:
+            self.__failures += 1
+            self.__timeout = min(self.__timeout * 2, self.__max_timeout)
+
+            if self.__state == BreakerState.HalfOpen or \
+                    (self.__state == BreakerState.Closed and
+                     self.__failure_threshold > 0 and
+                     self.__failures >= self.__failure_threshold):
+                if self.__state == BreakerState.Closed:
+                    logging.warning("Peer has failed %d times, "
+                                    "open the breaker", self.__failures)
+
+                self.__state = BreakerState.Open
+                self.__opened_time = time.time()
@@ -3,9 +3,12 @@ import threading
 import time
 import subprocess
 import sys
+import pickle
+import copy
 from multiprocessing.connection import Listener, Client
 import core
 import transaction
+import metrics
 
 
 class PrimaryBackupSwitchable(object):
@@ -63,6 +66,23 @@ class ProcessPair(object):
           communication. It can be TCP/IP address, UNIX socket (*nix only)
           or Pipe name (Windows only).
         - process_pairs.period: state sending period in seconds (float)
+
+    Replication telemetry (see get_statistics, also readable at runtime
+    with the diagnostics packet of the network module, see
+    network.Network.add_diagnostics):
+        - snapshot_size, snapshot_size.<module>: size of the serialized state
+          in bytes (total and per module)
+        - export_time: time to export the state of all modules, i.e. how
+          long the transaction slot is held by the replication
+        - serialize_time: time to serialize the exported state
+        - ack_latency: time from sending the state to receiving the ACK
+        - apply_time: time for the backup to import the received state
+        - staleness: age of the state when the backup has applied it
+        - failover_detection: time from the last received state to the
+          detection of the primary crash
+        - failover_time: time from the detection of the primary crash to
+          the end of switching to primary mode
+    All times are in seconds.
     """
 
     def __init__(self):
@@ -79,6 +99,9 @@ class ProcessPair(object):
 
         self.__is_channel_created = None
 
+        self.__statistics = metrics.Statistics()
+        self.__last_state_time = None  # Export time of the last applied state
+
     def init(self, config, transaction_manager, arguments):
         """
         Initializes the process pairs controller.
@@ -127,6 +150,22 @@ class ProcessPair(object):
 
         logging.debug("Finish activating process pairs mechanism")
 
+    def get_statistics(self):
+        """
+        Returns the current replication telemetry (see the class description)
+        in serializable format.
+        """
+
+        stats = self.__statistics.get()
+        stats["is_primary"] = self.__is_primary
+
+        # Backup staleness: how old the latest state of the backup is now
+        if not self.__is_primary and self.__last_state_time is not None:
+            stats["gauges"]["state_age"] = \
+                time.time() - self.__last_state_time
+
+        return stats
+
     @staticmethod
     def __create_backup_process():
         """
@@ -228,18 +267,35 @@ class ProcessPair(object):
                             logging.debug(
                                 "Get the current state of all modules")
 
-                            tid = self.__transaction_manager.start()
-                            states = {name: module.export_state(tid)
-                                      for (name, module) in
-                                      self.__module_list.items()}
-                            self.__transaction_manager.finish(tid)
-
-                            # Sends to the backup and waits for acknowledgement
+                            start_time = time.time()
+                            states = self.__take_snapshot()
+                            export_time = time.time()
+
+                            # Serializes each module separately to measure
+                            # the state size of every module. It is done
+                            # outside the transaction to avoid blocking the
+                            # other modules.
+                            data = {name: pickle.dumps(state)
+                                    for (name, state) in states.items()}
+                            serialize_time = time.time()
+
+                            # Sends to the backup and waits for acknowledgement.
+                            # The serialized states are sent as they are, not
+                            # serialized again.
                             logging.debug("Send state to the backup")
-                            conn.send(states)
+                            conn.send({"time": start_time,
+                                       "modules": list(data.keys())})
+                            for module_data in data.values():
+                                conn.send_bytes(module_data)
 
                             logging.debug("Wait for ACK from the backup")
                             _ = conn.recv()
+                            ack_time = time.time()
+
+                            self.__add_snapshot_statistics(
+                                data, export_time - start_time,
+                                serialize_time - export_time,
+                                ack_time - serialize_time)
 
                             # Sleep
                             time.sleep(self.__period)
@@ -247,10 +303,26 @@ class ProcessPair(object):
                 except (ConnectionResetError, BrokenPipeError, EOFError):
                     logging.error("Connection with the backup is down. "
                                   "The backup has been able to crash!")
+                    self.__statistics.increase("connection_lost")
 
                 # Tries to create the backup again
                 self.__create_backup_process()
 
+    def __take_snapshot(self):
+        """
+        Returns a consistent snapshot of the state of all modules. The state
+        is copied in a read-only transaction which holds the transaction slot
+        only for exporting and copying, the snapshot can then be serialized
+        without any lock while the modules continue working.
+        """
+
+        tid = self.__transaction_manager.start(read_only=True)
+        states = {name: copy.deepcopy(module.export_state(tid))
+                  for (name, module) in self.__module_list.items()}
+        self.__transaction_manager.finish(tid)
+
+        return states
+
     def __backup_mode_thread(self):
         """
         Backup mode monitoring thread which receives the current state
@@ -266,7 +338,10 @@ class ProcessPair(object):
                 while True:
                     # Waits for the current state from the primary
                     logging.debug("Wait for state from the primary")
-                    states = conn.recv()
+                    packet = conn.recv()
+                    states = {name: pickle.loads(conn.recv_bytes())
+                              for name in packet["modules"]}
+                    receive_time = time.time()
 
                     # Imports the received state
                     logging.debug(
@@ -277,6 +352,14 @@ class ProcessPair(object):
                         module.import_state(tid, states[name])
                     self.__transaction_manager.finish(tid)
 
+                    self.__last_state_time = packet["time"]
+                    apply_time = time.time()
+                    self.__statistics.increase("states_applied")
+                    self.__statistics.add_sample(
+                        "apply_time", apply_time - receive_time)
+                    self.__statistics.add_sample(
+                        "staleness", apply_time - packet["time"])
+
                     # Sends acknowledgement
                     logging.debug("Send ACK to the primary")
                     conn.send(True)
@@ -285,4 +368,31 @@ class ProcessPair(object):
                           "has been able to crash!")
 
         # Switches to primary mode
+        detect_time = time.time()
+        if self.__last_state_time is not None:
+            self.__statistics.add_sample(
+                "failover_detection", detect_time - self.__last_state_time)
+
         self.__set_primary_backup(True)
+
+        failover_time = time.time() - detect_time
+        self.__statistics.add_sample("failover_time", failover_time)
+        logging.info("Failover has finished in %.3f seconds", failover_time)
+
+    def __add_snapshot_statistics(self, data, export_time, serialize_time,
+                                  ack_latency):
+        """
+        Records the measurements of a state sent to the backup.
+        """
+
+        total_size = 0
+        for (name, module_data) in data.items():
+            self.__statistics.add_sample(
+                "snapshot_size." + name, len(module_data))
+            total_size += len(module_data)
+
+        self.__statistics.increase("states_sent")
+        self.__statistics.add_sample("snapshot_size", total_size)
+        self.__statistics.add_sample("export_time", export_time)
+        self.__statistics.add_sample("serialize_time", serialize_time)
+        self.__statistics.add_sample("ack_latency", ack_latency)
@@ -0,0 +1,79 @@
+import logging
+import asyncio
+import core
+import network
+import async_network
+import transaction
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.INFO)
+
+
+def on_receive_echo(tid, addr, data):
+    """
+    Called when the network module has received an echo packet.
+    Returns the received data back to the sender.
+    """
+
+    logging.debug("From %s:%d: %s", addr[0], addr[1], data)
+    return data
+
+
+def main():
+    """
+    Starts
+    """
+
+    config_0 = core.Configuration("../config/local-test.conf", "floor_0")
+    config_1 = core.Configuration("../config/local-test.conf", "floor_1")
+
+    transaction_manager_0 = transaction.TransactionManager()
+    transaction_manager_1 = transaction.TransactionManager()
+
+    # Node 0 uses the asyncio implementation, node 1 the threaded one
+    network_0 = async_network.AsyncNetwork()
+    network_1 = network.Network()
+
+    network_0.init(config_0, transaction_manager_0)
+    network_1.init(config_1, transaction_manager_1)
+
+    network_0.add_packet_handler("echo", on_receive_echo)
+    network_1.add_packet_handler("echo", on_receive_echo)
+
+    tid_0 = transaction_manager_0.start()
+    network_0.start(tid_0)
+    transaction_manager_0.finish(tid_0)
+
+    tid_1 = transaction_manager_1.start()
+    network_1.start(tid_1)
+    transaction_manager_1.finish(tid_1)
+
+    address_0 = network_0.__dict__["_Network__address"]
+    address_1 = network_1.__dict__["_Network__address"]
+
+    # Sends echo packet from 0 to 1 and from 1 to 0, expects the same reply
+    msg = "Haha"
+    resp_0 = network_0.send_packet(address_1, "echo", msg)
+    resp_1 = network_1.send_packet(address_0, "echo", msg)
+    if resp_0 == msg and resp_1 == msg:
+        print("PASS 1")
+    else:
+        print("FAIL 1")
+
+    # Sends many echo packets at the same time from the event loop
+    async def send_all():
+        return await asyncio.gather(
+            *[network_0.send_packet_async(address_1, "echo", index)
+              for index in range(50)])
+
+    loop = async_network.AsyncNetwork.get_event_loop()
+    resp = asyncio.run_coroutine_threadsafe(send_all(), loop).result()
+    if resp == list(range(50)):
+        print("PASS 2")
+    else:
+        print("FAIL 2")
+
+if __name__ == "__main__":
+    main()
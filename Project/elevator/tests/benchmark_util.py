@@ -0,0 +1,40 @@
+import tempfile
+import core
+import network
+import transaction
+
+
+def write_config(lines):
+    """
+    Writes the configuration lines into a temporary file, returns the path
+    of the file. The caller removes the file.
+    """
+
+    config_file = tempfile.NamedTemporaryFile(
+        "w", suffix=".conf", delete=False)
+    config_file.write("\n".join(lines) + "\n")
+    config_file.close()
+
+    return config_file.name
+
+
+def start_network(path, node_name, handlers=None):
+    """
+    Starts the network module of the node with the packet handlers
+    (packet type => handler).
+    """
+
+    config = core.Configuration(path, node_name)
+    transaction_manager = transaction.TransactionManager()
+
+    _network = network.Network()
+    _network.init(config, transaction_manager)
+
+    for (packet_type, handler) in (handlers or dict()).items():
+        _network.add_packet_handler(packet_type, handler)
+
+    tid = transaction_manager.start()
+    _network.start(tid)
+    transaction_manager.finish(tid)
+
+    return _network
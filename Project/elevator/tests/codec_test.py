@@ -0,0 +1,130 @@
+import logging
+import timeit
+import core
+import codec
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.INFO)
+
+
+# (packet type, request data, reply data) of the known packets
+PACKETS = [
+    ("elev_state_get",
+     {"floor": 2},
+     {"position": 3, "direction": core.Direction.Down,
+      "serving_requests": [core.Direction.Up, core.Direction.Down],
+      "motor_stuck": False}),
+    ("elev_request_add",
+     {"floor": 1, "direction": core.Direction.Up},
+     True),
+    ("floor_request_served",
+     {"elevator": 2, "direction": core.Direction.Down},
+     True),
+    ("floor_get_all_requests",
+     True,
+     [True, False]),
+    ("elev_state_subscribe",
+     {"floor": 0},
+     {"position": 1, "direction": core.Direction.Stop,
+      "serving_requests": [], "motor_stuck": True}),
+    ("floor_elev_state_push",
+     {"elevator": 1, "position": 2, "direction": core.Direction.Up,
+      "serving_requests": [core.Direction.Up], "motor_stuck": False},
+     True),
+    ("echo",
+     "Haha",
+     "Haha"),
+]
+
+
+def round_trip(_codec, kind, packet_type, data):
+    """
+    Encodes and decodes the packet, returns the decoded packet and the size
+    of the encoded packet.
+    """
+
+    packet = codec.Packet(kind, packet_type, 12345, data)
+    packet_bytes = _codec.encode(packet)
+
+    return codec.decode(packet_bytes), len(packet_bytes)
+
+
+def main():
+    """
+    Starts
+    """
+
+    json_codec = codec.get_codec("json")
+    binary_codec = codec.get_codec("binary")
+
+    # Encodes and decodes all the known packets with both codecs,
+    # expects the same data
+    ok = True
+    for (packet_type, request, reply) in PACKETS:
+        for _codec in (json_codec, binary_codec):
+            decoded, size = round_trip(
+                _codec, codec.PacketKind.Request, packet_type, request)
+            ok = ok and decoded.packet_type == packet_type \
+                and decoded.request_id == 12345 and decoded.data == request \
+                and decoded.codec is _codec
+
+            decoded, size = round_trip(
+                _codec, codec.PacketKind.Reply, packet_type, reply)
+            ok = ok and decoded.kind == codec.PacketKind.Reply \
+                and decoded.data == reply
+
+            print("%-24s %-6s reply: %3d bytes" %
+                  (packet_type, _codec.name, size))
+
+    print("PASS 1" if ok else "FAIL 1")
+
+    # Failed transaction (False reply) does not fit the fixed layout
+    decoded, _ = round_trip(binary_codec, codec.PacketKind.Reply,
+                            "elev_state_get", False)
+    if decoded.data is False:
+        print("PASS 2")
+    else:
+        print("FAIL 2")
+
+    # Wrong format
+    try:
+        codec.decode(b"\xb7\x00")
+        print("FAIL 3")
+    except ValueError:
+        print("PASS 3")
+
+    # Packet type of a request without decoding it, none for a reply
+    ok = True
+    for _codec in (json_codec, binary_codec):
+        request = _codec.encode(codec.Packet(
+            codec.PacketKind.Request, "elev_request_add", 1,
+            {"floor": 2, "direction": 0}))
+        reply = _codec.encode(codec.Packet(
+            codec.PacketKind.Reply, "elev_request_add", 1, True))
+        ok = ok and \
+            codec.peek_packet_type(request) == "elev_request_add" and \
+            codec.peek_packet_type(reply) is None
+    print("PASS 4" if ok else "FAIL 4")
+
+    # Busy reply of a request which has not been admitted
+    ok = True
+    for _codec in (json_codec, binary_codec):
+        for packet_type in ("elev_state_get", "echo"):
+            decoded, _ = round_trip(_codec, codec.PacketKind.Busy,
+                                    packet_type, None)
+            ok = ok and decoded.kind == codec.PacketKind.Busy and \
+                decoded.request_id == 12345 and decoded.data is None
+    print("PASS 5" if ok else "FAIL 5")
+
+    # Encoding + decoding time of the state polling reply
+    for _codec in (json_codec, binary_codec):
+        seconds = timeit.timeit(
+            lambda: round_trip(_codec, codec.PacketKind.Reply,
+                               PACKETS[0][0], PACKETS[0][2]),
+            number=10000)
+        print("%s: %.2f us per packet" % (_codec.name, seconds * 100))
+
+if __name__ == "__main__":
+    main()
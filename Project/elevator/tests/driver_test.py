@@ -42,6 +42,8 @@ def main():
     drv.set_motor_direction(1)
 
     while True:
+        drv.wait_for_inputs()
+
         if drv.get_floor_sensor_signal() == 3:
             drv.set_motor_direction(-1)
         elif drv.get_floor_sensor_signal() == 0:
@@ -0,0 +1,92 @@
+import logging
+import time
+import metrics
+import fragmentation
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.ERROR)
+
+
+ADDRESS = ("127.0.0.1", 15000)
+
+DATAGRAM_SIZE = 64
+
+PACKET = bytes(range(256)) * 2
+
+
+def reassemble(reassembler, fragments):
+    """
+    Adds the fragments in the specified order, returns the list of the
+    packets which have been put together.
+    """
+
+    packets = list()
+    for fragment in fragments:
+        packet = reassembler.add(ADDRESS, fragment)
+        if packet is not None:
+            packets.append(packet)
+
+    return packets
+
+
+def main():
+    """
+    Starts
+    """
+
+    fragmenter = fragmentation.Fragmenter(DATAGRAM_SIZE)
+
+    # A small packet is sent as it is, a large one is split into fragments
+    # which fit into a datagram
+    fragments = fragmenter.split(PACKET)
+    ok = fragmenter.split(b"small") == [b"small"] and len(fragments) > 1 \
+        and all(fragmentation.is_fragment(fragment) and
+                len(fragment) <= DATAGRAM_SIZE for fragment in fragments)
+    print("PASS 1" if ok else "FAIL 1")
+
+    # The fragments are put together whatever their order, duplicates are
+    # ignored
+    statistics = metrics.Statistics()
+    reassembler = fragmentation.Reassembler(1.0, 1 << 20, statistics)
+    ok = reassemble(reassembler, fragments) == [PACKET] and \
+        reassemble(reassembler, fragments[::-1]) == [PACKET] and \
+        reassemble(reassembler, fragments[1:] + fragments[:2]) == [PACKET]
+    print("PASS 2" if ok else "FAIL 2")
+
+    # Nothing comes out while a fragment is missing, the packet comes out
+    # once it arrives
+    fragments = fragmenter.split(PACKET)
+    ok = reassemble(reassembler, fragments[:-1]) == [] and \
+        reassemble(reassembler, fragments[-1:]) == [PACKET]
+    print("PASS 3" if ok else "FAIL 3")
+
+    # The fragments of an incomplete packet expire, a late fragment does
+    # not complete it
+    reassembler = fragmentation.Reassembler(0.1, 1 << 20, statistics)
+    fragments = fragmenter.split(PACKET)
+    reassemble(reassembler, fragments[:-1])
+    time.sleep(0.2)
+    ok = reassemble(reassembler, fragments[-1:]) == [] and \
+        statistics.get_counter("fragments_expired") == 1
+    print("PASS 4" if ok else "FAIL 4")
+
+    # The oldest incomplete packets are dropped when they take too much
+    # memory
+    reassembler = fragmentation.Reassembler(1.0, len(PACKET), statistics)
+    first = fragmenter.split(PACKET)
+    second = fragmenter.split(PACKET)
+    reassemble(reassembler, first[:-1] + second[:-1])
+    ok = statistics.get_counter("fragments_dropped") == 1 and \
+        reassemble(reassembler, first[-1:] + second[-1:]) == [PACKET]
+    print("PASS 5" if ok else "FAIL 5")
+
+    # Fragments in wrong format are ignored
+    ok = reassembler.add(ADDRESS, bytes([fragmentation.MAGIC, 1])) is None \
+        and reassembler.add(ADDRESS, fragmentation.HEADER.pack(
+            fragmentation.MAGIC, 1, 3, 2)) is None
+    print("PASS 6" if ok else "FAIL 6")
+
+if __name__ == "__main__":
+    main()
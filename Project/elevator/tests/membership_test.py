@@ -0,0 +1,118 @@
+import logging
+import time
+import metrics
+import membership
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.ERROR)
+
+
+ADDRESSES = [("127.0.0.1", 15500 + index) for index in range(4)]
+
+
+class Group(object):
+    """
+    Members of a gossip group connected in-process, without network. The
+    messages to the partitioned members are lost.
+    """
+
+    def __init__(self):
+        self.members = dict()
+        self.partition = set()
+
+        for address in ADDRESSES:
+            self.members[address] = membership.Membership(
+                address, ADDRESSES, period=0.02, ack_timeout=0.01,
+                indirect_probes=2, suspect_timeout=0.1, retransmit_mult=3,
+                statistics=metrics.Statistics())
+
+    def start(self):
+        for member in self.members.values():
+            member.start(self.send_packets)
+
+    def send_packets(self, packet_list, timeout):
+        resp_list = list()
+
+        for (addr, packet_type, data) in packet_list:
+            addr = tuple(addr)
+            if addr in self.partition or tuple(data["from"]) in \
+                    self.partition:
+                resp_list.append(False)
+            elif packet_type == "network_gossip_ping":
+                resp_list.append(self.members[addr].on_ping_received(data))
+            else:
+                resp_list.append(
+                    self.members[addr].on_ping_req_received(data))
+
+        return resp_list
+
+
+def wait_for_state(member, addr, state, timeout=2.0):
+    """
+    Waits until the member sees the other member in the state, returns
+    whether it has happened in time.
+    """
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if member.get_state(addr) == state:
+            return True
+        time.sleep(0.01)
+
+    return False
+
+
+def main():
+    """
+    Starts
+    """
+
+    node_a, node_b = ADDRESSES[0], ADDRESSES[1]
+
+    # A dead member is detected and comes back after the partition heals
+    group = Group()
+    group.start()
+    group.partition.add(node_b)
+    ok = wait_for_state(group.members[node_a], node_b,
+                        membership.MemberState.Dead)
+    group.partition.clear()
+    ok = ok and wait_for_state(group.members[node_a], node_b,
+                               membership.MemberState.Alive)
+    print("PASS 1" if ok else "FAIL 1")
+
+    # A stale death (older incarnation than the member's own) heard after
+    # the member has stopped announcing that it is alive is fixed by the
+    # direct probes
+    group = Group()
+    group.start()
+    time.sleep(0.5)
+
+    # B has refuted a suspicion that A has not heard of
+    incarnation = group.members[node_b]._Membership__incarnation
+    group.members[node_b]._Membership__incarnation += 50
+
+    stale = {"from": list(ADDRESSES[2]), "incarnation": 0,
+             "updates": [[node_b[0], node_b[1],
+                          int(membership.MemberState.Dead), incarnation]]}
+    group.members[node_a].on_ping_received(stale)
+    ok = group.members[node_a].get_state(node_b) == \
+        membership.MemberState.Dead
+    ok = ok and wait_for_state(group.members[node_a], node_b,
+                               membership.MemberState.Alive)
+    print("PASS 2" if ok else "FAIL 2")
+
+    # Messages which are not well-formed are ignored
+    group = Group()
+    broken = {"from": list(ADDRESSES[2]),
+              "updates": [[node_b[0], node_b[1], 7, 1]]}
+    ok = group.members[node_a].on_ping_received(broken) is False and \
+        group.members[node_a].on_ping_req_received(
+            {"from": list(ADDRESSES[2]), "updates": []}) is False and \
+        group.members[node_a].get_state(node_b) == \
+        membership.MemberState.Alive
+    print("PASS 3" if ok else "FAIL 3")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import logging
+import os
+import time
+import core
+import benchmark_util
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.ERROR)
+
+
+FLOOR_COUNTS = [1, 2, 4, 8, 16]
+ROUNDS = 200
+
+STATE = {"elevator": 0, "position": 2, "direction": core.Direction.Up,
+         "serving_requests": [core.Direction.Up], "motor_stuck": False}
+
+
+def write_config(floor_number):
+    """
+    Writes the configuration of one elevator and the floor panels on
+    the loopback interface, returns the path of the file.
+    """
+
+    lines = [
+        "[network]",
+        "timeout = 0.5",
+        "codec = binary",
+        "multicast_group = 239.255.42.1",
+        "multicast_port = 14800",
+        "multicast_interface = 127.0.0.1",
+        "[network.elevator_0]",
+        "port = 14750",
+    ]
+    for floor in range(floor_number):
+        lines += ["[network.floor_%d]" % floor, "port = %d" % (14700 + floor)]
+
+    return benchmark_util.write_config(lines)
+
+
+def make_state_handlers(received):
+    """
+    Returns the packet handlers of a floor panel, which count the received
+    state packets in the `received` list.
+    """
+
+    def on_state_received(tid, addr, data):
+        received[0] += 1
+        return True
+
+    return {"floor_elev_state_push": on_state_received,
+            "floor_elev_state_announce": on_state_received}
+
+
+def main():
+    """
+    Starts
+    """
+
+    path = write_config(max(FLOOR_COUNTS))
+
+    received = [0]
+    elevator = benchmark_util.start_network(path, "elevator_0")
+    floor_address = [("127.0.0.1", 14700 + floor)
+                     for floor in range(max(FLOOR_COUNTS))]
+    for floor in range(max(FLOOR_COUNTS)):
+        benchmark_util.start_network(path, "floor_%d" % floor,
+                                     make_state_handlers(received))
+
+    # Cost of one state change at the elevator: one push (and its
+    # acknowledgement) per floor panel, or one multicast announcement for
+    # the whole building
+    print("floors  unicast (ms)  datagrams  multicast (ms)  datagrams")
+    for floor_number in FLOOR_COUNTS:
+        packet_list = [(addr, "floor_elev_state_push", STATE)
+                       for addr in floor_address[:floor_number]]
+
+        start_time = time.time()
+        for _ in range(ROUNDS):
+            elevator.send_packets(packet_list)
+        unicast_time = (time.time() - start_time) / ROUNDS
+
+        start_time = time.time()
+        for _ in range(ROUNDS):
+            elevator.publish_packet("floor_elev_state_announce", STATE)
+        multicast_time = (time.time() - start_time) / ROUNDS
+
+        print("%6d  %12.3f  %9d  %14.3f  %9d" %
+              (floor_number, unicast_time * 1000, floor_number * 2,
+               multicast_time * 1000, 1))
+
+    time.sleep(0.5)
+    statistics = elevator.get_statistics()["counters"]
+    print("Received: %d, retransmissions: %d" %
+          (received[0], statistics.get("retransmissions", 0)))
+
+    os.remove(path)
+
+if __name__ == "__main__":
+    main()
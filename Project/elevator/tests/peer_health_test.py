@@ -0,0 +1,70 @@
+import logging
+import time
+import peer_health
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.ERROR)
+
+
+def main():
+    """
+    Starts
+    """
+
+    # The breaker opens after the failure threshold and rejects requests
+    health = peer_health.PeerHealth(3, 0.2, 0.05, 0.5)
+    for _ in range(2):
+        health.on_failure()
+    ok = health.get_state() == peer_health.BreakerState.Closed and \
+        health.allow_request()
+    health.on_failure()
+    ok = ok and health.get_state() == peer_health.BreakerState.Open and \
+        not health.allow_request()
+    print("PASS 1" if ok else "FAIL 1")
+
+    # After the probe period, one probe request is let through
+    time.sleep(0.25)
+    ok = health.allow_request() and \
+        health.get_state() == peer_health.BreakerState.HalfOpen and \
+        not health.allow_request()
+    print("PASS 2" if ok else "FAIL 2")
+
+    # A failed probe opens the breaker again for another probe period
+    health.on_failure()
+    ok = health.get_state() == peer_health.BreakerState.Open and \
+        not health.allow_request()
+    print("PASS 3" if ok else "FAIL 3")
+
+    # A successful probe closes the breaker and resets the failures
+    time.sleep(0.25)
+    health.allow_request()
+    health.on_success()
+    ok = health.get_state() == peer_health.BreakerState.Closed and \
+        health.allow_request()
+    health.on_failure()
+    ok = ok and health.get_state() == peer_health.BreakerState.Closed
+    print("PASS 4" if ok else "FAIL 4")
+
+    # A threshold of 0 disables the breaker
+    health = peer_health.PeerHealth(0, 0.2, 0.05, 0.5)
+    for _ in range(10):
+        health.on_failure()
+    ok = health.get_state() == peer_health.BreakerState.Closed and \
+        health.allow_request()
+    print("PASS 5" if ok else "FAIL 5")
+
+    # The timeout follows the RTT within its bounds
+    health = peer_health.PeerHealth(3, 0.2, 0.05, 0.5)
+    ok = health.get_timeout() == 0.5
+    for _ in range(20):
+        health.add_rtt_sample(0.001)
+    ok = ok and health.get_timeout() == 0.05
+    for _ in range(20):
+        health.add_rtt_sample(1.0)
+    ok = ok and health.get_timeout() == 0.5
+    print("PASS 6" if ok else "FAIL 6")
+
+if __name__ == "__main__":
+    main()
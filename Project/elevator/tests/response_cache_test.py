@@ -0,0 +1,62 @@
+import logging
+import network
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.ERROR)
+
+
+ADDRESS = ("127.0.0.1", 15000)
+
+
+def handle(cache, request_id, resp):
+    """
+    Handles a new request and caches its reply.
+    """
+
+    key = (ADDRESS, request_id)
+    cache.begin(key)
+    cache.finish(key, resp)
+
+
+def main():
+    """
+    Starts
+    """
+
+    # A duplicate gets the cached reply, or nothing while the first copy
+    # is still being handled
+    cache = network.ResponseCache(2)
+    ok = cache.begin((ADDRESS, 1)) == (True, None) and \
+        cache.begin((ADDRESS, 1)) == (False, None)
+    cache.finish((ADDRESS, 1), b"reply 1")
+    ok = ok and cache.begin((ADDRESS, 1)) == (False, b"reply 1") and \
+        cache.begin((("127.0.0.1", 15001), 1)) == (True, None)
+    print("PASS 1" if ok else "FAIL 1")
+
+    # The least recently used reply is evicted when the cache is full
+    cache = network.ResponseCache(2)
+    handle(cache, 1, b"reply 1")
+    handle(cache, 2, b"reply 2")
+    cache.begin((ADDRESS, 1))  # 2 is now the least recently used
+    handle(cache, 3, b"reply 3")
+    ok = cache.begin((ADDRESS, 1)) == (False, b"reply 1") and \
+        cache.begin((ADDRESS, 3)) == (False, b"reply 3") and \
+        cache.begin((ADDRESS, 2)) == (True, None)
+    print("PASS 2" if ok else "FAIL 2")
+
+    # A request without reply is not cached, it can be handled again
+    cache = network.ResponseCache(2)
+    handle(cache, 1, None)
+    ok = cache.begin((ADDRESS, 1)) == (True, None)
+    print("PASS 3" if ok else "FAIL 3")
+
+    # A capacity of 0 disables the cache
+    cache = network.ResponseCache(0)
+    handle(cache, 1, b"reply 1")
+    ok = cache.begin((ADDRESS, 1)) == (True, None)
+    print("PASS 4" if ok else "FAIL 4")
+
+if __name__ == "__main__":
+    main()
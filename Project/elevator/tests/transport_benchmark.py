@@ -0,0 +1,77 @@
+import logging
+import os
+import time
+import benchmark_util
+
+
+logging.basicConfig(format="%(levelname)8s | %(asctime)s : %(message)s"
+                    " (%(module)s.%(funcName)s)",
+                    level=logging.ERROR)
+
+
+ROUNDS = 2000
+
+DATA = {"floor": 2, "direction": 0}
+
+
+def write_config(transport_name, port):
+    """
+    Writes the configuration of two nodes using the transport, returns the
+    path of the file.
+    """
+
+    lines = [
+        "[network]",
+        "timeout = 0.5",
+        "codec = json",
+        "transport = %s" % transport_name,
+        "[network.client]",
+        "port = %d" % port,
+        "[network.server]",
+        "port = %d" % (port + 1),
+    ]
+
+    return benchmark_util.write_config(lines)
+
+
+def start_network(path, node_name):
+    """
+    Starts the network module of the node with an echo packet handler.
+    """
+
+    return benchmark_util.start_network(
+        path, node_name, {"echo": lambda tid, addr, data: data})
+
+
+def main():
+    """
+    Measures the round trip of a request over UDP and over the loopback
+    transport. The packet handler does nothing, so the difference is the
+    cost of the encoding and the sockets.
+    """
+
+    print("transport  round trip (us)  rtt p50 (us)  rtt p99 (us)")
+    for (transport_name, port) in [("udp", 14900), ("loopback", 14910)]:
+        path = write_config(transport_name, port)
+
+        client = start_network(path, "client")
+        start_network(path, "server")
+        server_address = ("127.0.0.1", port + 1)
+
+        start_time = time.time()
+        for _ in range(ROUNDS):
+            assert client.send_packet(server_address, "echo", DATA) == DATA
+        round_trip = (time.time() - start_time) / ROUNDS
+
+        # Round trip measured by the network module itself
+        rtt = client.get_peer_statistics()["127.0.0.1:%d" % (port + 1)][
+            "echo"]["samples"]["rtt"]
+
+        print("%9s  %15.1f  %12.1f  %12.1f" %
+              (transport_name, round_trip * 1000000, rtt["p50"] * 1000000,
+               rtt["p99"] * 1000000))
+
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
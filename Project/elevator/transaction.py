@@ -12,9 +12,14 @@ class TransactionManager(object):
         self.__lock = threading.Condition()
         self.__transaction_list = dict()
 
-    def start(self):
+    def start(self, read_only=False):
         """
         Starts new transaction, returns the new transaction identifier.
+
+        A read-only transaction only reads the state of the resources (e.g.
+        to take a consistent snapshot of the system). The resources do not
+        keep their previous state for rollback and skip the side effects of
+        committing, so that the transaction can finish quickly.
         """
 
         self.__lock.acquire()
@@ -34,7 +39,7 @@ class TransactionManager(object):
 
         # Adds the transaction to the list
         logging.debug("New transaction identifier: %s", str(new_id))
-        self.__transaction_list[new_id] = Transaction(new_id)
+        self.__transaction_list[new_id] = Transaction(new_id, read_only)
 
         logging.debug("Finish creating new transaction")
         self.__lock.release()
@@ -63,6 +68,23 @@ class TransactionManager(object):
             tid, type(resource))
         self.__lock.release()
 
+    def is_read_only(self, tid):
+        """
+        Returns whether the specified transaction is read-only.
+        """
+
+        self.__lock.acquire()
+
+        read_only = False
+        if tid in self.__transaction_list:
+            read_only = self.__transaction_list[tid].read_only
+        else:
+            logging.error("Transaction not found! (tid = %s)", tid)
+
+        self.__lock.release()
+
+        return read_only
+
     def finish(self, tid):
         """
         Finishes the specified transaction. If all actions have been done
@@ -111,17 +133,37 @@ class TransactionManager(object):
 
         return can_commit
 
+    def abort(self, tid):
+        """
+        Aborts the specified transaction without asking the resources, e.g.
+        when the packet handler has raised an exception.
+        """
+
+        self.__lock.acquire()
+        logging.error("Abort the transaction (tid = %s)", tid)
+
+        transaction = self.__transaction_list.pop(tid, None)
+        if transaction is not None:
+            for resource in transaction.resources:
+                resource.abort(tid)
+        else:
+            logging.error("Transaction not found! (tid = %s)", tid)
+
+        self.__lock.notifyAll()
+        self.__lock.release()
+
 
 class Transaction(object):
     """
-    Transaction information including unique identifier and list of joint
-    resource managers.
+    Transaction information including unique identifier, list of joint
+    resource managers and whether the transaction is read-only.
     """
 
-    def __init__(self, tid):
+    def __init__(self, tid, read_only=False):
 
         # All data are public and directly accessible by transaction manager
         self.tid = tid
+        self.read_only = read_only
         self.resources = set()
 
 
@@ -0,0 +1,176 @@
+import logging
+import copy
+import random
+import threading
+import concurrent.futures
+
+
+class LoopbackTransport(object):
+    """
+    In-process transport between the network modules of the same process,
+    e.g. all the nodes of a building started by one test. A request is
+    passed to the receiver as Python objects, without encoding and without
+    sockets, and handled by the receiver as a request received from the
+    network (new transaction of the receiver, duplicate suppression). The
+    data is copied both ways, so the nodes never share objects.
+
+    The network modules are registered by their configured address. The
+    requests to an address which is not registered are not handled by this
+    transport (see is_registered).
+
+    The requests received by a network module are handed to the handler
+    threads of its transport, never handled in the thread of the sender.
+    The requests of the urgent packet types (e.g. the gossip probes) have
+    their own threads, so that they do not wait behind the others.
+
+    Optionally, a one-way latency and a loss rate are emulated, so that the
+    timeouts and retransmissions still work as over a real network.
+
+    Usage: transport = LoopbackTransport(latency, loss, handler_threads,
+                                         urgent_threads)
+        transport.register(address, receive_func, urgent_packets)
+        # receive_func(src_address, request_id, packet_type, data, reply)
+        # is called in a handler thread, calls reply(resp_data) when the
+        # request has been handled
+        if transport.is_registered(addr):
+            transport.send_request(address, addr, request_id, packet_type,
+                                   data, future)
+    """
+
+    # Address => function submitting the requests to the network module, of
+    # all the network modules in the process
+    __receivers = dict()
+    __receivers_lock = threading.Lock()
+
+    def __init__(self, latency, loss, handler_threads, urgent_threads):
+        """
+        Initializes a new instance of the transport.LoopbackTransport class.
+
+        @param latency One-way delay of the packets in seconds
+        @param loss Probability that a packet is lost (0.0 - 1.0)
+        @param handler_threads Number of threads handling the received
+                               requests
+        @param urgent_threads Number of threads handling the received
+                              requests of the urgent packet types
+        """
+
+        self.__latency = latency
+        self.__loss = loss
+
+        self.__receive = None
+        self.__urgent_packets = frozenset()
+
+        self.__handlers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=handler_threads)
+        self.__urgent_handlers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=urgent_threads)
+
+    def register(self, address, receive_func, urgent_packets=()):
+        """
+        Registers the network module listening to the address, which
+        receives the requests with this transport.
+        """
+
+        logging.debug("Register loopback address %s:%d",
+                      address[0], address[1])
+
+        self.__receive = receive_func
+        self.__urgent_packets = frozenset(urgent_packets)
+
+        with LoopbackTransport.__receivers_lock:
+            LoopbackTransport.__receivers[tuple(address)] = \
+                self.__submit_request
+
+    def unregister(self, address):
+        """
+        Unregisters the network module listening to the address.
+        """
+
+        with LoopbackTransport.__receivers_lock:
+            LoopbackTransport.__receivers.pop(tuple(address), None)
+
+    def is_registered(self, addr):
+        """
+        Returns whether a network module of this process listens to the
+        address.
+        """
+
+        with LoopbackTransport.__receivers_lock:
+            return tuple(addr) in LoopbackTransport.__receivers
+
+    def send_request(self, src_address, addr, request_id, packet_type, data,
+                     future):
+        """
+        Passes the request to the network module listening to the address.
+        The response data is set to the future when the reply arrives; it is
+        never set if the request or the reply is lost.
+        """
+
+        with LoopbackTransport.__receivers_lock:
+            receive_func = LoopbackTransport.__receivers.get(tuple(addr))
+
+        if receive_func is None:
+            raise OSError("Loopback address is not registered")
+
+        if self.__is_lost():
+            logging.debug("Emulate lost request (addr = %s:%d)",
+                          addr[0], addr[1])
+            return
+
+        def reply(resp_data):
+            if self.__is_lost():
+                logging.debug("Emulate lost reply (addr = %s:%d)",
+                              addr[0], addr[1])
+                return
+
+            self.__deliver(self.__set_result, future,
+                           copy.deepcopy(resp_data))
+
+        self.__deliver(receive_func, tuple(src_address), request_id,
+                       packet_type, copy.deepcopy(data), reply)
+
+    def __submit_request(self, src_address, request_id, packet_type, data,
+                         reply):
+        """
+        Hands the request received by the registered network module to
+        a handler thread.
+        """
+
+        if packet_type in self.__urgent_packets:
+            handlers = self.__urgent_handlers
+        else:
+            handlers = self.__handlers
+
+        handlers.submit(self.__receive, src_address, request_id,
+                        packet_type, data, reply)
+
+    def __is_lost(self):
+        """
+        Returns whether the packet is lost (emulated).
+        """
+
+        return self.__loss > 0.0 and random.random() < self.__loss
+
+    def __deliver(self, func, *args):
+        """
+        Calls the function after the emulated latency.
+        """
+
+        if self.__latency > 0.0:
+            timer = threading.Timer(self.__latency, func, args)
+            timer.daemon = True
+            timer.start()
+        else:
+            func(*args)
+
+    @staticmethod
+    def __set_result(future, resp_data):
+        """
+        Sets the response data to the future, unless it has already been
+        replied (e.g. retransmitted request).
+        """
+
+        try:
+            future.set_result(resp_data)
+        except concurrent.futures.InvalidStateError:
+            pass